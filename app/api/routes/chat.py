@@ -1,15 +1,52 @@
+import json
+import time
 from fastapi import APIRouter
+from fastapi.responses import JSONResponse, StreamingResponse
+from starlette.background import BackgroundTask
 from app.schemas.chat import ChatRequest, ChatResponse
-from app.services.rag import rag_engine
-from app.services.memory import SlidingWindowMemory
+from app.services.rag import IndexNotReady, rag_engine
+from app.core.config import settings
+from app.services.backends import PoolSaturated
+from app.services.memory import SlidingWindowMemory, create_memory_backend
+from app.services.metrics import REGISTRY
 
 router = APIRouter()
 
 # Sliding window memory: last 10 turns (user+assistant pairs)
-memory = SlidingWindowMemory(max_turns=10)
+memory = SlidingWindowMemory(
+    max_turns=10,
+    backend=create_memory_backend(
+        settings.MEMORY_BACKEND,
+        storage_dir=settings.storage_dir_path,
+        sqlite_file=settings.MEMORY_SQLITE_FILE,
+        max_sessions=settings.MEMORY_MAX_SESSIONS,
+        idle_ttl_seconds=settings.MEMORY_IDLE_TTL_SECONDS,
+    ),
+)
+
+# One stats() call serves all three gauges of a scrape (SQLite runs queries for it)
+_STATS_MAX_AGE = 1.0
+_stats_snapshot = (float("-inf"), {})  # (taken at, stats), swapped as one tuple
+
+def _memory_stat(key: str) -> float:
+    global _stats_snapshot
+    taken_at, stats = _stats_snapshot
+    now = time.monotonic()
+    if now - taken_at > _STATS_MAX_AGE:
+        stats = memory.stats()
+        _stats_snapshot = (now, stats)
+    return stats[key]
+
+REGISTRY.gauge("rag_memory_sessions", "Sessions held in chat memory", lambda: _memory_stat("sessions"))
+REGISTRY.gauge("rag_memory_messages", "Messages held in chat memory", lambda: _memory_stat("messages"))
+REGISTRY.gauge("rag_memory_bytes", "Approximate bytes of chat memory", lambda: _memory_stat("approx_bytes"))
+
+async def _after_turn(session_id: str) -> None:
+    # runs after the response has been sent (history summary etc.)
+    await rag_engine.after_turn(session_id, await memory.aget(session_id))
 
 @router.post("/chat", response_model=ChatResponse)
-def chat(req: ChatRequest):
+async def chat(req: ChatRequest):
     session_id = (getattr(req, "session_id", None) or "default").strip()
 
     question = (req.question or "").strip()
@@ -17,12 +54,60 @@ def chat(req: ChatRequest):
         return ChatResponse(answer="Information not available.")
 
     # 1) Save user message into memory
-    memory.add_user(session_id, question)
+    await memory.aadd_user(session_id, question)
 
     # 2) Ask RAG with history (we send memory into RAG -> LLM)
-    answer = rag_engine.answer(question, history_messages=memory.get(session_id))
+    reply = await rag_engine.answer_turn(question, history_messages=await memory.aget(session_id), session_id=session_id)
+
+    # 3) Save assistant answer into memory, with the chunks it came from
+    await memory.aadd_assistant(session_id, reply.text, reply.provenance.to_dict() if reply.provenance else None)
+
+    return JSONResponse(
+        ChatResponse(answer=reply.text).model_dump(),
+        background=BackgroundTask(_after_turn, session_id),
+    )
+
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@router.post("/chat/stream")
+async def chat_stream(req: ChatRequest):
+    """
+    Same as /chat, but streams the answer as Server-Sent Events:
+      event: delta  data: {"text": "..."}   (append to the bubble)
+      event: done   data: {"text": "..."}   (final answer, replaces the bubble)
+      event: error  data: {"text": "...", "status": 503}   (LM backends saturated / index not ready)
+    """
+    session_id = (getattr(req, "session_id", None) or "default").strip()
+    question = (req.question or "").strip()
+
+    async def events():
+        if not question:
+            yield _sse("done", {"text": "Information not available."})
+            return
+
+        await memory.aadd_user(session_id, question)
+        history = await memory.aget(session_id)
 
-    # 3) Save assistant answer into memory
-    memory.add_assistant(session_id, answer)
+        provenance = None
+        try:
+            async for kind, value in rag_engine.answer_stream(
+                question, history_messages=history, session_id=session_id
+            ):
+                if kind == "provenance":
+                    provenance = value.to_dict()
+                    continue
+                if kind == "done":
+                    # Save the final answer only once the stream has completed
+                    await memory.aadd_assistant(session_id, value, provenance)
+                yield _sse(kind, {"text": value})
+        except (PoolSaturated, IndexNotReady) as e:
+            # headers are already sent, so report it in-band
+            yield _sse("error", {"text": str(e), "status": 503})
 
-    return ChatResponse(answer=answer)
\ No newline at end of file
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        background=BackgroundTask(_after_turn, session_id) if question else None,
+    )
@@ -0,0 +1,57 @@
+import time
+
+from app.services.metrics import (
+    LATENCY_BUCKETS,
+    REGISTRY,
+    server_timing,
+    start_request_timing,
+    stop_request_timing,
+)
+
+REQUEST_SECONDS = REGISTRY.histogram(
+    "rag_request_seconds", "HTTP request latency (until the body is fully sent)", LATENCY_BUCKETS, ("route", "status")
+)
+
+_ROUTES = ("/api/chat/stream", "/api/chat", "/health", "/ready", "/metrics")
+
+
+def _route(path: str) -> str:
+    # fixed label set: no per-path cardinality from static files or scanners
+    return path if path in _ROUTES else "other"
+
+
+class RequestTimingMiddleware:
+    """
+    Plain ASGI middleware (no BaseHTTPMiddleware task overhead):
+      - records rag_request_seconds per route and status class
+      - collects the timed() stages of the request and, if enabled, sends
+        them as a Server-Timing header. Stages that run after the response
+        has started (streamed answers) are not in the header, only in /metrics.
+    """
+    def __init__(self, app, header: bool = False):
+        self.app = app
+        self.header = header
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        t0 = time.perf_counter()
+        timings: dict = {}
+        token = start_request_timing(timings)
+        status = ["500"]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status[0] = str(message["status"])
+                if self.header:
+                    value = server_timing(timings, time.perf_counter() - t0)
+                    message = {**message, "headers": [*message.get("headers", []), (b"server-timing", value.encode())]}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            stop_request_timing(token)
+            REQUEST_SECONDS.observe(time.perf_counter() - t0, route=_route(scope.get("path", "")), status=status[0][0] + "xx")
@@ -13,19 +13,154 @@ class Settings(BaseSettings):
     MODEL_NAME: str = "qwen2.5-1.5b-instruct"
     EMBED_MODEL: str = "text-embedding-nomic-embed-text-v1.5"
 
+    # HTTP client for LM Studio (shared keep-alive pool)
+    LM_TIMEOUT: float = 120.0
+    LM_CONNECT_TIMEOUT: float = 5.0
+    LM_POOL_TIMEOUT: float = 30.0
+    LM_MAX_CONNECTIONS: int = 64
+    LM_MAX_KEEPALIVE: int = 32
+    LM_KEEPALIVE_EXPIRY: float = 30.0
+
+    # Backend pools (comma-separated base URLs; empty = LM_URL)
+    LM_CHAT_URLS: str = ""
+    LM_EMBED_URLS: str = ""
+    LM_CHAT_MAX_CONCURRENCY: int = 4    # in-flight requests per chat backend
+    LM_EMBED_MAX_CONCURRENCY: int = 8   # in-flight requests per embedding backend
+    LM_MAX_QUEUE: int = 64              # waiters per pool before failing fast (503)
+    LM_QUEUE_TIMEOUT: float = 10.0      # max seconds a request waits for a backend slot
+    LM_FAIL_THRESHOLD: int = 3          # consecutive failures before a backend is ejected
+    LM_EJECT_SECONDS: float = 15.0
+    LM_HEALTH_INTERVAL: float = 10.0    # active /models probes; 0 disables
+
+    # Generation length
+    LM_EARLY_STOP: bool = True          # stream labels / strict answers and cancel once the output is decided
+    LM_CHOICE_CONSTRAINT: str = ""      # constrain label outputs: "" | grammar (llama.cpp) | json_schema (LM Studio)
+    LM_ADAPTIVE_MAX_TOKENS: bool = False  # cap max_tokens per call site by the completion lengths seen there
+    LM_ADAPTIVE_WINDOW: int = 200       # completions remembered per call site
+    LM_ADAPTIVE_QUANTILE: float = 0.99
+    LM_ADAPTIVE_HEADROOM: float = 1.5   # cap = quantile x headroom, at most the call site's own max_tokens
+    LM_ADAPTIVE_MIN_TOKENS: int = 16
+
     KNOWLEDGE_DIR: str = "knowledge"
     KNOWLEDGE_FILES: str = "uniq1.txt,uniq2.txt,uniq3.txt"
     BOT_RULES_FILE: str = "bot_rules.txt"
+    # Comma-separated globs relative to KNOWLEDGE_DIR (e.g. "**/*.txt,**/*.md");
+    # when set, replaces KNOWLEDGE_FILES. Bot rules and intent examples are never indexed.
+    KNOWLEDGE_GLOB: str = ""
 
+    # Ingestion pipeline (startup sync and `python -m app.ingest`)
+    INGEST_WORKERS: int = 1            # chunking processes; 0 = one per CPU core minus one
+    INGEST_EMBED_CONCURRENCY: int = 4  # embedding batches in flight
+    INGEST_BATCH_SIZE: int = 64        # chunks per /embeddings request and per upsert
+
+    # Chunk sizes in CHUNK_UNIT: "chars" or "tokens" (estimated, see tokens.count_tokens)
+    CHUNK_UNIT: str = "chars"
     CHUNK_SIZE: int = 900
     CHUNK_OVERLAP: int = 140
     TOP_K: int = 8
+    # Below this best score a question gets no CONTEXT. In hybrid retrieval a chunk's score is the
+    # higher of its vector similarity and its BM25 term coverage (see RAGEngine._fuse)
     MIN_SIMILARITY: float = 0.35
 
+    # Retrieval: "dense" (vectors only), "hybrid" (BM25 + vectors, reciprocal rank fusion)
+    # or "lexical_first" (hybrid, but a confident BM25 match skips the question embedding).
+    # hybrid/lexical_first also gate on BM25 coverage: revisit MIN_SIMILARITY when switching
+    RETRIEVAL_MODE: str = "dense"
+    RRF_K: int = 60
+    LEXICAL_FIRST_MIN_COVERAGE: float = 0.8  # idf-weighted share of question terms found in the top chunk
+    LEXICAL_FIRST_MIN_TERMS: int = 2         # question terms the index knows
+
+    # Prompt size: CONTEXT gets what is left of PROMPT_TOKEN_BUDGET after
+    # system prompt, history and question (never less than CONTEXT_MIN_TOKENS)
+    PROMPT_TOKEN_BUDGET: int = 3000
+    CONTEXT_MIN_TOKENS: int = 256
+    CHARS_PER_TOKEN: float = 4.0
+
+    # History sent to the LLM. Modes per call site: none | recent | summary | full
+    # (summary = rolling summary of older turns + HISTORY_RECENT_TURNS verbatim; it costs an
+    # extra LLM call per fold and is kept in process memory, so use it only with MEMORY_BACKEND=memory)
+    HISTORY_TOKEN_BUDGET: int = 600
+    HISTORY_RECENT_TURNS: int = 2
+    HISTORY_MODE_CLASSIFIER: str = "recent"
+    HISTORY_MODE_VERIFIER: str = "full"
+    HISTORY_MODE_ANSWERER: str = "full"
+    # Older turns are folded into the summary this many at a time; in between the verbatim
+    # history only grows at the end, so consecutive prompts share a cacheable prefix (0 = every turn)
+    HISTORY_FOLD_TURNS: int = 3
+
     FALLBACK_TEXT: str = "Information not available."
 
+    # LLM-written instructions from the policy flags (app/services/policy.py), added after the
+    # bot rules in every system prompt. Generated once per flags + MODEL_NAME, kept in STORAGE_DIR
+    POLICY_PROMPT_ENABLED: bool = False
+    POLICY_PROMPT_FILE: str = "policy_prompt.json"
+
+    # Local intent routing before the LLM classifier
+    INTENT_ROUTER_ENABLED: bool = True
+    INTENT_EXAMPLES_FILE: str = "intent_examples.json"
+    INTENT_CONFIDENCE_THRESHOLD: float = 0.10
+
+    # Run question embedding + vector query concurrently with intent routing
+    RAG_SPECULATIVE_RETRIEVAL: bool = True
+
+    # Session memory: "memory" (per process) or "sqlite" (shared file in STORAGE_DIR)
+    MEMORY_BACKEND: str = "memory"
+    MEMORY_SQLITE_FILE: str = "memory.sqlite3"
+    MEMORY_MAX_SESSIONS: int = 10000
+    MEMORY_IDLE_TTL_SECONDS: float = 3600.0
+
+    # Semantic answer cache for near-duplicate questions
+    ANSWER_CACHE_ENABLED: bool = True
+    ANSWER_CACHE_SIMILARITY: float = 0.95
+    ANSWER_CACHE_TTL_SECONDS: float = 3600.0
+    ANSWER_CACHE_MAX_ITEMS: int = 1000
+
     STORAGE_DIR: str = "storage"
 
+    # Startup warm-up (background): bot rules + index open/sync, then with WARMUP_LM
+    # the intent example embeddings and a 1-token chat call (model load, keep-alive)
+    WARMUP_ON_STARTUP: bool = True
+    WARMUP_LM: bool = True
+    # Questions that arrive before the index is ready: "wait" (up to NOT_READY_WAIT_SECONDS,
+    # 0 = no limit, then 503), "reject" (503 + Retry-After) or "fallback" (reply NOT_READY_TEXT)
+    NOT_READY_POLICY: str = "wait"
+    NOT_READY_WAIT_SECONDS: float = 30.0
+    NOT_READY_TEXT: str = "The assistant is starting up, please try again in a moment."
+
+    # Index versions (STORAGE_DIR/index): a build goes into a new directory and CURRENT is
+    # flipped atomically; every server process polls CURRENT and swaps between requests
+    INDEX_POLL_INTERVAL: float = 2.0       # seconds; 0 = no hot reload and no clean-up of old versions
+    KNOWLEDGE_WATCH_INTERVAL: float = 0.0  # rebuild when knowledge files change (size/mtime); 0 = off
+    INDEX_LEASE_TTL: float = 60.0          # a process that stops heartbeating its version this long is gone
+    INDEX_SWAP_GRACE: float = 30.0         # keep the previous version open for requests still using it
+    # POST /admin/reindex requires this value in X-Admin-Token; empty disables the endpoint
+    ADMIN_TOKEN: str = ""
+
+    # Add a Server-Timing header (per-stage milliseconds) to every response
+    SERVER_TIMING_HEADER: bool = False
+
+    # Vector backend: "chroma" (persistent ChromaDB) or "numpy" (memory-mapped .npy, brute force)
+    VECTOR_BACKEND: str = "chroma"
+    VECTOR_QUANTIZATION: str = "float32"  # numpy backend only: float32 | int8
+    # Two-stage (Matryoshka) search: scan embeddings cut to their first VECTOR_FIRST_STAGE_DIM
+    # dimensions for VECTOR_FIRST_STAGE_CANDIDATES rows, re-rank those with the full vectors
+    # before TOP_K / MIN_SIMILARITY. 0 = one stage. Needs a Matryoshka model (nomic-embed-text-v1.5: 64..768).
+    VECTOR_FIRST_STAGE_DIM: int = 0
+    VECTOR_FIRST_STAGE_QUANTIZATION: str = "float32"  # numpy backend only: float32 | int8 | binary
+    VECTOR_FIRST_STAGE_CANDIDATES: int = 200
+
+    # Concurrent embedding requests are merged into micro-batches
+    EMBED_BATCH_WINDOW_MS: float = 5.0
+    EMBED_BATCH_MAX: int = 64
+
+    # Concurrent identical questions (same normalised text, equivalent history) share one computation
+    SINGLE_FLIGHT_ENABLED: bool = True
+
+    # Embedding cache (SQLite file inside STORAGE_DIR + in-process LRU)
+    EMBED_CACHE_ENABLED: bool = True
+    EMBED_CACHE_FILE: str = "embed_cache.sqlite3"
+    EMBED_CACHE_MEMORY_ITEMS: int = 4096
+
     @property
     def knowledge_dir_path(self) -> Path:
         return Path(self.KNOWLEDGE_DIR)
@@ -38,4 +173,8 @@ class Settings(BaseSettings):
     def knowledge_files_list(self) -> list[str]:
         return [x.strip() for x in self.KNOWLEDGE_FILES.split(",") if x.strip()]
 
+    @property
+    def knowledge_glob_list(self) -> list[str]:
+        return [x.strip() for x in self.KNOWLEDGE_GLOB.split(",") if x.strip()]
+
 settings = Settings()
\ No newline at end of file
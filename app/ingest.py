@@ -0,0 +1,66 @@
+"""
+Build or update the vector index without starting the web server:
+
+    python -m app.ingest [--workers N] [--embed-concurrency N] [--batch-size N] [--rebuild]
+
+Uses the same settings (.env) as the server, which then starts with
+nothing left to embed. The result is published as a new index version:
+running servers switch to it without a restart.
+"""
+import argparse
+import sys
+import time
+
+from app.core.config import settings
+from app.services.indexing import SyncStats, default_workers
+from app.services.rag import RAGEngine
+
+
+class ProgressReporter:
+    def __init__(self, every_seconds: float = 1.0, stream=sys.stderr):
+        self.every_seconds = every_seconds
+        self.stream = stream
+        self._last = 0.0
+
+    def __call__(self, stats: SyncStats) -> None:
+        now = time.monotonic()
+        # stats.version is only set once the sync has finished
+        if not stats.version and now - self._last < self.every_seconds:
+            return
+        self._last = now
+        elapsed = max(stats.elapsed, 1e-9)
+        self.stream.write(
+            f"\rfiles {stats.files} (changed {stats.changed_files}) | "
+            f"embedded {stats.embedded} chunks | {stats.embedded / elapsed:.1f} chunks/s | "
+            f"{stats.files / elapsed:.1f} files/s"
+        )
+        self.stream.flush()
+
+
+def main(argv: list[str] | None = None) -> int:
+    ap = argparse.ArgumentParser(prog="python -m app.ingest", description="Index the knowledge base.")
+    ap.add_argument("--workers", type=int, default=default_workers(), help="chunking processes (default: CPU cores - 1)")
+    ap.add_argument("--embed-concurrency", type=int, default=settings.INGEST_EMBED_CONCURRENCY)
+    ap.add_argument("--batch-size", type=int, default=settings.INGEST_BATCH_SIZE)
+    ap.add_argument("--rebuild", action="store_true", help="re-index everything into an empty version")
+    args = ap.parse_args(argv)
+
+    engine = RAGEngine()
+    reporter = ProgressReporter()
+    started = time.perf_counter()
+    version = engine.build_index(
+        workers=args.workers,
+        embed_concurrency=args.embed_concurrency,
+        batch_size=args.batch_size,
+        progress=reporter,
+        fresh=args.rebuild,
+    )
+    elapsed = time.perf_counter() - started
+    sys.stderr.write("\n")
+    index_version = engine.store.read_meta(version).get("index_version", "")
+    print(f"index version {index_version} ({version}) ready in {elapsed:.1f}s")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
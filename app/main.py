@@ -1,17 +1,24 @@
+import asyncio
 from pathlib import Path
-from fastapi import FastAPI
-from fastapi.responses import FileResponse
+from fastapi import FastAPI, Header, HTTPException, Request
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse
 from fastapi.staticfiles import StaticFiles
 
 from app.core.config import settings
 from app.api.routes.chat import router as chat_router
-from app.services.rag import rag_engine
+from app.services.rag import IndexNotReady, rag_engine
+from app.services.backends import PoolSaturated
+from app.services.lm_client import aclose_async_client, run_health_checks
+from app.api.timing import RequestTimingMiddleware
+from app.services.metrics import REGISTRY
 
 BASE_DIR = Path(__file__).resolve().parent.parent  # project root (uniq_rag_bot)
 STATIC_DIR = BASE_DIR / "static"
 
 app = FastAPI(title=settings.APP_NAME)
 
+app.add_middleware(RequestTimingMiddleware, header=settings.SERVER_TIMING_HEADER)
+
 # API
 app.include_router(chat_router, prefix="/api")
 
@@ -27,11 +34,70 @@ else:
     def home():
         return {"message": "static/ folder not found. Create static/index.html and static/app.js"}
 
+_background: list[asyncio.Task] = []
+
+@app.exception_handler(PoolSaturated)
+async def _pool_saturated(request: Request, exc: PoolSaturated):
+    # LM backends are at capacity: fail fast instead of piling up requests
+    return JSONResponse({"detail": str(exc)}, status_code=503, headers={"Retry-After": "2"})
+
+@app.exception_handler(IndexNotReady)
+async def _index_not_ready(request: Request, exc: IndexNotReady):
+    return JSONResponse({"detail": str(exc)}, status_code=503, headers={"Retry-After": "5"})
+
 @app.on_event("startup")
-def _startup():
-    # Do not call LM Studio here (prevents startup cancel errors on Windows)
-    pass
+async def _startup():
+    # Index build and LM warm-up run in the background: the server accepts
+    # connections at once and /ready reports when questions can be answered.
+    if settings.WARMUP_ON_STARTUP:
+        _background.append(asyncio.create_task(rag_engine.warm_up(warm_lm=settings.WARMUP_LM)))
+    # Do not call LM Studio here (prevents startup cancel errors on Windows);
+    # health probes only start after the first interval.
+    if settings.LM_HEALTH_INTERVAL > 0:
+        _background.append(asyncio.create_task(run_health_checks(settings.LM_HEALTH_INTERVAL)))
+    # Follow index versions published by other workers / the ingest CLI
+    if settings.INDEX_POLL_INTERVAL > 0:
+        _background.append(asyncio.create_task(
+            rag_engine.watch_index(settings.INDEX_POLL_INTERVAL, settings.KNOWLEDGE_WATCH_INTERVAL)
+        ))
+
+@app.on_event("shutdown")
+async def _shutdown():
+    for t in _background:
+        t.cancel()
+    rag_engine.close_index()
+    await aclose_async_client()
 
 @app.get("/health")
 def health():
-    return {"status": "ok"}
\ No newline at end of file
+    return {
+        "status": "ok",
+        "index_ready": rag_engine.ready,
+        "index_version": rag_engine.index_version,
+    }
+
+@app.get("/ready")
+def ready():
+    # readiness (index open) as opposed to /health (process alive)
+    if rag_engine.ready:
+        return {"status": "ready", "index_version": rag_engine.index_version}
+    status = "failed" if rag_engine.init_error else "starting"
+    return JSONResponse({"status": status, "error": rag_engine.init_error}, status_code=503)
+
+@app.post("/admin/reindex")
+async def admin_reindex(fresh: bool = False, x_admin_token: str = Header(default="")):
+    # Re-sync the knowledge files into a new index version (fresh: re-embed everything);
+    # this worker switches at once, the others within INDEX_POLL_INTERVAL
+    if not settings.ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if x_admin_token != settings.ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Invalid admin token")
+    version = await rag_engine.reindex(fresh=fresh, blocking=False)
+    if version is None:
+        raise HTTPException(status_code=409, detail="An index build is already running")
+    return {"version": version, "index_version": rag_engine.store.read_meta(version).get("index_version", "")}
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    # Prometheus text exposition format
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
@@ -0,0 +1,121 @@
+from __future__ import annotations
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import FrozenSet, Optional
+
+import numpy as np
+
+from app.services.metrics import REGISTRY
+
+CACHE_TOTAL = REGISTRY.counter(
+    "rag_answer_cache_total", "Semantic answer cache lookups", ("result",)
+)
+
+
+@dataclass
+class CachedAnswer:
+    embedding: np.ndarray  # unit float32
+    answer: str
+    chunk_ids: FrozenSet[str]
+    index_version: str
+    history_key: str  # what the answerer saw of the conversation ("" = nothing)
+    created: float
+
+
+class SemanticAnswerCache:
+    """
+    Answer cache for near-duplicate questions, keyed by question embedding.
+    An entry is served only when
+      - cosine(question, cached question) >= similarity_threshold
+      - it is younger than ttl_seconds
+      - it was built from the same index version
+      - the current retrieval returned exactly the same chunk set
+      - the prompt carried the same conversation history (history_key)
+    so a cached answer never uses context the current question would not get,
+    and a follow-up ("how long is it?") is never answered for another conversation.
+    Bounded LRU; entries of an older index version are dropped on sight.
+    """
+    def __init__(self, max_items: int, ttl_seconds: float, similarity_threshold: float):
+        self.max_items = max_items
+        self.ttl_seconds = ttl_seconds
+        self.similarity_threshold = similarity_threshold
+        self._entries: "OrderedDict[int, CachedAnswer]" = OrderedDict()
+        self._next_id = 0
+        self._matrix: Optional[np.ndarray] = None  # stacked embeddings, rebuilt lazily
+        self._matrix_ids: list[int] = []
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _unit(embedding) -> np.ndarray:
+        v = np.asarray(embedding, dtype=np.float32)
+        return v / (np.linalg.norm(v) + 1e-12)
+
+    def _drop(self, entry_id: int) -> None:
+        self._entries.pop(entry_id, None)
+        self._matrix = None
+
+    def lookup(
+        self, embedding, chunk_ids: FrozenSet[str], index_version: str, history_key: str = ""
+    ) -> Optional[str]:
+        q = self._unit(embedding)
+        now = time.monotonic()
+        with self._lock:
+            if self._entries and self._matrix is None:
+                self._matrix_ids = list(self._entries)
+                self._matrix = np.stack([self._entries[i].embedding for i in self._matrix_ids])
+
+            answer = None
+            if self._matrix is not None:
+                sims = self._matrix @ q
+                for j in np.argsort(-sims):
+                    if sims[j] < self.similarity_threshold:
+                        break
+                    eid = self._matrix_ids[int(j)]
+                    e = self._entries.get(eid)
+                    if e is None:
+                        continue
+                    if e.index_version != index_version or now - e.created > self.ttl_seconds:
+                        self._drop(eid)
+                        continue
+                    if e.chunk_ids == chunk_ids and e.history_key == history_key:
+                        self._entries.move_to_end(eid)
+                        answer = e.answer
+                        break
+
+            if answer is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        CACHE_TOTAL.inc(result="hit" if answer is not None else "miss")
+        return answer
+
+    def store(
+        self, embedding, answer: str, chunk_ids: FrozenSet[str], index_version: str, history_key: str = ""
+    ) -> None:
+        entry = CachedAnswer(
+            embedding=self._unit(embedding),
+            answer=answer,
+            chunk_ids=frozenset(chunk_ids),
+            index_version=index_version,
+            history_key=history_key,
+            created=time.monotonic(),
+        )
+        with self._lock:
+            self._entries[self._next_id] = entry
+            self._next_id += 1
+            while len(self._entries) > self.max_items:
+                self._entries.popitem(last=False)
+            self._matrix = None
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._matrix = None
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "items": len(self._entries)}
@@ -0,0 +1,254 @@
+from __future__ import annotations
+import asyncio
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+from typing import AsyncIterator, Iterator, List, Optional
+
+import httpx
+import requests
+
+from app.services.metrics import REGISTRY
+
+BACKEND_REQUESTS = REGISTRY.counter(
+    "rag_lm_backend_requests_total", "Requests sent to LM backends", ("pool", "backend", "result")
+)
+BACKEND_EJECTIONS = REGISTRY.counter(
+    "rag_lm_backend_ejections_total", "Backends taken out of rotation", ("pool", "backend", "reason")
+)
+POOL_REJECTED = REGISTRY.counter(
+    "rag_lm_pool_rejected_total", "Requests failed fast because the pool was saturated", ("pool", "reason")
+)
+
+
+class PoolSaturated(Exception):
+    """No backend capacity within the queue limits; surfaced as HTTP 503."""
+
+
+class Backend:
+    def __init__(self, url: str, max_concurrency: int):
+        self.url = url.rstrip("/")
+        self.max_concurrency = max(1, max_concurrency)
+        self.outstanding = 0
+        self.consecutive_failures = 0
+        self.ejected_until = 0.0
+
+    def available(self, now: float) -> bool:
+        return self.ejected_until <= now
+
+    def has_capacity(self, now: float) -> bool:
+        return self.available(now) and self.outstanding < self.max_concurrency
+
+
+class BackendPool:
+    """
+    OpenAI-compatible servers that can serve the same requests.
+      - least-outstanding-requests balancing
+      - per-backend concurrency limit (a semaphore shared through one condition)
+      - passive health: `fail_threshold` consecutive failures eject a backend
+        for `eject_seconds`; after that it gets traffic again (half-open)
+      - active health: check() probes GET /models
+      - bounded queue: at most `max_queue` waiters, each for at most
+        `queue_timeout` seconds, otherwise PoolSaturated (-> 503)
+    acquire() serves the event loop, acquire_blocking() threads (index
+    builds, the ingest CLI); both draw from the same slots and queue.
+    """
+    def __init__(
+        self,
+        name: str,
+        urls: List[str],
+        max_concurrency: int,
+        max_queue: int,
+        queue_timeout: float,
+        fail_threshold: int = 3,
+        eject_seconds: float = 15.0,
+    ):
+        if not urls:
+            raise ValueError(f"{name} pool needs at least one backend URL")
+        self.name = name
+        self.backends = [Backend(u, max_concurrency) for u in urls]
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.fail_threshold = max(1, fail_threshold)
+        self.eject_seconds = eject_seconds
+        self._waiting = 0
+        # slots, waiters and failure counts change under _lock (threads and the event loop);
+        # _sync_cond wakes waiting threads, the asyncio condition waiting coroutines
+        self._lock = threading.Lock()
+        self._sync_cond = threading.Condition(self._lock)
+        self._cond: asyncio.Condition | None = None
+        self._loop: asyncio.AbstractEventLoop | None = None
+
+    def _condition(self) -> asyncio.Condition:
+        loop = asyncio.get_running_loop()
+        if self._cond is None or self._loop is not loop:
+            self._cond = asyncio.Condition()
+            self._loop = loop
+        return self._cond
+
+    def _pick(self, now: float, need_capacity: bool = True) -> Optional[Backend]:
+        ok = [b for b in self.backends if (b.has_capacity(now) if need_capacity else b.available(now))]
+        if not ok:
+            return None
+        return min(ok, key=lambda b: (b.outstanding / b.max_concurrency, b.outstanding))
+
+    def _take(self) -> Optional[Backend]:
+        """A slot on the best backend with capacity, or None. Caller holds _lock."""
+        backend = self._pick(time.monotonic())
+        if backend is not None:
+            backend.outstanding += 1
+        return backend
+
+    def _enqueue(self) -> None:
+        """Admit one waiter or raise PoolSaturated. Caller holds _lock."""
+        if not any(b.available(time.monotonic()) for b in self.backends):
+            POOL_REJECTED.inc(pool=self.name, reason="no_healthy_backend")
+            raise PoolSaturated(f"no healthy {self.name} backend")
+        if self._waiting >= self.max_queue:
+            POOL_REJECTED.inc(pool=self.name, reason="queue_full")
+            raise PoolSaturated(f"{self.name} queue full")
+        self._waiting += 1
+
+    def _release(self, backend: Backend) -> None:
+        with self._sync_cond:
+            backend.outstanding -= 1
+            self._sync_cond.notify()
+
+    async def _notify_async(self) -> None:
+        cond = self._condition()
+        async with cond:
+            cond.notify()
+
+    def _wake_async(self) -> None:
+        """From a thread: let a coroutine waiting in acquire() look again."""
+        loop = self._loop
+        if self._waiting and loop is not None and not loop.is_closed():
+            try:
+                asyncio.run_coroutine_threadsafe(self._notify_async(), loop)
+            except RuntimeError:
+                pass  # loop shut down meanwhile
+
+    @asynccontextmanager
+    async def acquire(self) -> AsyncIterator[Backend]:
+        cond = self._condition()
+        async with cond:
+            with self._lock:
+                backend = self._take()
+                if backend is None:
+                    self._enqueue()
+            if backend is None:
+                taken: List[Backend] = []
+
+                def ready() -> bool:
+                    with self._lock:
+                        b = self._take()
+                    if b is not None:
+                        taken.append(b)
+                    return b is not None
+
+                try:
+                    await asyncio.wait_for(cond.wait_for(ready), timeout=self.queue_timeout)
+                except asyncio.TimeoutError:
+                    if taken:  # got a slot as the timeout fired: hand it back
+                        self._release(taken[0])
+                    POOL_REJECTED.inc(pool=self.name, reason="queue_timeout")
+                    raise PoolSaturated(f"{self.name} queue timeout") from None
+                finally:
+                    with self._lock:
+                        self._waiting -= 1
+                backend = taken[0]
+
+        try:
+            yield backend
+        finally:
+            self._release(backend)
+            async with cond:
+                cond.notify()
+
+    @contextmanager
+    def acquire_blocking(self) -> Iterator[Backend]:
+        """acquire() for threads: the same slots, queue limit and timeout, waiting in the calling thread."""
+        with self._sync_cond:
+            backend = self._take()
+            if backend is None:
+                self._enqueue()
+                try:
+                    deadline = time.monotonic() + self.queue_timeout
+                    while backend is None:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            POOL_REJECTED.inc(pool=self.name, reason="queue_timeout")
+                            raise PoolSaturated(f"{self.name} queue timeout")
+                        self._sync_cond.wait(remaining)
+                        backend = self._take()
+                finally:
+                    self._waiting -= 1
+
+        try:
+            yield backend
+        finally:
+            self._release(backend)
+            self._wake_async()
+
+    def report(self, backend: Backend, ok: bool) -> None:
+        """Passive health check: called with the outcome of every request."""
+        BACKEND_REQUESTS.inc(pool=self.name, backend=backend.url, result="ok" if ok else "error")
+        with self._lock:
+            if ok:
+                backend.consecutive_failures = 0
+                return
+            backend.consecutive_failures += 1
+            if backend.consecutive_failures >= self.fail_threshold:
+                self._eject(backend, "passive")
+
+    def _eject(self, backend: Backend, reason: str) -> None:
+        # caller holds self._lock
+        backend.ejected_until = time.monotonic() + self.eject_seconds
+        backend.consecutive_failures = 0
+        BACKEND_EJECTIONS.inc(pool=self.name, backend=backend.url, reason=reason)
+
+    async def check(self, client: httpx.AsyncClient, timeout: float = 2.0) -> None:
+        """Active health check: probe every backend once."""
+        async def probe(b: Backend) -> None:
+            try:
+                r = await client.get(f"{b.url}/models", timeout=timeout)
+                healthy = r.status_code < 500
+            except httpx.HTTPError:
+                healthy = False
+            with self._lock:  # report() updates the same health state from request threads
+                if healthy:
+                    if b.ejected_until > time.monotonic():
+                        b.ejected_until = 0.0  # back early
+                else:
+                    self._eject(b, "active")
+
+        await asyncio.gather(*(probe(b) for b in self.backends))
+        with self._sync_cond:
+            self._sync_cond.notify_all()
+        cond = self._condition()
+        async with cond:
+            cond.notify_all()
+
+    def stats(self) -> list[dict]:
+        now = time.monotonic()
+        return [
+            {
+                "url": b.url,
+                "outstanding": b.outstanding,
+                "max_concurrency": b.max_concurrency,
+                "healthy": b.available(now),
+            }
+            for b in self.backends
+        ]
+
+
+def is_backend_failure(exc: BaseException) -> bool:
+    """Errors that say something about the backend (not about our request)."""
+    if isinstance(exc, (httpx.HTTPStatusError, requests.HTTPError)) and exc.response is not None:
+        return exc.response.status_code >= 500 or exc.response.status_code == 429
+    return isinstance(exc, (httpx.TransportError, httpx.TimeoutException, requests.ConnectionError, requests.Timeout))
+
+
+def parse_urls(raw: str, default: str) -> List[str]:
+    urls = [u.strip().rstrip("/") for u in (raw or "").split(",") if u.strip()]
+    return urls or [default.rstrip("/")]
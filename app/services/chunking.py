@@ -1,11 +1,28 @@
 import re
 from dataclasses import dataclass
+from typing import Optional
+
+from app.core.config import settings
+from app.services.tokens import count_tokens
 
 @dataclass
 class Chunk:
     source: str
     chunk_id: int
     text: str
+    # text == normalize_text(source text)[start:end]; -1 when unknown (older index)
+    start: int = -1
+    end: int = -1
+
+CHUNK_UNITS = ("chars", "tokens")
+
+PARAGRAPH, SENTENCE = 2, 1
+
+# Line breaks (a blank line = paragraph) and sentence punctuation followed by spaces
+_BREAK = re.compile(r"\n\s*|[.!?;:\u3002\uff01\uff1f][^\S\n]+")
+_SPACE = re.compile(r"\s")
+_NON_SPACE = re.compile(r"\S")
+_PIECE = re.compile(r"\w+|[^\w\s]")
 
 def _clean_text(t: str) -> str:
     t = t.replace("\r\n", "\n").replace("\r", "\n")
@@ -13,43 +30,187 @@ def _clean_text(t: str) -> str:
     t = re.sub(r"\n{3,}", "\n\n", t).strip()
     return t
 
-def chunk_text(source: str, text: str, chunk_size: int, overlap: int) -> list[Chunk]:
+def normalize_text(t: str) -> str:
+    """The text chunk offsets refer to (line endings and blank lines normalised)."""
+    return _clean_text(t)
+
+class _Text:
+    """
+    Sentence and paragraph breaks of a text, found in one regex pass and
+    stored as parallel lists (plus a final entry for the end of the text):
+      ends[k]   - where the content before break k ends
+      starts[k] - where the content after break k begins
+      levels[k] - PARAGRAPH or SENTENCE
+      sizes[k]  - size of text[:ends[k]] in the chunking unit
+    so the size of any span between two breaks is a subtraction. Inside
+    a sentence, token sizes are counted on from the last position asked
+    for (chunk starts only move forward), so a text without breaks is
+    still counted once.
+    """
+    def __init__(self, text: str, tokens: bool):
+        self.text = text
+        self.tokens = tokens
+        ends, starts, levels, sizes = [], [], [], []
+        prev = 0
+        total = 0
+        for m in _BREAK.finditer(text):
+            a, b = m.span()
+            if text[a] == "\n":
+                while a > prev and text[a - 1] in " \t":
+                    a -= 1
+            else:
+                a += 1  # keep the punctuation
+            if tokens:
+                total += count_tokens(text, prev, a)
+            ends.append(a)
+            starts.append(b)
+            levels.append(PARAGRAPH if text.count("\n", a, b) > 1 else SENTENCE)
+            sizes.append(total if tokens else a)
+            prev = b
+        n = len(text)
+        ends.append(n)
+        starts.append(n)
+        levels.append(PARAGRAPH)
+        sizes.append(total + count_tokens(text, prev, n) if tokens else n)
+        self.ends, self.starts, self.levels, self.sizes = ends, starts, levels, sizes
+        self._at, self._at_size = 0, 0  # a word boundary and the size of text[:_at]
+
+    def size_before(self, pos: int, k: int) -> int:
+        """Size of text[:pos]; k = index of the first break ending after pos."""
+        if not self.tokens:
+            return pos
+        sentence_start = self.starts[k - 1] if k > 0 else 0
+        if not sentence_start <= self._at <= pos:
+            self._at, self._at_size = sentence_start, self.sizes[k - 1] if k > 0 else 0
+        size = self._at_size + count_tokens(self.text, self._at, pos)
+        if pos == 0 or self.text[pos - 1].isspace():
+            # no word spans pos, so counting on from it adds up exactly
+            self._at, self._at_size = pos, size
+        return size
+
+    def _piece_cost(self, m: re.Match) -> int:
+        per = max(1, int(2 * settings.CHARS_PER_TOKEN))
+        return 1 + (m.end() - m.start() - 1) // per  # as in count_tokens
+
+    def fit_end(self, pos: int, budget: int) -> int:
+        """Furthest position p with size(text[pos:p]) <= budget, ignoring word boundaries."""
+        if not self.tokens:
+            return min(len(self.text), pos + budget)
+        per = max(1, int(2 * settings.CHARS_PER_TOKEN))
+        used = 0
+        for m in _PIECE.finditer(self.text, pos):
+            cost = self._piece_cost(m)
+            if used + cost > budget:
+                # a single piece larger than the budget is cut by characters
+                return m.start() if m.start() > pos else m.start() + int(budget * per)
+            used += cost
+        return len(self.text)
+
+    def word_end(self, pos: int, limit: int) -> int:
+        """End of the last whole word in text[pos:limit] (pos if there is none)."""
+        text = self.text
+        if limit >= len(text) or text[limit].isspace():
+            e = limit
+        else:
+            e = max(text.rfind(" ", pos, limit), text.rfind("\n", pos, limit), text.rfind("\t", pos, limit))
+            if e <= pos:
+                return pos
+        while e > pos and text[e - 1].isspace():
+            e -= 1
+        return e
+
+    def next_word(self, pos: int) -> int:
+        """Start of the first word at or after pos."""
+        m = _NON_SPACE.search(self.text, pos)
+        return m.start() if m else len(self.text)
+
+    def overlap_start(self, s: int, e: int, overlap: int) -> Optional[int]:
+        """
+        Start of the longest run of whole words of text[s+1:e] that ends at e
+        and fits in `overlap` (None if not even the last word does).
+        """
+        text = self.text
+        if not self.tokens:
+            m = _SPACE.search(text, max(s + 1, e - overlap) - 1, e)
+            if m is not None:
+                cand = self.next_word(m.end())
+                if cand < e:
+                    return cand
+            return None
+        # walk the words back from e, adding up their tokens
+        back = max(s + 1, e - int(overlap * 2 * settings.CHARS_PER_TOKEN))
+        best = None
+        used = 0
+        for m in reversed(list(_PIECE.finditer(text, back, e))):
+            used += self._piece_cost(m)
+            if used > overlap:
+                break
+            if text[m.start() - 1].isspace():
+                best = m.start()
+        return best
+
+def chunk_text(source: str, text: str, chunk_size: int, overlap: int, unit: str = "chars") -> list[Chunk]:
+    """
+    Pack text into chunks of at most chunk_size (chars or estimated tokens),
+    ending at a paragraph break, else a sentence end, else a word boundary.
+    Each chunk repeats up to `overlap` of the previous one (whole words).
+    Works on offsets and slices each chunk once: linear in the text length.
+    """
+    if unit not in CHUNK_UNITS:
+        raise ValueError(f"Unknown chunk unit: {unit!r}")
     text = _clean_text(text)
     if not text:
         return []
 
-    # Split by paragraphs first, then pack into chunks
-    paras = [p.strip() for p in text.split("\n\n") if p.strip()]
+    chunk_size = max(1, chunk_size)
+    overlap = max(0, min(overlap, chunk_size - 1))
+    t = _Text(text, tokens=unit == "tokens")
+    ends, starts, levels, sizes = t.ends, t.starts, t.levels, t.sizes
+    n = len(text)
+
     chunks: list[Chunk] = []
-    buf = ""
-    cid = 0
-
-    def flush(b: str):
-        nonlocal cid
-        b = b.strip()
-        if b:
-            chunks.append(Chunk(source=source, chunk_id=cid, text=b))
-            cid += 1
-
-    for p in paras:
-        if not buf:
-            buf = p
-            continue
+    s = 0        # start of the current chunk
+    k = 0        # first break ending after s
+    prev_end = 0
+    while s < n:
+        while ends[k] <= s:
+            k += 1
+        base = t.size_before(s, k)
+
+        # furthest fitting paragraph and sentence break
+        best = {PARAGRAPH: -1, SENTENCE: -1}
+        j = k
+        while j < len(ends) and sizes[j] - base <= chunk_size:
+            best[levels[j]] = j
+            j += 1
 
-        if len(buf) + 2 + len(p) <= chunk_size:
-            buf = buf + "\n\n" + p
+        if j == len(ends):
+            e = n  # the rest fits
         else:
-            flush(buf)
+            e = -1
+            for lv in (PARAGRAPH, SENTENCE):
+                if best[lv] != -1 and 2 * (sizes[best[lv]] - base) >= chunk_size:
+                    e = ends[best[lv]]
+                    break
+            if e == -1:
+                # no break fills half a chunk: end at the last fitting word
+                limit = t.fit_end(s, chunk_size)
+                e = t.word_end(s, limit)
+                if e <= s:
+                    e = limit  # a single word longer than a chunk
+
+        if e <= prev_end:
+            # the overlap leaves no room for new text: restart right after the last chunk
+            s = t.next_word(prev_end)
+            continue
 
-            # overlap: keep last N chars from previous chunk
-            tail = buf[-overlap:] if overlap > 0 else ""
-            buf = (tail + "\n\n" + p).strip()
+        chunks.append(Chunk(source=source, chunk_id=len(chunks), text=text[s:e], start=s, end=e))
+        if e >= n:
+            break
+        prev_end = e
 
-            # If still too large, hard-split
-            while len(buf) > chunk_size:
-                flush(buf[:chunk_size])
-                tail2 = buf[chunk_size - overlap:chunk_size] if overlap > 0 else ""
-                buf = (tail2 + buf[chunk_size:]).strip()
+        # next chunk starts with the last whole words of this one (at most `overlap`)
+        nxt = t.overlap_start(s, e, overlap) if overlap else None
+        s = nxt if nxt is not None else t.next_word(e)
 
-    flush(buf)
-    return chunks   
\ No newline at end of file
+    return chunks
@@ -0,0 +1,119 @@
+from __future__ import annotations
+from dataclasses import dataclass, field
+from typing import Dict, List
+
+from app.services.tokens import estimate_tokens
+from app.services.vectorstore import SearchHit
+
+
+@dataclass
+class Span:
+    """Consecutive chunks of one source merged into a single passage."""
+    source: str
+    first_id: int
+    last_id: int
+    text: str
+    score: float
+    hits: List[SearchHit] = field(default_factory=list)
+    end: int = -1  # character offset where text ends in the source, -1 if unknown
+
+
+@dataclass
+class AssembledContext:
+    text: str
+    hits: List[SearchHit]  # hits whose text made it into the context
+    tokens: int
+    dropped: int  # hits left out because of the budget
+
+
+def _overlap(a: str, b: str, max_overlap: int, min_overlap: int = 16) -> int:
+    """
+    Length of the longest suffix of `a` (at most max_overlap chars) that is
+    also a prefix of `b`. Overlaps shorter than min_overlap are ignored.
+    """
+    probe = b[:min_overlap]
+    if max_overlap < min_overlap or len(probe) < min_overlap:
+        return 0
+    window = a[-max_overlap:]
+    pos = window.find(probe)
+    while pos != -1:
+        tail = window[pos:]
+        if b.startswith(tail):
+            return len(tail)
+        pos = window.find(probe, pos + 1)
+    return 0
+
+
+def _join(a: str, b: str, max_overlap: int) -> str:
+    n = _overlap(a, b, max_overlap)
+    if n:
+        return a + b[n:]
+    return a + "\n\n" + b
+
+
+def _extend(span: Span, chunk, max_overlap: int) -> None:
+    if span.end >= 0 and 0 <= chunk.start <= span.end:
+        # offsets known: cut the overlap exactly
+        span.text += chunk.text[span.end - chunk.start:]
+    else:
+        span.text = _join(span.text, chunk.text, max_overlap)
+    span.end = chunk.end
+
+
+def merge_hits(hits: List[SearchHit], max_overlap: int) -> List[Span]:
+    """
+    Merge hits that are adjacent chunks (chunk_id, chunk_id + 1, ...) of the same
+    source, dropping the overlap the chunker repeats at the start of each chunk
+    (by character offsets, or by matching text for chunks stored without them).
+    Duplicate hits (same source and chunk_id) are kept once.
+    """
+    by_source: Dict[str, Dict[int, SearchHit]] = {}
+    for h in hits:
+        by_source.setdefault(h.chunk.source, {}).setdefault(h.chunk.chunk_id, h)
+
+    spans: List[Span] = []
+    for source, chunks in by_source.items():
+        span: Span | None = None
+        for cid in sorted(chunks):
+            h = chunks[cid]
+            if span is not None and cid == span.last_id + 1:
+                _extend(span, h.chunk, max_overlap)
+                span.last_id = cid
+                span.score = max(span.score, h.similarity)
+                span.hits.append(h)
+                continue
+            if span is not None:
+                spans.append(span)
+            span = Span(source, cid, cid, h.chunk.text, h.similarity, [h], end=h.chunk.end)
+        if span is not None:
+            spans.append(span)
+    return spans
+
+
+def assemble_context(hits: List[SearchHit], budget_tokens: int, max_overlap: int) -> AssembledContext:
+    """
+    Pack merged, de-duplicated passages by score into `budget_tokens`.
+    Passages that do not fit are skipped; the best one is truncated rather
+    than dropped so there is always some context when hits exist.
+    """
+    spans = sorted(merge_hits(hits, max_overlap), key=lambda s: s.score, reverse=True)
+
+    parts: List[str] = []
+    used: List[SearchHit] = []
+    tokens = 0
+    dropped = 0
+    for span in spans:
+        cost = estimate_tokens(span.text) + (1 if parts else 0)
+        if tokens + cost <= budget_tokens:
+            parts.append(span.text)
+            used.extend(span.hits)
+            tokens += cost
+        elif not parts and budget_tokens > 0:
+            keep = max(1, int(len(span.text) * budget_tokens / max(cost, 1)))
+            parts.append(span.text[:keep].rstrip())
+            used.extend(span.hits)
+            tokens = budget_tokens
+        else:
+            dropped += len(span.hits)
+
+    return AssembledContext(text="\n\n".join(parts).strip(), hits=used, tokens=tokens, dropped=dropped)
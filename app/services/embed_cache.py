@@ -0,0 +1,127 @@
+from __future__ import annotations
+import sqlite3
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from app.core.config import settings
+from app.services.manifest import content_hash
+from app.services.metrics import REGISTRY
+
+Key = Tuple[str, str]  # (embed model, text hash)
+
+CACHE_TOTAL = REGISTRY.counter(
+    "rag_embed_cache_total", "Embedding cache lookups per text", ("result",)
+)
+
+
+class EmbeddingCache:
+    """
+    Disk-backed embedding cache (SQLite) with an in-process LRU in front.
+    Keys include the embedding model name, so switching EMBED_MODEL
+    can never return vectors from the previous model.
+    Vectors are stored as raw float32 bytes.
+    """
+    def __init__(self, db_path: Path, max_memory_items: int = 4096):
+        self.db_path = db_path
+        self.max_memory_items = max_memory_items
+        self._lru: "OrderedDict[Key, list[float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+        db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._con = sqlite3.connect(str(db_path), check_same_thread=False)
+        self._con.execute("PRAGMA journal_mode=WAL")
+        self._con.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " model TEXT NOT NULL,"
+            " hash TEXT NOT NULL,"
+            " vec BLOB NOT NULL,"
+            " PRIMARY KEY (model, hash))"
+        )
+        self._con.commit()
+
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(model: str, text: str) -> Key:
+        return (model, content_hash(text))
+
+    def _remember(self, key: Key, vec: list[float]) -> None:
+        self._lru[key] = vec
+        self._lru.move_to_end(key)
+        while len(self._lru) > self.max_memory_items:
+            self._lru.popitem(last=False)
+
+    def get_many(self, model: str, texts: List[str]) -> List[Optional[list[float]]]:
+        keys = [self.key(model, t) for t in texts]
+        out: List[Optional[list[float]]] = [None] * len(texts)
+
+        with self._lock:
+            disk: dict[str, list[int]] = {}
+            for i, k in enumerate(keys):
+                v = self._lru.get(k)
+                if v is not None:
+                    self._lru.move_to_end(k)
+                    out[i] = v
+                else:
+                    disk.setdefault(k[1], []).append(i)
+
+            if disk:
+                hashes = list(disk)
+                # stay below SQLite's bound-parameter limit
+                for j in range(0, len(hashes), 500):
+                    part = hashes[j:j + 500]
+                    rows = self._con.execute(
+                        f"SELECT hash, vec FROM embeddings WHERE model = ? AND hash IN ({','.join('?' * len(part))})",
+                        [model, *part],
+                    ).fetchall()
+                    for h, blob in rows:
+                        vec = np.frombuffer(blob, dtype=np.float32).tolist()
+                        self._remember((model, h), vec)
+                        for i in disk[h]:
+                            out[i] = vec
+
+            found = sum(1 for v in out if v is not None)
+            self.hits += found
+            self.misses += len(out) - found
+        CACHE_TOTAL.inc(found, result="hit")
+        CACHE_TOTAL.inc(len(out) - found, result="miss")
+        return out
+
+    def put_many(self, model: str, texts: List[str], vectors: List[list[float]]) -> None:
+        rows = []
+        with self._lock:
+            for t, v in zip(texts, vectors):
+                k = self.key(model, t)
+                self._remember(k, v)
+                rows.append((model, k[1], np.asarray(v, dtype=np.float32).tobytes()))
+            self._con.executemany(
+                "INSERT OR REPLACE INTO embeddings (model, hash, vec) VALUES (?, ?, ?)", rows
+            )
+            self._con.commit()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "memory_items": len(self._lru)}
+
+
+_cache: EmbeddingCache | None = None
+_cache_lock = threading.Lock()
+
+
+def get_embedding_cache() -> EmbeddingCache | None:
+    global _cache
+    if not settings.EMBED_CACHE_ENABLED:
+        return None
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = EmbeddingCache(
+                    settings.storage_dir_path / settings.EMBED_CACHE_FILE,
+                    max_memory_items=settings.EMBED_CACHE_MEMORY_ITEMS,
+                )
+    return _cache
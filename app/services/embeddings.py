@@ -1,17 +1,105 @@
-import requests
+import asyncio
+
 from app.core.config import settings
+from app.services.embed_cache import get_embedding_cache
+from app.services.lm_client import apost, embed_pool, post
+from app.services.metrics import REGISTRY
+from app.services.singleflight import MicroBatcher
 
-def embed_texts(texts: list[str]) -> list[list[float]]:
-    url = f"{settings.LM_URL}/embeddings"
+EMBED_BATCH_SIZE = REGISTRY.histogram(
+    "rag_embed_batch_size", "Texts per /embeddings request (async path)", (1, 2, 4, 8, 16, 32, 64, 128)
+)
 
-    payload = {
+def _payload(texts: list[str]) -> dict:
+    return {
         "model": settings.EMBED_MODEL,
         "input": texts
     }
 
-    r = requests.post(url, json=payload, timeout=120)
-    r.raise_for_status()
+def _request_embeddings(texts: list[str]) -> list[list[float]]:
+    r = post(embed_pool(), "/embeddings", _payload(texts))
 
     data = r.json()["data"]
 
-    return [d["embedding"] for d in data]   
\ No newline at end of file
+    return [d["embedding"] for d in data]
+
+async def _arequest_embeddings(texts: list[str]) -> list[list[float]]:
+    r = await apost(embed_pool(), "/embeddings", _payload(texts))
+
+    data = r.json()["data"]
+
+    return [d["embedding"] for d in data]
+
+# Cache writes of fresh vectors run in a thread, and the batch does not
+# wait for the SQLite commit; the tasks are kept here until they finish
+_writes: set[asyncio.Task] = set()
+
+def _write_back(cache, texts: list[str], vecs: list[list[float]]) -> None:
+    task = asyncio.create_task(asyncio.to_thread(cache.put_many, settings.EMBED_MODEL, texts, vecs))
+    _writes.add(task)
+    task.add_done_callback(lambda t: _writes.discard(t) or t.cancelled() or t.exception())
+
+async def _send_batch(texts: list[str]) -> list[list[float]]:
+    vecs = await _arequest_embeddings(texts)
+    cache = get_embedding_cache()
+    if cache is not None:
+        _write_back(cache, texts, vecs)
+    return vecs
+
+# One batcher per event loop: concurrent requests' cache misses are
+# coalesced into micro-batches (and identical texts sent once)
+_batchers: dict[asyncio.AbstractEventLoop, MicroBatcher] = {}
+
+def _batcher() -> MicroBatcher:
+    loop = asyncio.get_running_loop()
+    b = _batchers.get(loop)
+    if b is None:
+        for old in [l for l in _batchers if l.is_closed()]:
+            del _batchers[old]
+        b = _batchers[loop] = MicroBatcher(
+            _send_batch,
+            window_seconds=settings.EMBED_BATCH_WINDOW_MS / 1000.0,
+            max_batch=settings.EMBED_BATCH_MAX,
+            on_batch=EMBED_BATCH_SIZE.observe,
+        )
+    return b
+
+def _merge(texts: list[str], out: list, missing: list[str], fresh: list[list[float]]) -> list[list[float]]:
+    by_text = dict(zip(missing, fresh))
+    return [v if v is not None else by_text[t] for t, v in zip(texts, out)]
+
+def _missing(texts: list[str], out: list) -> list[str]:
+    # Only send cache misses (deduplicated) to the server
+    return list(dict.fromkeys(t for t, v in zip(texts, out) if v is None))
+
+def embed_texts(texts: list[str]) -> list[list[float]]:
+    if not texts:
+        return []
+    cache = get_embedding_cache()
+    if cache is None:
+        return _request_embeddings(texts)
+
+    model = settings.EMBED_MODEL
+    out = cache.get_many(model, texts)
+    missing = _missing(texts, out)
+    if missing:
+        fresh = _request_embeddings(missing)
+        cache.put_many(model, missing, fresh)
+        out = _merge(texts, out, missing, fresh)
+    return out
+
+async def aembed_texts(texts: list[str]) -> list[list[float]]:
+    if not texts:
+        return []
+    cache = get_embedding_cache()
+    if cache is None:
+        out = [None] * len(texts)
+    else:
+        # SQLite lookups would otherwise stall every other request on the loop
+        out = await asyncio.to_thread(cache.get_many, settings.EMBED_MODEL, texts)
+    missing = _missing(texts, out)
+    if missing:
+        # cached by _send_batch once the batch returns
+        fresh = await _batcher().submit(missing)
+        out = _merge(texts, out, missing, fresh)
+    return out
@@ -0,0 +1,169 @@
+from __future__ import annotations
+import asyncio
+import hashlib
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from app.services.metrics import timed
+from app.services.tokens import estimate_messages_tokens, estimate_tokens
+
+# How much history each call site gets:
+#   none    - no history
+#   recent  - last N turns verbatim
+#   summary - rolling summary of older turns + last N turns verbatim
+#   full    - the whole memory window verbatim
+HISTORY_MODES = ("none", "recent", "summary", "full")
+
+Summarizer = Callable[[str, List[dict]], Awaitable[str]]
+
+
+def _fingerprint(m: dict) -> str:
+    raw = f"{(m or {}).get('role')}\x00{(m or {}).get('content')}"
+    return hashlib.sha1(raw.encode("utf-8", errors="ignore")).hexdigest()
+
+
+def _clean(history_messages) -> List[dict]:
+    out = []
+    for m in history_messages or []:
+        role = (m or {}).get("role")
+        content = (m or {}).get("content")
+        if role in ("user", "assistant") and isinstance(content, str) and content.strip():
+            out.append(m)
+    return out
+
+
+@dataclass
+class HistoryView:
+    messages: List[dict] = field(default_factory=list)
+    summary: str = ""
+
+    @property
+    def tokens(self) -> int:
+        return estimate_messages_tokens(self.messages) + estimate_tokens(self.summary)
+
+
+@dataclass
+class _SummaryState:
+    summary: str = ""
+    last_folded: str = ""  # fingerprint of the newest message folded into the summary
+    last_seen: float = field(default_factory=time.monotonic)
+
+
+class HistoryCompactor:
+    """
+    Keeps prompt history small: the last `recent_turns` turns stay verbatim,
+    older turns are folded into a per-session rolling summary.
+    The summary is updated incrementally (only newly aged-out messages are sent
+    to the summarizer) after the response has gone out, never on the hot path.
+    Aged-out turns are folded `fold_turns` at a time (or when the history
+    outgrows the token budget): between folds each prompt extends the previous
+    one, which lets the LLM server reuse its cached prefix.
+
+    Summaries live in this process only (like InProcessMemoryBackend) and
+    expire with the session after `idle_ttl_seconds` without a turn.
+    """
+    def __init__(
+        self,
+        summarizer: Summarizer,
+        token_budget: int,
+        recent_turns: int,
+        max_sessions: int = 10000,
+        fold_turns: int = 0,
+        idle_ttl_seconds: float = 3600.0,
+    ):
+        self.summarizer = summarizer
+        self.token_budget = token_budget
+        self.recent_turns = recent_turns
+        self.fold_turns = fold_turns
+        self.max_sessions = max_sessions
+        self.idle_ttl_seconds = idle_ttl_seconds
+        self._state: "OrderedDict[str, _SummaryState]" = OrderedDict()
+        self._locks: Dict[str, asyncio.Lock] = {}
+
+    def _split(self, session_id: Optional[str], messages: List[dict]):
+        """-> (state, pending older messages not yet folded, recent messages)"""
+        keep = max(0, self.recent_turns * 2)
+        older = messages[:-keep] if keep else messages
+        recent = messages[-keep:] if keep else []
+        state = self._state.get(session_id or "")
+        now = time.monotonic()
+        if state is not None and now - state.last_seen > self.idle_ttl_seconds:
+            # the session expired from memory: its summary must not come back with the id
+            self._state.pop(session_id, None)
+            lock = self._locks.get(session_id)
+            if lock is not None and not lock.locked():
+                del self._locks[session_id]
+            state = None
+        if state is not None:
+            state.last_seen = now
+        if state is None or not state.last_folded:
+            return state, older, recent
+        for i in range(len(older) - 1, -1, -1):
+            if _fingerprint(older[i]) == state.last_folded:
+                return state, older[i + 1:], recent
+        # the last folded message already left the memory window
+        return state, older, recent
+
+    def _trim(self, messages: List[dict], budget: int) -> List[dict]:
+        # drop oldest first until the history fits
+        out = list(messages)
+        while out and estimate_messages_tokens(out) > budget:
+            out.pop(0)
+        return out
+
+    def view(
+        self,
+        session_id: Optional[str],
+        history_messages,
+        mode: str,
+        current: str | None = None,
+    ) -> HistoryView:
+        messages = _clean(history_messages)
+        # The current question is already in memory and is sent separately
+        if current is not None and messages and messages[-1].get("role") == "user" \
+                and messages[-1].get("content", "").strip() == current.strip():
+            messages = messages[:-1]
+
+        if mode == "none" or not messages:
+            return HistoryView()
+        if mode == "full":
+            return HistoryView(self._trim(messages, self.token_budget))
+
+        state, pending, recent = self._split(session_id, messages)
+        if mode == "recent":
+            return HistoryView(self._trim(recent, self.token_budget))
+
+        # summary: summary first, then not-yet-summarized older messages, then recent ones
+        summary = state.summary if state is not None else ""
+        budget = max(0, self.token_budget - estimate_tokens(summary))
+        return HistoryView(self._trim(pending + recent, budget), summary)
+
+    async def update(self, session_id: Optional[str], history_messages) -> None:
+        """Fold messages that aged out of the recent window into the summary."""
+        if not session_id:
+            return
+        lock = self._locks.setdefault(session_id, asyncio.Lock())
+        try:
+            async with lock:
+                messages = _clean(history_messages)
+                state, pending, recent = self._split(session_id, messages)
+                if not pending:
+                    return
+                previous = state.summary if state is not None else ""
+                if (
+                    len(pending) < 2 * self.fold_turns
+                    and estimate_tokens(previous) + estimate_messages_tokens(pending + recent) <= self.token_budget
+                ):
+                    return  # not yet: keep the prompt prefix stable
+                with timed("history_summary"):
+                    summary = (await self.summarizer(previous, pending)).strip()
+                self._state[session_id] = _SummaryState(summary or previous, _fingerprint(pending[-1]))
+                self._state.move_to_end(session_id)
+                while len(self._state) > self.max_sessions:
+                    old, _ = self._state.popitem(last=False)
+                    self._locks.pop(old, None)
+        finally:
+            if session_id not in self._state and not lock.locked():
+                self._locks.pop(session_id, None)
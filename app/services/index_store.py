@@ -0,0 +1,237 @@
+"""
+Versioned index directories, shared by every server process and the ingest CLI.
+
+    STORAGE_DIR/index/
+      CURRENT            name of the live version (replaced atomically)
+      v<time>-<id>/      one complete index: vector store, manifest, BM25, version.json
+      leases/            <version>@<pid>: that process still reads the version (mtime = heartbeat)
+      build.lock         one writer at a time, across processes
+      .staging-*/        a build in progress
+
+A build writes into a staging directory, renames it to a new version and
+only then flips CURRENT, so readers never see a half-built index. Published
+versions are never modified (except the knowledge stamp in version.json).
+"""
+from __future__ import annotations
+import hashlib
+import json
+import os
+import shutil
+import time
+import uuid
+from pathlib import Path
+from typing import Iterable, List
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+META_FILE = "version.json"
+RETIRED_FILE = "RETIRED"  # mtime = when the version stopped being CURRENT
+
+
+class FileLock:
+    """Exclusive advisory lock on a file (flock, or msvcrt on Windows); not re-entrant."""
+    def __init__(self, path: Path):
+        self.path = path
+        self._fh = None
+
+    def acquire(self, blocking: bool = True) -> bool:
+        fh = open(self.path, "a+b")
+        try:
+            if fcntl is not None:
+                fcntl.flock(fh.fileno(), fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+            else:
+                while True:
+                    try:
+                        fh.seek(0)
+                        msvcrt.locking(fh.fileno(), msvcrt.LK_NBLCK, 1)
+                        break
+                    except OSError:
+                        if not blocking:
+                            raise
+                        time.sleep(0.1)
+        except OSError:
+            fh.close()
+            if blocking:
+                raise
+            return False
+        self._fh = fh
+        return True
+
+    def release(self) -> None:
+        fh, self._fh = self._fh, None
+        if fh is None:
+            return
+        try:
+            if fcntl is not None:
+                fcntl.flock(fh.fileno(), fcntl.LOCK_UN)
+            else:
+                fh.seek(0)
+                msvcrt.locking(fh.fileno(), msvcrt.LK_UNLCK, 1)
+        finally:
+            fh.close()
+
+    def __enter__(self) -> "FileLock":
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.release()
+
+
+def _link_or_copy(src: str, dst: str) -> None:
+    try:
+        os.link(src, dst)
+    except OSError:  # another filesystem, or no hard links there
+        shutil.copy2(src, dst)
+
+
+def knowledge_stamp(paths: Iterable[Path], fingerprint: dict) -> str:
+    """
+    Cheap change detector for the knowledge files (names, sizes, mtimes) and
+    the index settings; a changed stamp only means "run a sync to find out".
+    """
+    h = hashlib.sha1(json.dumps(fingerprint, sort_keys=True).encode("utf-8"))
+    for p in paths:
+        try:
+            st = p.stat()
+            h.update(f"{p.as_posix()}:{st.st_size}:{st.st_mtime_ns}\n".encode("utf-8"))
+        except OSError:
+            h.update(f"{p.as_posix()}:-\n".encode("utf-8"))
+    return h.hexdigest()[:16]
+
+
+class IndexStore:
+    def __init__(self, root: Path, lease_ttl: float = 60.0):
+        self.root = root
+        self.lease_ttl = lease_ttl
+        self.leases_dir = root / "leases"
+        self.leases_dir.mkdir(parents=True, exist_ok=True)
+
+    # -----------------------------
+    # Versions
+    # -----------------------------
+    def current(self) -> str:
+        """The live version ("" before the first build)."""
+        try:
+            name = (self.root / "CURRENT").read_text(encoding="utf-8").strip()
+        except OSError:
+            return ""
+        return name if name and (self.root / name).is_dir() else ""
+
+    def path(self, version: str) -> Path:
+        return self.root / version
+
+    def read_meta(self, version: str) -> dict:
+        try:
+            return json.loads((self.path(version) / META_FILE).read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return {}
+
+    @staticmethod
+    def _write_meta(directory: Path, meta: dict) -> None:
+        tmp = directory / (META_FILE + ".tmp")
+        tmp.write_text(json.dumps(meta, indent=1, sort_keys=True), encoding="utf-8")
+        os.replace(tmp, directory / META_FILE)
+
+    def write_meta(self, version: str, meta: dict) -> None:
+        self._write_meta(self.path(version), meta)
+
+    # -----------------------------
+    # Building (hold lock() around these)
+    # -----------------------------
+    def lock(self) -> FileLock:
+        return FileLock(self.root / "build.lock")
+
+    def stage(self, base: str = "", link: bool = False) -> Path:
+        """
+        A private directory to build in: a copy of version `base`, or empty.
+        With `link` the files are hard links to the base's instead of copies
+        (copied where the filesystem cannot link). Only for stores that
+        replace their files and never write one in place: a link shares
+        the file with the published version.
+        """
+        staging = self.root / f".staging-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        if base:
+            shutil.copytree(
+                self.path(base), staging,
+                ignore=shutil.ignore_patterns(META_FILE, RETIRED_FILE),
+                copy_function=_link_or_copy if link else shutil.copy2,
+            )
+        else:
+            staging.mkdir()
+        return staging
+
+    def discard(self, staging: Path) -> None:
+        shutil.rmtree(staging, ignore_errors=True)
+
+    def publish(self, staging: Path, meta: dict) -> str:
+        """Turn a finished staging directory into a version and make it CURRENT."""
+        version = f"v{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:6]}"
+        self._write_meta(staging, dict(meta, created=time.time()))
+        os.rename(staging, self.path(version))
+
+        previous = self.current()
+        tmp = self.root / f"CURRENT.{os.getpid()}.tmp"
+        tmp.write_text(version, encoding="utf-8")
+        os.replace(tmp, self.root / "CURRENT")
+        if previous:
+            (self.path(previous) / RETIRED_FILE).touch()
+        return version
+
+    # -----------------------------
+    # Readers
+    # -----------------------------
+    def _lease(self, version: str) -> Path:
+        return self.leases_dir / f"{version}@{os.getpid()}"
+
+    def hold(self, version: str) -> None:
+        """Mark `version` as in use by this process; call again as a heartbeat."""
+        self._lease(version).touch()
+
+    def release(self, version: str) -> None:
+        self._lease(version).unlink(missing_ok=True)
+
+    def collect_garbage(self) -> List[str]:
+        """
+        Delete versions that are not CURRENT, were retired at least lease_ttl
+        ago and have no live lease, plus staging leftovers of crashed builds.
+        Skipped while a build holds the lock. Returns the deleted versions.
+        """
+        lock = self.lock()
+        if not lock.acquire(blocking=False):
+            return []
+        try:
+            now = time.time()
+            held = set()
+            for lease in self.leases_dir.iterdir():
+                try:
+                    fresh = now - lease.stat().st_mtime < self.lease_ttl
+                except OSError:
+                    continue
+                if fresh:
+                    held.add(lease.name.rsplit("@", 1)[0])
+                else:
+                    lease.unlink(missing_ok=True)  # its process died
+
+            current = self.current()
+            removed = []
+            for d in self.root.iterdir():
+                if d.name.startswith(".staging-") and d.is_dir():
+                    shutil.rmtree(d, ignore_errors=True)
+                    continue
+                if d.name == current or d.name in held or not (d / META_FILE).exists():
+                    continue
+                retired = d / RETIRED_FILE
+                since = (retired if retired.exists() else d / META_FILE).stat().st_mtime
+                # a process that read CURRENT just before the flip may not have its lease yet
+                if now - since < self.lease_ttl:
+                    continue
+                shutil.rmtree(d, ignore_errors=True)
+                removed.append(d.name)
+            return removed
+        finally:
+            lock.release()
@@ -0,0 +1,203 @@
+from __future__ import annotations
+import multiprocessing
+import os
+import time
+from collections import deque
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, Deque, Dict, Iterable, List, Optional, Tuple
+
+from app.services.chunking import Chunk
+from app.services.embeddings import embed_texts
+from app.services.lexical import BM25Index
+from app.services.manifest import FileEntry, IndexManifest, content_hash
+from app.services.vectorstore import VectorStore, chunk_key
+
+# Must be picklable (a module-level function or functools.partial of one)
+# when chunking runs in worker processes
+Chunker = Callable[[str, str], List[Chunk]]
+Embedder = Callable[[List[str]], List[List[float]]]
+
+
+@dataclass
+class SyncStats:
+    files: int = 0
+    chunks: int = 0
+    embedded: int = 0
+    deleted: int = 0
+    rebuilt: bool = False
+    version: str = ""
+    changed_files: int = 0
+    started: float = 0.0
+
+    @property
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started if self.started else 0.0
+
+
+class _InlineExecutor(Executor):
+    """Runs work in the calling thread (workers=1, or nothing to parallelise)."""
+    def submit(self, fn, /, *args, **kwargs) -> Future:
+        f: Future = Future()
+        try:
+            f.set_result(fn(*args, **kwargs))
+        except BaseException as e:
+            f.set_exception(e)
+        return f
+
+
+def _chunk_file(chunker: Chunker, source: str, text: str) -> List[Tuple[Chunk, str]]:
+    # runs in a worker process: hash there too, only results come back.
+    # Offsets are part of the hash so stored offsets never go stale.
+    return [(c, content_hash(f"{c.start}:{c.end}:{c.text}")) for c in chunker(source, text)]
+
+
+def sync_index(
+    vdb: VectorStore,
+    files: Iterable[tuple[str, str]],
+    chunker: Chunker,
+    manifest_path: Path,
+    fingerprint: Dict[str, object],
+    batch_size: int = 64,
+    workers: int = 1,
+    embed_concurrency: int = 1,
+    progress: Optional[Callable[[SyncStats], None]] = None,
+    lexical: Optional[BM25Index] = None,
+    embed: Embedder = embed_texts,
+) -> SyncStats:
+    """
+    Bring the vector collection in line with the knowledge files.
+    Only chunks that were added or whose text changed are embedded;
+    chunks that disappeared are deleted. Unchanged files are not even re-chunked.
+
+    `files` is consumed lazily as a pipeline:
+      read file -> chunk (up to `workers` processes) -> embedding batches
+      (up to `embed_concurrency` in flight) -> upsert per batch.
+    Each stage has a bounded queue, so only a few files and batches are
+    held in memory at any time however large the corpus is. A batch upsert
+    costs the size of the batch, not of the index (the NumPy store stages
+    it); everything is committed with one vdb.flush() at the end, before
+    the manifest that describes it is saved.
+
+    `lexical` (a BM25 index) receives the same upserts and deletes; it is
+    rebuilt from the stored chunks when it was not built for this index version.
+    """
+    stats = SyncStats(started=time.perf_counter())
+
+    manifest = IndexManifest.load(manifest_path)
+    # Full rebuild when there is no manifest, embedding/chunking settings changed,
+    # or the collection does not hold what the manifest claims (e.g. storage wiped).
+    if (
+        manifest is None
+        or manifest.fingerprint != fingerprint
+        or vdb.count() != manifest.chunk_count
+    ):
+        vdb.reset()
+        manifest = IndexManifest(fingerprint=dict(fingerprint))
+        stats.rebuilt = True
+
+    # follow the changes incrementally only if it matched the index before them
+    lexical_rebuild = lexical is not None and (stats.rebuilt or lexical.version != manifest.version)
+    if lexical_rebuild:
+        lexical.clear()
+
+    new_files: Dict[str, FileEntry] = {}
+    workers = max(1, workers)
+    embed_concurrency = max(1, embed_concurrency)
+
+    chunk_pool: Executor | None = None  # created on the first changed file
+    embed_pool = ThreadPoolExecutor(embed_concurrency, thread_name_prefix="embed") if embed_concurrency > 1 else _InlineExecutor()
+    chunking: Deque[Tuple[str, str, Future]] = deque()
+    embedding: Deque[Tuple[List[Chunk], Future]] = deque()
+    pending: List[Chunk] = []
+
+    def upsert_oldest() -> None:
+        batch, fut = embedding.popleft()
+        vdb.upsert(batch, fut.result())
+        if lexical is not None and not lexical_rebuild:
+            lexical.add(batch)
+        stats.embedded += len(batch)
+        if progress is not None:
+            progress(stats)
+
+    def submit_batch(batch: List[Chunk]) -> None:
+        while len(embedding) >= embed_concurrency:
+            upsert_oldest()
+        embedding.append((batch, embed_pool.submit(embed, [c.text for c in batch])))
+
+    def collect_oldest() -> None:
+        source, fh, fut = chunking.popleft()
+        old = manifest.files.get(source)
+        old_chunks = old.chunks if old is not None else {}
+        entry = FileEntry(hash=fh)
+        for c, h in fut.result():
+            key = chunk_key(c)
+            entry.chunks[key] = h
+            if old_chunks.get(key) != h:
+                pending.append(c)
+        new_files[source] = entry
+        while len(pending) >= batch_size:
+            submit_batch(pending[:batch_size])
+            del pending[:batch_size]
+
+    try:
+        for source, text in files:
+            stats.files += 1
+            fh = content_hash(text)
+            old = manifest.files.get(source)
+            if old is not None and old.hash == fh:
+                new_files[source] = old
+                continue
+
+            stats.changed_files += 1
+            if chunk_pool is None:
+                chunk_pool = (
+                    ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn"))
+                    if workers > 1 else _InlineExecutor()
+                )
+            while len(chunking) >= 2 * workers:
+                collect_oldest()
+            chunking.append((source, fh, chunk_pool.submit(_chunk_file, chunker, source, text)))
+
+        while chunking:
+            collect_oldest()
+        if pending:
+            submit_batch(list(pending))
+            pending.clear()
+        while embedding:
+            upsert_oldest()
+    finally:
+        if chunk_pool is not None:
+            chunk_pool.shutdown(wait=True, cancel_futures=True)
+        embed_pool.shutdown(wait=True, cancel_futures=True)
+
+    live = {k for e in new_files.values() for k in e.chunks}
+    removed = [k for e in manifest.files.values() for k in e.chunks if k not in live]
+    if removed:
+        vdb.delete(removed)
+        if lexical is not None and not lexical_rebuild:
+            lexical.remove(removed)
+
+    vdb.flush()
+    stats.deleted = len(removed)
+    stats.chunks = len(live)
+
+    if stats.rebuilt or new_files != manifest.files:
+        manifest.files = new_files
+        manifest.save(manifest_path)
+
+    stats.version = manifest.version
+    if lexical is not None:
+        if lexical_rebuild:
+            lexical.add(c for c in vdb.get_chunks(sorted(live)) if c is not None)
+        if lexical.version != stats.version:
+            lexical.version = stats.version
+            lexical.dirty = True
+    if progress is not None:
+        progress(stats)
+    return stats
+
+
+def default_workers() -> int:
+    return max(1, (os.cpu_count() or 1) - 1)
@@ -0,0 +1,191 @@
+from __future__ import annotations
+import asyncio
+import json
+import re
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Awaitable, Callable, Dict, List, Optional, Protocol
+
+import numpy as np
+
+from app.services.embeddings import aembed_texts
+from app.services.metrics import CONFIDENCE_BUCKETS, REGISTRY
+
+INTENTS = ("uniq_question", "verification_or_feedback", "casual")
+
+ROUTE_TOTAL = REGISTRY.counter(
+    "rag_intent_route_total", "Intent routing decisions", ("intent", "source")
+)
+ROUTE_CONFIDENCE = REGISTRY.histogram(
+    "rag_intent_route_confidence",
+    "Confidence of each intent stage, accepted or not",
+    CONFIDENCE_BUCKETS,
+    ("source", "accepted"),
+)
+
+
+@dataclass
+class RouteDecision:
+    intent: str
+    confidence: float  # 0..1, stage specific
+    source: str  # which stage decided: lexical | bm25 | centroid | llm
+
+
+class IntentStage(Protocol):
+    name: str
+
+    async def classify(self, user_msg: str, history_messages=None) -> Optional[RouteDecision]:
+        ...
+
+
+class LexicalRules:
+    """
+    Cheap whole-message rules for greetings/thanks/acknowledgements and
+    obvious "is that right?" follow-ups. Only fires on short messages.
+    """
+    name = "lexical"
+
+    CASUAL = re.compile(
+        r"^(hi+|hey+|hello+|hii+|good (morning|afternoon|evening|night)|"
+        r"thanks?( you)?( so much| a lot)?|thank u|thx|ty|ok(ay)?|k|cool|nice|great|"
+        r"got it|bye+|goodbye|see you( later)?|how are you)"
+        r"( (there|bot|assistant|uniq assistant))?[\s!.,?]*$",
+        re.IGNORECASE,
+    )
+    VERIFY = re.compile(
+        r"^(is (that|this|it) (right|correct|true)|are you sure|"
+        r"(that'?s|that is|this is|it'?s) (wrong|incorrect|not (right|correct|true))|wrong)[\s!.?]*$",
+        re.IGNORECASE,
+    )
+
+    async def classify(self, user_msg: str, history_messages=None) -> Optional[RouteDecision]:
+        msg = user_msg.strip()
+        if len(msg) > 60:
+            return None
+        if self.CASUAL.match(msg):
+            return RouteDecision("casual", 1.0, self.name)
+        if self.VERIFY.match(msg):
+            return RouteDecision("verification_or_feedback", 1.0, self.name)
+        return None
+
+
+class CentroidClassifier:
+    """
+    Nearest-centroid classifier over labelled example utterances.
+    Confidence is the cosine margin between the best and the runner-up centroid.
+    The question embedding goes through the embedding cache, so the
+    retrieval step that follows gets it for free.
+    """
+    name = "centroid"
+
+    def __init__(self, examples_path: Path):
+        self.examples_path = examples_path
+        self._labels: List[str] = []
+        self._centroids: Optional[np.ndarray] = None
+        self._ready = False
+        self._lock = asyncio.Lock()
+
+    def _load_examples(self) -> Dict[str, List[str]]:
+        try:
+            raw = json.loads(self.examples_path.read_text(encoding="utf-8"))
+        except Exception:
+            return {}
+        return {
+            k: [str(x) for x in v if str(x).strip()]
+            for k, v in raw.items()
+            if k in INTENTS and isinstance(v, list)
+        }
+
+    async def _ensure_ready(self) -> None:
+        if self._ready:
+            return
+        async with self._lock:
+            if self._ready:
+                return
+            examples = {k: v for k, v in self._load_examples().items() if v}
+            if len(examples) >= 2:
+                labels, centroids = [], []
+                for label, texts in examples.items():
+                    m = np.asarray(await aembed_texts(texts), dtype=np.float32)
+                    m /= np.linalg.norm(m, axis=1, keepdims=True) + 1e-12
+                    c = m.mean(axis=0)
+                    centroids.append(c / (np.linalg.norm(c) + 1e-12))
+                    labels.append(label)
+                self._labels = labels
+                self._centroids = np.stack(centroids)
+            self._ready = True
+
+    async def warm_up(self) -> None:
+        await self._ensure_ready()
+
+    async def classify(self, user_msg: str, history_messages=None) -> Optional[RouteDecision]:
+        await self._ensure_ready()
+        if self._centroids is None:
+            return None
+        q = np.asarray((await aembed_texts([user_msg]))[0], dtype=np.float32)
+        q /= np.linalg.norm(q) + 1e-12
+        sims = self._centroids @ q
+        order = np.argsort(-sims)
+        margin = float(sims[order[0]] - sims[order[1]])
+        return RouteDecision(self._labels[int(order[0])], max(0.0, min(1.0, margin)), self.name)
+
+
+class KnowledgeMatch:
+    """
+    Questions whose terms (almost) all occur in one knowledge chunk are
+    uniq_question without embedding them. `match` returns the BM25 coverage
+    of the best chunk, or None when the lexical match is not conclusive.
+    """
+    name = "bm25"
+
+    def __init__(self, match: Callable[[str], Optional[float]]):
+        self.match = match
+
+    async def classify(self, user_msg: str, history_messages=None) -> Optional[RouteDecision]:
+        coverage = self.match(user_msg)
+        if coverage is None:
+            return None
+        return RouteDecision("uniq_question", coverage, self.name)
+
+
+class IntentRouter:
+    """
+    Runs local stages in order and accepts the first decision whose
+    confidence reaches the threshold. Only when none does is the
+    (slow) LLM classifier called.
+    """
+    def __init__(
+        self,
+        stages: List[IntentStage],
+        fallback: Callable[..., Awaitable[str]],
+        threshold: float,
+    ):
+        self.stages = stages
+        self.fallback = fallback
+        self.threshold = threshold
+
+    async def warm_up(self) -> None:
+        """Prepare stages that load or embed something on first use."""
+        for stage in self.stages:
+            warm_up = getattr(stage, "warm_up", None)
+            if warm_up is not None:
+                await warm_up()
+
+    async def route(self, user_msg: str, history_messages=None) -> RouteDecision:
+        for stage in self.stages:
+            try:
+                d = await stage.classify(user_msg, history_messages=history_messages)
+            except Exception:
+                d = None  # a broken local stage must never block the request
+            if d is None:
+                continue
+            accepted = d.confidence >= self.threshold
+            ROUTE_CONFIDENCE.observe(d.confidence, source=d.source, accepted=str(accepted).lower())
+            if accepted:
+                ROUTE_TOTAL.inc(intent=d.intent, source=d.source)
+                return d
+
+        label = await self.fallback(user_msg, history_messages=history_messages)
+        d = RouteDecision(label, 1.0, "llm")
+        ROUTE_TOTAL.inc(intent=d.intent, source=d.source)
+        return d
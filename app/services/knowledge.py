@@ -1,4 +1,5 @@
 from pathlib import Path
+from typing import Iterable, Iterator
 
 def read_text_file(path: Path) -> str:
     try:
@@ -6,15 +7,33 @@ def read_text_file(path: Path) -> str:
     except Exception:
         return ""
 
+def discover_knowledge_files(knowledge_dir: Path, patterns: list[str], exclude: Iterable[str] = ()) -> list[str]:
+    """
+    Relative names (posix style, e.g. "docs/faq.txt") of all files under
+    knowledge_dir matching any glob pattern ("*.txt", "**/*.md"), sorted.
+    """
+    skip = set(exclude)
+    names: set[str] = set()
+    for pattern in patterns:
+        for p in knowledge_dir.glob(pattern):
+            if p.is_file():
+                name = p.relative_to(knowledge_dir).as_posix()
+                if name not in skip:
+                    names.add(name)
+    return sorted(names)
+
+def iter_knowledge_files(knowledge_dir: Path, filenames: Iterable[str]) -> Iterator[tuple[str, str]]:
+    """
+    Yields (source_name, text), reading one file at a time
+    """
+    for name in filenames:
+        yield name, read_text_file(knowledge_dir / name)
+
 def load_knowledge_files(knowledge_dir: Path, filenames: list[str]) -> list[tuple[str, str]]:
     """
     Returns list of (source_name, text)
     """
-    out: list[tuple[str, str]] = []
-    for name in filenames:
-        p = knowledge_dir / name
-        out.append((name, read_text_file(p)))
-    return out
+    return list(iter_knowledge_files(knowledge_dir, filenames))
 
 def load_bot_rules(knowledge_dir: Path, rules_filename: str) -> str:
-    return read_text_file(knowledge_dir / rules_filename).strip()
\ No newline at end of file
+    return read_text_file(knowledge_dir / rules_filename).strip()
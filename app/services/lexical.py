@@ -0,0 +1,193 @@
+from __future__ import annotations
+import json
+import math
+import os
+import re
+import threading
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Sequence
+
+from app.services.chunking import Chunk
+from app.services.vectorstore import chunk_key
+
+LEXICAL_FORMAT = 1
+
+_WORD = re.compile(r"\w+")
+_STOPWORDS = frozenset(
+    "a an and are as at be by can do does for from has have how i in is it me my "
+    "of on or our so that the their there this to u us was we what when where "
+    "which who why will with you your".split()
+)
+
+
+def tokenize(text: str) -> List[str]:
+    """Lower-cased words without stopwords; a trailing plural "s" is dropped."""
+    out = []
+    for w in _WORD.findall(text.lower()):
+        if w in _STOPWORDS:
+            continue
+        if len(w) > 3 and w.endswith("s") and not w.endswith("ss"):
+            w = w[:-1]
+        out.append(w)
+    return out
+
+
+@dataclass
+class LexicalHit:
+    key: str        # chunk_key of the chunk
+    score: float    # BM25
+    coverage: float  # idf-weighted share of the query terms found in the chunk, 0..1
+
+
+class BM25Index:
+    """
+    In-memory inverted index (Okapi BM25) over the same chunks as the vector store.
+    Kept in step by sync_index and persisted as JSON next to the collection;
+    `version` is the index manifest version it was built for.
+    """
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.version = ""
+        self.dirty = False
+        self._postings: Dict[str, Dict[str, int]] = {}  # term -> chunk key -> term frequency
+        self._doc_len: Dict[str, int] = {}
+        self._doc_terms: Dict[str, List[str]] = {}  # chunk key -> distinct terms (for removal)
+        self._total_len = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._doc_len)
+
+    # -----------------------------
+    # Updates
+    # -----------------------------
+    def clear(self) -> None:
+        with self._lock:
+            self._postings.clear()
+            self._doc_len.clear()
+            self._doc_terms.clear()
+            self._total_len = 0
+            self.dirty = True
+
+    def _remove(self, key: str) -> None:
+        terms = self._doc_terms.pop(key, None)
+        if terms is None:
+            return
+        for t in terms:
+            docs = self._postings.get(t)
+            if docs is not None:
+                docs.pop(key, None)
+                if not docs:
+                    del self._postings[t]
+        self._total_len -= self._doc_len.pop(key, 0)
+
+    def add(self, chunks: Iterable[Chunk]) -> None:
+        """Index (or re-index) chunks."""
+        with self._lock:
+            for c in chunks:
+                key = chunk_key(c)
+                self._remove(key)
+                tf: Dict[str, int] = {}
+                tokens = tokenize(c.text)
+                for t in tokens:
+                    tf[t] = tf.get(t, 0) + 1
+                for t, n in tf.items():
+                    self._postings.setdefault(t, {})[key] = n
+                self._doc_terms[key] = list(tf)
+                self._doc_len[key] = len(tokens)
+                self._total_len += len(tokens)
+            self.dirty = True
+
+    def remove(self, keys: Iterable[str]) -> None:
+        with self._lock:
+            for k in keys:
+                self._remove(k)
+            self.dirty = True
+
+    # -----------------------------
+    # Search
+    # -----------------------------
+    def _idf(self, df: int) -> float:
+        n = len(self._doc_len)
+        return math.log(1.0 + (n - df + 0.5) / (df + 0.5))
+
+    def search(self, query: str, top_k: int) -> List[LexicalHit]:
+        terms = list(dict.fromkeys(tokenize(query)))
+        if not terms or not self._doc_len:
+            return []
+
+        with self._lock:
+            avg_len = self._total_len / max(1, len(self._doc_len))
+            k1, b = self.k1, self.b
+            # unknown terms count with the highest idf: a question about
+            # something the knowledge base never mentions gets low coverage
+            idfs = {t: self._idf(len(self._postings.get(t, ()))) for t in terms}
+            idf_total = sum(idfs.values()) or 1.0
+
+            scores: Dict[str, float] = {}
+            matched: Dict[str, float] = {}
+            for t in terms:
+                docs = self._postings.get(t)
+                if not docs:
+                    continue
+                idf = idfs[t]
+                for key, tf in docs.items():
+                    norm = k1 * (1.0 - b + b * self._doc_len[key] / avg_len)
+                    scores[key] = scores.get(key, 0.0) + idf * tf * (k1 + 1.0) / (tf + norm)
+                    matched[key] = matched.get(key, 0.0) + idf
+
+        best = sorted(scores, key=scores.__getitem__, reverse=True)[:top_k]
+        return [LexicalHit(k, scores[k], matched[k] / idf_total) for k in best]
+
+    def known_terms(self, query: str) -> int:
+        """How many distinct query terms occur in the index at all."""
+        return sum(1 for t in set(tokenize(query)) if t in self._postings)
+
+    # -----------------------------
+    # Persistence
+    # -----------------------------
+    def save(self, path: Path) -> None:
+        with self._lock:
+            raw = {
+                "format": LEXICAL_FORMAT,
+                "version": self.version,
+                "k1": self.k1,
+                "b": self.b,
+                "docs": self._doc_len,
+                "postings": self._postings,
+            }
+            tmp = path.with_suffix(path.suffix + ".tmp")
+            tmp.write_text(json.dumps(raw, separators=(",", ":")), encoding="utf-8")
+            os.replace(tmp, path)
+            self.dirty = False
+
+    @classmethod
+    def load(cls, path: Path) -> Optional["BM25Index"]:
+        try:
+            raw = json.loads(path.read_text(encoding="utf-8"))
+        except Exception:
+            return None
+        if raw.get("format") != LEXICAL_FORMAT:
+            return None
+        idx = cls(k1=float(raw.get("k1", 1.5)), b=float(raw.get("b", 0.75)))
+        idx.version = str(raw.get("version", ""))
+        idx._doc_len = {str(k): int(v) for k, v in (raw.get("docs") or {}).items()}
+        idx._postings = {str(t): {str(k): int(n) for k, n in d.items()} for t, d in (raw.get("postings") or {}).items()}
+        doc_terms: Dict[str, List[str]] = {k: [] for k in idx._doc_len}
+        for t, docs in idx._postings.items():
+            for k in docs:
+                doc_terms.setdefault(k, []).append(t)
+        idx._doc_terms = doc_terms
+        idx._total_len = sum(idx._doc_len.values())
+        return idx
+
+
+def reciprocal_rank_fusion(rankings: Sequence[Sequence[str]], k: int = 60) -> List[str]:
+    """Merge ranked key lists: score(key) = sum of 1 / (k + rank) over the lists it is in."""
+    scores: Dict[str, float] = {}
+    for ranking in rankings:
+        for rank, key in enumerate(ranking, start=1):
+            scores[key] = scores.get(key, 0.0) + 1.0 / (k + rank)
+    return sorted(scores, key=scores.__getitem__, reverse=True)
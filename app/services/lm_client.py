@@ -1,17 +1,257 @@
+import asyncio
+import json
+import math
+import threading
+import time
+from collections import deque
+from typing import AsyncIterator, Callable, Deque, Dict, Optional, Sequence
+
+import httpx
 import requests
 from app.core.config import settings
+from app.services.backends import BackendPool, is_backend_failure, parse_urls
+from app.services.metrics import REGISTRY, TOKEN_BUCKETS, observe_stage, timed
+from app.services.tokens import estimate_tokens
+
+LM_TOKENS = REGISTRY.counter(
+    "rag_lm_tokens_total",
+    "Tokens reported by the LM server (kind=cached: prompt tokens served from its prefix cache)",
+    ("call_site", "kind"),
+)
+LM_PROMPT_TOKENS = REGISTRY.histogram(
+    "rag_lm_prompt_tokens", "Prompt tokens per chat completion", TOKEN_BUCKETS, ("call_site",)
+)
+LM_COMPLETION_TOKENS = REGISTRY.histogram(
+    "rag_lm_completion_tokens", "Completion tokens per chat completion", TOKEN_BUCKETS, ("call_site",)
+)
+LM_MAX_TOKENS = REGISTRY.histogram(
+    "rag_lm_max_tokens", "max_tokens sent per chat completion (after LM_ADAPTIVE_MAX_TOKENS)", TOKEN_BUCKETS, ("call_site",)
+)
+LM_EARLY_STOPS = REGISTRY.counter(
+    "rag_lm_early_stops_total", "Streamed generations cancelled once a stop condition decided the output", ("call_site",)
+)
+
+# Called with the text generated so far; returns the final output once it is
+# decided (generation is then cancelled), None to keep generating.
+StopCondition = Callable[[str], Optional[str]]
+
+def stop_on_labels(labels: Sequence[str]) -> StopCondition:
+    """Decided as soon as one of `labels` appears (the first one in the text wins)."""
+    wanted = [l.lower() for l in labels]
+
+    def decide(text: str) -> Optional[str]:
+        low = text.lower()
+        found = [(low.find(l), i) for i, l in enumerate(wanted) if l in low]
+        return labels[min(found)[1]] if found else None
+    return decide
+
+def stop_on_text(target: str, anywhere: bool = False) -> StopCondition:
+    """
+    Decided (as `target`) once the output starts with it, ignoring case and
+    leading whitespace, or with anywhere=True once it occurs at all.
+    """
+    low_target = target.lower()
+
+    def decide(text: str) -> Optional[str]:
+        low = text.lower() if anywhere else text.lstrip().lower()
+        hit = low_target in low if anywhere else low.startswith(low_target)
+        return target if hit else None
+    return decide
+
+class CompletionBudget:
+    """
+    Adaptive max_tokens per call site: the `quantile` of the last `window`
+    completion lengths seen there times `headroom`, between `floor` and the
+    max_tokens the call site asks for (used as is until `min_samples`).
+    A completion cut off by the cap counts at the cap, so when more than
+    1 - quantile of them hit it the cap grows again by `headroom`. Streams
+    cancelled by an early stop are not observed: they ended where the stop
+    condition cut them, not where the model would have.
+    """
+    def __init__(self, window: int = 200, quantile: float = 0.99, headroom: float = 1.5,
+                 floor: int = 16, min_samples: int = 30):
+        self.window = window
+        self.quantile = quantile
+        self.headroom = headroom
+        self.floor = floor
+        self.min_samples = min_samples
+        self._seen: Dict[str, Deque[int]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, call_site: str, tokens: int) -> None:
+        with self._lock:
+            seen = self._seen.get(call_site)
+            if seen is None:
+                seen = self._seen[call_site] = deque(maxlen=self.window)
+            seen.append(int(tokens))
+
+    def max_tokens(self, call_site: str, limit: int) -> int:
+        with self._lock:
+            seen = sorted(self._seen.get(call_site, ()))
+        if len(seen) < self.min_samples:
+            return limit
+        q = seen[min(len(seen) - 1, int(self.quantile * len(seen)))]
+        return min(limit, max(self.floor, math.ceil(q * self.headroom)))
+
+completion_budget = CompletionBudget(
+    window=settings.LM_ADAPTIVE_WINDOW,
+    quantile=settings.LM_ADAPTIVE_QUANTILE,
+    headroom=settings.LM_ADAPTIVE_HEADROOM,
+    floor=settings.LM_ADAPTIVE_MIN_TOKENS,
+)
 
 _session = requests.Session()
 
-def chat_complete(
+# Shared async client: one connection pool with keep-alive for every LM Studio call
+_async_client: httpx.AsyncClient | None = None
+
+def get_async_client() -> httpx.AsyncClient:
+    global _async_client
+    if _async_client is None or _async_client.is_closed:
+        _async_client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=settings.LM_MAX_CONNECTIONS,
+                max_keepalive_connections=settings.LM_MAX_KEEPALIVE,
+                keepalive_expiry=settings.LM_KEEPALIVE_EXPIRY,
+            ),
+            timeout=httpx.Timeout(
+                settings.LM_TIMEOUT,
+                connect=settings.LM_CONNECT_TIMEOUT,
+                pool=settings.LM_POOL_TIMEOUT,
+            ),
+        )
+    return _async_client
+
+async def aclose_async_client() -> None:
+    global _async_client
+    if _async_client is not None:
+        await _async_client.aclose()
+        _async_client = None
+
+# Backend pools: chat and embeddings get separate limits even on the same server
+_chat_pool: BackendPool | None = None
+_embed_pool: BackendPool | None = None
+
+def chat_pool() -> BackendPool:
+    global _chat_pool
+    if _chat_pool is None:
+        _chat_pool = BackendPool(
+            "chat",
+            parse_urls(settings.LM_CHAT_URLS, settings.LM_URL),
+            max_concurrency=settings.LM_CHAT_MAX_CONCURRENCY,
+            max_queue=settings.LM_MAX_QUEUE,
+            queue_timeout=settings.LM_QUEUE_TIMEOUT,
+            fail_threshold=settings.LM_FAIL_THRESHOLD,
+            eject_seconds=settings.LM_EJECT_SECONDS,
+        )
+    return _chat_pool
+
+def embed_pool() -> BackendPool:
+    global _embed_pool
+    if _embed_pool is None:
+        _embed_pool = BackendPool(
+            "embed",
+            parse_urls(settings.LM_EMBED_URLS, settings.LM_URL),
+            max_concurrency=settings.LM_EMBED_MAX_CONCURRENCY,
+            max_queue=settings.LM_MAX_QUEUE,
+            queue_timeout=settings.LM_QUEUE_TIMEOUT,
+            fail_threshold=settings.LM_FAIL_THRESHOLD,
+            eject_seconds=settings.LM_EJECT_SECONDS,
+        )
+    return _embed_pool
+
+async def apost(pool: BackendPool, path: str, payload: dict) -> httpx.Response:
+    """POST to the least-loaded healthy backend of `pool` (raises PoolSaturated when full)."""
+    async with pool.acquire() as backend:
+        try:
+            r = await get_async_client().post(f"{backend.url}{path}", json=payload)
+            r.raise_for_status()
+        except Exception as e:
+            pool.report(backend, ok=not is_backend_failure(e))
+            raise
+        pool.report(backend, ok=True)
+        return r
+
+def post(pool: BackendPool, path: str, payload: dict) -> requests.Response:
+    """apost() for sync callers (index builds, the ingest CLI): same slots, queue and health reporting."""
+    with pool.acquire_blocking() as backend:
+        try:
+            r = _session.post(f"{backend.url}{path}", json=payload, timeout=settings.LM_TIMEOUT)
+            r.raise_for_status()
+        except Exception as e:
+            pool.report(backend, ok=not is_backend_failure(e))
+            raise
+        pool.report(backend, ok=True)
+        return r
+
+async def run_health_checks(interval: float) -> None:
+    """Active health checks for both pools, forever (cancel to stop)."""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await asyncio.gather(
+                chat_pool().check(get_async_client()),
+                embed_pool().check(get_async_client()),
+            )
+        except Exception as e:
+            print("LM HEALTH CHECK FAILED:", e)
+
+def _record_usage(call_site: str, usage: dict | None, timings: dict | None = None) -> None:
+    """
+    Token counts from the OpenAI-style usage field; prompt-cache hits from
+    usage.prompt_tokens_details.cached_tokens or llama.cpp's timings.cache_n,
+    and llama.cpp's prefill time (timings.prompt_ms) as stage llm_<call site>_prefill.
+    """
+    if usage:
+        prompt = int(usage.get("prompt_tokens") or 0)
+        completion = int(usage.get("completion_tokens") or 0)
+        LM_TOKENS.inc(prompt, call_site=call_site, kind="prompt")
+        LM_TOKENS.inc(completion, call_site=call_site, kind="completion")
+        LM_PROMPT_TOKENS.observe(prompt, call_site=call_site)
+        LM_COMPLETION_TOKENS.observe(completion, call_site=call_site)
+        completion_budget.observe(call_site, completion)
+    cached = ((usage or {}).get("prompt_tokens_details") or {}).get("cached_tokens")
+    if cached is None and timings:
+        cached = timings.get("cache_n")
+    if cached:
+        LM_TOKENS.inc(int(cached), call_site=call_site, kind="cached")
+    if timings and timings.get("prompt_ms") is not None:
+        observe_stage(f"llm_{call_site}_prefill", float(timings["prompt_ms"]) / 1000.0)
+
+def _constrain(payload: dict, choices: Sequence[str]) -> None:
+    """Restrict the output to one of `choices`, the way LM_CHOICE_CONSTRAINT says the server supports."""
+    mode = settings.LM_CHOICE_CONSTRAINT.strip().lower()
+    if mode == "grammar":
+        # llama.cpp server: GBNF grammar (string literals are JSON-quoted)
+        payload["grammar"] = "root ::= " + " | ".join(json.dumps(c) for c in choices)
+    elif mode == "json_schema":
+        # LM Studio / OpenAI structured output: {"label": "<choice>"}
+        payload["response_format"] = {
+            "type": "json_schema",
+            "json_schema": {
+                "name": "label",
+                "strict": True,
+                "schema": {
+                    "type": "object",
+                    "properties": {"label": {"type": "string", "enum": list(choices)}},
+                    "required": ["label"],
+                    "additionalProperties": False,
+                },
+            },
+        }
+    elif mode:
+        raise ValueError(f"Unknown LM_CHOICE_CONSTRAINT: {settings.LM_CHOICE_CONSTRAINT!r}")
+
+def _build_payload(
     system_text: str,
     user_text: str,
-    history_messages: list[dict] | None = None,
-    max_tokens: int = 200,
-    temperature: float = 0.2,
-) -> str:
-    url = f"{settings.LM_URL}/chat/completions"
-
+    history_messages: list[dict] | None,
+    max_tokens: int,
+    temperature: float,
+    call_site: str = "",
+    stop_sequences: Sequence[str] | None = None,
+    choices: Sequence[str] | None = None,
+) -> dict:
     messages: list[dict] = [{"role": "system", "content": system_text}]
 
     # Add history (sliding window)
@@ -25,14 +265,135 @@ def chat_complete(
     # Current user question always last
     messages.append({"role": "user", "content": user_text})
 
+    if call_site:
+        if settings.LM_ADAPTIVE_MAX_TOKENS:
+            max_tokens = completion_budget.max_tokens(call_site, max_tokens)
+        LM_MAX_TOKENS.observe(max_tokens, call_site=call_site)
     payload = {
         "model": settings.MODEL_NAME,
         "messages": messages,
         "temperature": float(temperature),
         "max_tokens": int(max_tokens),
     }
+    if stop_sequences:
+        payload["stop"] = list(stop_sequences)
+    if choices:
+        _constrain(payload, choices)
+    return payload
+
+def chat_complete(
+    system_text: str,
+    user_text: str,
+    history_messages: list[dict] | None = None,
+    max_tokens: int = 200,
+    temperature: float = 0.2,
+) -> str:
+    payload = _build_payload(system_text, user_text, history_messages, max_tokens, temperature)
+    data = post(chat_pool(), "/chat/completions", payload).json()
+    return (data["choices"][0]["message"]["content"] or "").strip()
+
+async def achat_complete(
+    system_text: str,
+    user_text: str,
+    history_messages: list[dict] | None = None,
+    max_tokens: int = 200,
+    temperature: float = 0.2,
+    call_site: str = "answer",
+    stop: StopCondition | None = None,
+    stop_sequences: Sequence[str] | None = None,
+    choices: Sequence[str] | None = None,
+) -> str:
+    """
+    The reply text. With `stop` the request is streamed instead and cancelled
+    as soon as `stop` decides the output, which is then returned.
+    """
+    if stop is not None:
+        parts: list[str] = []
+        async for delta in astream_chat(
+            system_text, user_text, history_messages, max_tokens, temperature, call_site, stop, stop_sequences, choices,
+        ):
+            parts.append(delta)
+        text = "".join(parts)
+        decided = stop(text)
+        return (decided if decided is not None else text).strip()
 
-    r = _session.post(url, json=payload, timeout=120)
-    r.raise_for_status()
+    payload = _build_payload(
+        system_text, user_text, history_messages, max_tokens, temperature, call_site, stop_sequences, choices,
+    )
+
+    with timed(f"llm_{call_site}"):
+        r = await apost(chat_pool(), "/chat/completions", payload)
     data = r.json()
-    return (data["choices"][0]["message"]["content"] or "").strip()
\ No newline at end of file
+    _record_usage(call_site, data.get("usage"), data.get("timings"))
+    return (data["choices"][0]["message"]["content"] or "").strip()
+
+async def astream_chat(
+    system_text: str,
+    user_text: str,
+    history_messages: list[dict] | None = None,
+    max_tokens: int = 200,
+    temperature: float = 0.2,
+    call_site: str = "answer",
+    stop: StopCondition | None = None,
+    stop_sequences: Sequence[str] | None = None,
+    choices: Sequence[str] | None = None,
+) -> AsyncIterator[str]:
+    """
+    Stream content deltas from /chat/completions (stream: true, SSE lines).
+    After each delta `stop` sees the text so far; once it decides, the
+    stream is closed, which makes the server stop generating (llama.cpp
+    and LM Studio cancel a request whose connection goes away).
+    """
+    payload = _build_payload(
+        system_text, user_text, history_messages, max_tokens, temperature, call_site, stop_sequences, choices,
+    )
+    payload["stream"] = True
+    # servers that support it send a final chunk with token usage
+    payload["stream_options"] = {"include_usage": True}
+    t0 = time.perf_counter()
+    first = True
+    text = ""
+    reported = False
+    stopped = False
+
+    pool = chat_pool()
+    async with pool.acquire() as backend:
+        try:
+            async with get_async_client().stream("POST", f"{backend.url}/chat/completions", json=payload) as r:
+                r.raise_for_status()
+                async for line in r.aiter_lines():
+                    if not line.startswith("data:"):
+                        continue
+                    data = line[5:].strip()
+                    if data == "[DONE]":
+                        break
+                    try:
+                        obj = json.loads(data)
+                    except ValueError:
+                        continue
+                    reported = reported or bool(obj.get("usage"))
+                    _record_usage(call_site, obj.get("usage"), obj.get("timings"))
+                    out = obj.get("choices") or [{}]
+                    delta = (out[0].get("delta") or {}).get("content")
+                    if delta:
+                        if first:
+                            observe_stage(f"llm_{call_site}_first_token", time.perf_counter() - t0)
+                            first = False
+                        text += delta
+                        yield delta
+                        if stop is not None and stop(text) is not None:
+                            LM_EARLY_STOPS.inc(call_site=call_site)
+                            stopped = True
+                            break
+        except Exception as e:
+            pool.report(backend, ok=not is_backend_failure(e))
+            raise
+        pool.report(backend, ok=True)
+        observe_stage(f"llm_{call_site}", time.perf_counter() - t0)
+        if not reported and not stopped:
+            # a server without stream usage: count what arrived. An early-stopped
+            # stream is left out: its length is where `stop` cut it, not where the
+            # model would have ended, and learning it would shrink the cap below
+            # what finished completions need
+            completion_budget.observe(call_site, estimate_tokens(text))
+
@@ -0,0 +1,68 @@
+from __future__ import annotations
+import hashlib
+import json
+import os
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, Optional
+
+MANIFEST_VERSION = 1
+
+
+def content_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8", errors="ignore")).hexdigest()
+
+
+@dataclass
+class FileEntry:
+    hash: str
+    chunks: Dict[str, str] = field(default_factory=dict)  # chunk key -> chunk text hash
+
+
+@dataclass
+class IndexManifest:
+    """
+    Content hashes of everything currently stored in the vector collection.
+    Persisted as JSON next to the Chroma collection:
+      - fingerprint: settings that change every vector (embed model, chunking)
+      - files: source -> file hash + per-chunk hashes
+    """
+    fingerprint: Dict[str, object] = field(default_factory=dict)
+    files: Dict[str, FileEntry] = field(default_factory=dict)
+
+    @property
+    def chunk_count(self) -> int:
+        return sum(len(f.chunks) for f in self.files.values())
+
+    @property
+    def version(self) -> str:
+        """Changes whenever any stored vector would change."""
+        parts = [json.dumps(self.fingerprint, sort_keys=True)]
+        for src in sorted(self.files):
+            parts.extend(f"{k}={h}" for k, h in sorted(self.files[src].chunks.items()))
+        return content_hash("\n".join(parts))[:16]
+
+    @classmethod
+    def load(cls, path: Path) -> Optional["IndexManifest"]:
+        try:
+            raw = json.loads(path.read_text(encoding="utf-8"))
+        except Exception:
+            return None
+        if raw.get("version") != MANIFEST_VERSION:
+            return None
+        files = {
+            str(src): FileEntry(hash=str(e.get("hash", "")), chunks=dict(e.get("chunks") or {}))
+            for src, e in (raw.get("files") or {}).items()
+        }
+        return cls(fingerprint=dict(raw.get("fingerprint") or {}), files=files)
+
+    def save(self, path: Path) -> None:
+        raw = {
+            "version": MANIFEST_VERSION,
+            "fingerprint": self.fingerprint,
+            "files": {src: {"hash": e.hash, "chunks": e.chunks} for src, e in self.files.items()},
+        }
+        # write + rename so a crash never leaves a half-written manifest
+        tmp = path.with_suffix(path.suffix + ".tmp")
+        tmp.write_text(json.dumps(raw, indent=1, sort_keys=True), encoding="utf-8")
+        os.replace(tmp, path)
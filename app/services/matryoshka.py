@@ -0,0 +1,132 @@
+"""
+Two-stage (Matryoshka) vector search, shared by the vector backends.
+
+Matryoshka-trained embedding models (nomic-embed-text-v1.5 among them)
+pack most of the meaning into the leading dimensions, so the first `dim`
+values of an embedding, L2-normalised again, are a usable embedding on
+their own. A query first scans those short vectors (optionally int8 or
+1-bit quantised) for a wide candidate set, and only the candidates are
+re-ranked with the full vectors before the TOP_K cut.
+"""
+from __future__ import annotations
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+FIRST_STAGE_QUANTIZATIONS = ("float32", "int8", "binary")
+
+_BLOCK = 16384  # rows per step when int8 codes are scored
+
+_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+def truncate(vectors: np.ndarray, dim: int) -> np.ndarray:
+    """The first `dim` columns of (N, D) vectors, L2-normalised again (float32)."""
+    v = np.array(vectors[:, :dim], dtype=np.float32)
+    v /= np.linalg.norm(v, axis=1, keepdims=True) + 1e-12
+    return v
+
+
+def quantize(unit: np.ndarray, quantization: str) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+    """
+    (codes, per-row scales) of unit vectors:
+      float32  as is
+      int8     rows scaled to [-127, 127]; scales undo it
+      binary   sign bits packed 8 per byte (no scales)
+    """
+    if quantization == "float32":
+        return unit.astype(np.float32), None
+    if quantization == "int8":
+        scales = (np.abs(unit).max(axis=1) / 127.0).astype(np.float32) if len(unit) else np.zeros(0, np.float32)
+        return np.round(unit / np.maximum(scales, 1e-12)[:, None]).astype(np.int8), scales
+    if quantization == "binary":
+        return np.packbits(unit > 0, axis=1), None
+    raise ValueError(f"Unknown quantization: {quantization!r}")
+
+
+def scores(queries: np.ndarray, codes: np.ndarray, scales: Optional[np.ndarray], quantization: str) -> np.ndarray:
+    """(Q, N) first-stage scores of truncated unit queries against stored codes; higher is closer."""
+    if quantization == "binary":
+        bits = np.packbits(queries > 0, axis=1)
+        # minus the Hamming distance: XOR, then a popcount lookup per byte
+        return np.stack([
+            -_POPCOUNT[np.bitwise_xor(codes, b)].sum(axis=1, dtype=np.int32) for b in bits
+        ]).astype(np.float32)
+    if codes.dtype == np.float32:
+        return queries @ codes.T
+    # int8: cast a block of rows at a time, so the product runs in BLAS without a float copy of everything
+    s = np.empty((len(queries), codes.shape[0]), dtype=np.float32)
+    for i in range(0, codes.shape[0], _BLOCK):
+        s[:, i:i + _BLOCK] = queries @ np.asarray(codes[i:i + _BLOCK], dtype=np.float32).T
+    s *= scales[None, :]
+    return s
+
+
+def candidates(first_stage: np.ndarray, n: int) -> np.ndarray:
+    """(Q, n) row numbers of the n best first-stage scores per query, ascending (not by score)."""
+    rows = first_stage.shape[1]
+    if n >= rows:
+        return np.tile(np.arange(rows), (first_stage.shape[0], 1))
+    top = np.argpartition(-first_stage, n - 1, axis=1)[:, :n]
+    top.sort(axis=1)  # the full vectors are then read front to back
+    return top
+
+
+class FullVectorTable:
+    """
+    Full-dimension vectors by chunk id in a SQLite file, for backends whose
+    own index holds only the truncated ones. Read only for the candidates
+    of a query, so it costs disk, not memory.
+    """
+    _MAX_VARS = 900  # SQLite host parameters per statement, with room to spare
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._con: sqlite3.Connection | None = sqlite3.connect(str(path), check_same_thread=False)
+        self._con.execute("CREATE TABLE IF NOT EXISTS vectors (id TEXT PRIMARY KEY, v BLOB NOT NULL)")
+        self._con.commit()
+
+    def _db(self) -> sqlite3.Connection:
+        if self._con is None:
+            raise RuntimeError(f"{self.path} is closed")
+        return self._con
+
+    def count(self) -> int:
+        with self._lock:
+            return int(self._db().execute("SELECT COUNT(*) FROM vectors").fetchone()[0])
+
+    def reset(self) -> None:
+        with self._lock:
+            self._db().execute("DELETE FROM vectors")
+            self._db().commit()
+
+    def upsert(self, ids: List[str], vectors: np.ndarray) -> None:
+        rows = [(k, np.asarray(v, dtype=np.float32).tobytes()) for k, v in zip(ids, vectors)]
+        with self._lock:
+            self._db().executemany("INSERT OR REPLACE INTO vectors (id, v) VALUES (?, ?)", rows)
+            self._db().commit()
+
+    def delete(self, ids: List[str]) -> None:
+        with self._lock:
+            self._db().executemany("DELETE FROM vectors WHERE id = ?", [(k,) for k in ids])
+            self._db().commit()
+
+    def get(self, ids: List[str]) -> Dict[str, np.ndarray]:
+        out: Dict[str, np.ndarray] = {}
+        with self._lock:
+            for i in range(0, len(ids), self._MAX_VARS):
+                part = ids[i:i + self._MAX_VARS]
+                marks = ",".join("?" * len(part))
+                for k, blob in self._db().execute(f"SELECT id, v FROM vectors WHERE id IN ({marks})", part):
+                    out[k] = np.frombuffer(blob, dtype=np.float32)
+        return out
+
+    def close(self) -> None:
+        with self._lock:
+            if self._con is not None:
+                self._con.close()
+                self._con = None
@@ -1,30 +1,285 @@
 from __future__ import annotations
+import asyncio
+import json
+import sqlite3
+import sys
+import threading
+import time
+from collections import OrderedDict, deque
 from dataclasses import dataclass, field
-from typing import Dict, List
+from pathlib import Path
+from typing import Deque, List, Optional, Protocol, Tuple, Union
+
+Message = dict  # {"role": "user"|"assistant", "content": "...", "provenance": {...} (assistant, optional)}
+
+# Stored form: (role, content), or (role, content, provenance) for assistant
+# turns answered from retrieved chunks. Roles are interned string constants,
+# so a message costs one small tuple plus its text.
+StoredMessage = Union[Tuple[str, str], Tuple[str, str, dict]]
+
+USER = sys.intern("user")
+ASSISTANT = sys.intern("assistant")
+
+
+class MemoryBackend(Protocol):
+    # True when get/append do blocking I/O: async callers then run them in a thread
+    blocking: bool
+
+    def get(self, session_id: str) -> List[StoredMessage]: ...
+
+    def append(self, session_id: str, msg: StoredMessage, max_messages: int) -> None: ...
+
+    def stats(self) -> dict: ...
+
+
+def _approx_size(m: StoredMessage) -> int:
+    return sys.getsizeof(m) + sys.getsizeof(m[1]) + (sys.getsizeof(m[2]) if len(m) > 2 else 0)
+
+
+class _Session:
+    __slots__ = ("messages", "last_seen")
+
+    def __init__(self, max_messages: int):
+        self.messages: Deque[StoredMessage] = deque(maxlen=max_messages)
+        self.last_seen = time.monotonic()
+
+
+class InProcessMemoryBackend:
+    """
+    Per-process LRU of sessions with a global session cap and idle-TTL eviction.
+    """
+    blocking = False
+
+    def __init__(self, max_sessions: int = 10000, idle_ttl_seconds: float = 3600.0):
+        self.max_sessions = max_sessions
+        self.idle_ttl_seconds = idle_ttl_seconds
+        self._sessions: "OrderedDict[str, _Session]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.evicted = 0
+        # running totals, so stats() (scraped by /metrics) does not walk every message
+        self._messages = 0
+        self._bytes = 0
+
+    def _evict(self, now: float) -> None:
+        # OrderedDict is kept in last-seen order: oldest first
+        while self._sessions:
+            sid, s = next(iter(self._sessions.items()))
+            if len(self._sessions) > self.max_sessions or now - s.last_seen > self.idle_ttl_seconds:
+                del self._sessions[sid]
+                self.evicted += 1
+                self._messages -= len(s.messages)
+                self._bytes -= sum(_approx_size(m) for m in s.messages)
+            else:
+                break
+
+    def get(self, session_id: str) -> List[StoredMessage]:
+        now = time.monotonic()
+        with self._lock:
+            self._evict(now)
+            s = self._sessions.get(session_id)
+            return list(s.messages) if s is not None else []
+
+    def append(self, session_id: str, msg: StoredMessage, max_messages: int) -> None:
+        now = time.monotonic()
+        with self._lock:
+            # before the lookup: an idle-expired session must start over, not come back
+            self._evict(now)
+            s = self._sessions.get(session_id)
+            if s is None:
+                s = self._sessions[session_id] = _Session(max_messages)
+            if len(s.messages) == s.messages.maxlen:  # the append drops the oldest
+                self._messages -= 1
+                self._bytes -= _approx_size(s.messages[0])
+            s.messages.append(msg)
+            self._messages += 1
+            self._bytes += _approx_size(msg)
+            s.last_seen = now
+            self._sessions.move_to_end(session_id)
+            self._evict(now)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "backend": "memory",
+                "sessions": len(self._sessions),
+                "messages": self._messages,
+                "approx_bytes": self._bytes,
+                "evicted": self.evicted,
+            }
+
+
+class SQLiteMemoryBackend:
+    """
+    Session history in a SQLite file (WAL mode), so several uvicorn workers
+    share it and it survives restarts. Same cap/TTL rules as the in-process backend;
+    eviction runs every `sweep_every` appends.
+    """
+    blocking = True
+
+    def __init__(
+        self,
+        path: Path,
+        max_sessions: int = 10000,
+        idle_ttl_seconds: float = 3600.0,
+        sweep_every: int = 100,
+    ):
+        self.path = path
+        self.max_sessions = max_sessions
+        self.idle_ttl_seconds = idle_ttl_seconds
+        self.sweep_every = sweep_every
+        self._appends = 0
+        self._lock = threading.Lock()
+
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._con = sqlite3.connect(str(path), check_same_thread=False, timeout=10)
+        self._con.execute("PRAGMA journal_mode=WAL")
+        self._con.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS sessions (
+                session_id TEXT PRIMARY KEY,
+                last_seen REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS sessions_last_seen ON sessions(last_seen);
+            CREATE TABLE IF NOT EXISTS messages (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                session_id TEXT NOT NULL,
+                role TEXT NOT NULL,
+                content TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS messages_session ON messages(session_id, seq);
+            """
+        )
+        columns = {r[1] for r in self._con.execute("PRAGMA table_info(messages)")}
+        if "provenance" not in columns:
+            # files written before assistant turns kept their provenance
+            self._con.execute("ALTER TABLE messages ADD COLUMN provenance TEXT")
+        self._con.commit()
+
+    def get(self, session_id: str) -> List[StoredMessage]:
+        cutoff = time.time() - self.idle_ttl_seconds
+        with self._lock:
+            row = self._con.execute(
+                "SELECT last_seen FROM sessions WHERE session_id = ?", (session_id,)
+            ).fetchone()
+            if row is None or row[0] < cutoff:
+                return []
+            rows = self._con.execute(
+                "SELECT role, content, provenance FROM messages WHERE session_id = ? ORDER BY seq",
+                (session_id,),
+            ).fetchall()
+        return [
+            (USER if r == USER else ASSISTANT, c, json.loads(p)) if p else (USER if r == USER else ASSISTANT, c)
+            for r, c, p in rows
+        ]
+
+    def append(self, session_id: str, msg: StoredMessage, max_messages: int) -> None:
+        now = time.time()
+        with self._lock, self._con:
+            # a session idle past the TTL starts over (get() already treats it as
+            # empty); the sweep that deletes it may not have run yet
+            self._con.execute(
+                "DELETE FROM messages WHERE session_id = ? AND EXISTS ("
+                " SELECT 1 FROM sessions WHERE session_id = ? AND last_seen < ?)",
+                (session_id, session_id, now - self.idle_ttl_seconds),
+            )
+            self._con.execute(
+                "INSERT INTO sessions (session_id, last_seen) VALUES (?, ?) "
+                "ON CONFLICT(session_id) DO UPDATE SET last_seen = excluded.last_seen",
+                (session_id, now),
+            )
+            self._con.execute(
+                "INSERT INTO messages (session_id, role, content, provenance) VALUES (?, ?, ?, ?)",
+                (session_id, msg[0], msg[1], json.dumps(msg[2], separators=(",", ":")) if len(msg) > 2 else None),
+            )
+            # keep only last N messages
+            self._con.execute(
+                "DELETE FROM messages WHERE session_id = ? AND seq NOT IN ("
+                " SELECT seq FROM messages WHERE session_id = ? ORDER BY seq DESC LIMIT ?)",
+                (session_id, session_id, max_messages),
+            )
+            self._appends += 1
+            if self._appends % self.sweep_every == 0:
+                self._sweep(now)
+
+    def _sweep(self, now: float) -> None:
+        self._con.execute(
+            "DELETE FROM sessions WHERE last_seen < ? OR session_id IN ("
+            " SELECT session_id FROM sessions ORDER BY last_seen DESC LIMIT -1 OFFSET ?)",
+            (now - self.idle_ttl_seconds, self.max_sessions),
+        )
+        self._con.execute(
+            "DELETE FROM messages WHERE session_id NOT IN (SELECT session_id FROM sessions)"
+        )
+
+    def stats(self) -> dict:
+        with self._lock:
+            sessions = self._con.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+            messages, text_bytes = self._con.execute(
+                "SELECT COUNT(*), COALESCE(SUM(LENGTH(content)), 0) FROM messages"
+            ).fetchone()
+        try:
+            file_bytes = self.path.stat().st_size
+        except OSError:
+            file_bytes = 0
+        return {
+            "backend": "sqlite",
+            "sessions": sessions,
+            "messages": messages,
+            "approx_bytes": text_bytes,
+            "file_bytes": file_bytes,
+        }
 
-Message = dict  # {"role": "user"|"assistant", "content": "..."}
 
 @dataclass
 class SlidingWindowMemory:
     max_turns: int = 10
-    _store: Dict[str, List[Message]] = field(default_factory=dict)
+    backend: MemoryBackend = field(default_factory=InProcessMemoryBackend)
 
     @property
     def max_messages(self) -> int:
         return self.max_turns * 2  # 10 turns = 20 messages
 
     def get(self, session_id: str) -> List[Message]:
-        return self._store.get(session_id, [])
+        out = []
+        for m in self.backend.get(session_id):
+            msg = {"role": m[0], "content": m[1]}
+            if len(m) > 2:
+                msg["provenance"] = m[2]
+            out.append(msg)
+        return out
 
     def add_user(self, session_id: str, text: str) -> None:
-        self._append(session_id, {"role": "user", "content": text})
+        self.backend.append(session_id, (USER, text), self.max_messages)
+
+    def add_assistant(self, session_id: str, text: str, provenance: Optional[dict] = None) -> None:
+        """provenance: the retrieved chunks the answer came from (see rag.Provenance)."""
+        msg: StoredMessage = (ASSISTANT, text, provenance) if provenance else (ASSISTANT, text)
+        self.backend.append(session_id, msg, self.max_messages)
+
+    def stats(self) -> dict:
+        return self.backend.stats()
+
+    # For the async routes: a blocking backend (SQLite) runs in a worker
+    # thread so the event loop keeps serving other requests meanwhile
+    async def _call(self, fn, *args):
+        if getattr(self.backend, "blocking", False):
+            return await asyncio.to_thread(fn, *args)
+        return fn(*args)
+
+    async def aget(self, session_id: str) -> List[Message]:
+        return await self._call(self.get, session_id)
+
+    async def aadd_user(self, session_id: str, text: str) -> None:
+        await self._call(self.add_user, session_id, text)
+
+    async def aadd_assistant(self, session_id: str, text: str, provenance: Optional[dict] = None) -> None:
+        await self._call(self.add_assistant, session_id, text, provenance)
 
-    def add_assistant(self, session_id: str, text: str) -> None:
-        self._append(session_id, {"role": "assistant", "content": text})
 
-    def _append(self, session_id: str, msg: Message) -> None:
-        hist = self._store.setdefault(session_id, [])
-        hist.append(msg)
-        # keep only last N messages
-        if len(hist) > self.max_messages:
-            del hist[:-self.max_messages]
\ No newline at end of file
+def create_memory_backend(kind: str, storage_dir: Path, sqlite_file: str, max_sessions: int, idle_ttl_seconds: float) -> MemoryBackend:
+    kind = (kind or "memory").strip().lower()
+    if kind == "sqlite":
+        return SQLiteMemoryBackend(storage_dir / sqlite_file, max_sessions, idle_ttl_seconds)
+    if kind == "memory":
+        return InProcessMemoryBackend(max_sessions, idle_ttl_seconds)
+    raise ValueError(f"Unknown MEMORY_BACKEND: {kind!r}")
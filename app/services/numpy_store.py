@@ -0,0 +1,384 @@
+from __future__ import annotations
+import json
+import os
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from app.services.chunking import Chunk
+from app.services.matryoshka import FIRST_STAGE_QUANTIZATIONS, candidates, quantize, scores, truncate
+from app.services.vectorstore import SearchHit, chunk_key
+
+
+class NumpyVectorDB:
+    """
+    In-process brute-force vector store for small/medium knowledge bases.
+    Files in persist_dir:
+      - <name>.vectors.npy : unit-normalised float32 (or int8) matrix, memory-mapped
+      - <name>.scales.npy  : per-row dequantisation scale (int8 only)
+      - <name>.meta.json   : ids, documents and metadata, row aligned
+      - <name>.coarse.npy  : first_stage_dim-dim copy of the rows (two-stage search only),
+                             float32, int8 (+ <name>.coarse_scales.npy) or packed sign bits
+      - <name>.staged.f32  : rows written since the last flush (raw float32, append-only)
+    upsert() and delete() only stage: new vectors are appended to the staged
+    file and the chunks kept in memory, so an indexing batch costs its own
+    size. flush() merges them into the files above in one streaming pass;
+    reads flush first, so they always see every write.
+    A query is one matmul plus argpartition. With first_stage_dim set it
+    scans the small coarse matrix for `candidates` rows and re-ranks only
+    those with the full vectors, so most of the memory-mapped full matrix
+    is never paged in.
+
+    Similarity is 1 - squared L2 distance of the unit vectors (= 2*cos - 1),
+    which is what ChromaVectorDB returns for its default l2 space,
+    so MIN_SIMILARITY keeps its meaning across backends.
+    """
+    def __init__(
+        self,
+        persist_dir: str,
+        collection_name: str = "uniq_kb",
+        quantization: str = "float32",
+        first_stage_dim: int = 0,
+        first_stage_quantization: str = "float32",
+        candidates: int = 200,
+    ):
+        if quantization not in ("float32", "int8"):
+            raise ValueError(f"Unknown quantization: {quantization!r}")
+        if first_stage_quantization not in FIRST_STAGE_QUANTIZATIONS:
+            raise ValueError(f"Unknown first stage quantization: {first_stage_quantization!r}")
+        self.persist_dir = persist_dir
+        self.collection_name = collection_name
+        self.quantization = quantization
+        self.first_stage_dim = max(0, first_stage_dim)
+        self.first_stage_quantization = first_stage_quantization
+        self.candidates = candidates
+
+        root = Path(persist_dir)
+        root.mkdir(parents=True, exist_ok=True)
+        self._vectors_path = root / f"{collection_name}.vectors.npy"
+        self._scales_path = root / f"{collection_name}.scales.npy"
+        self._meta_path = root / f"{collection_name}.meta.json"
+        self._coarse_path = root / f"{collection_name}.coarse.npy"
+        self._coarse_scales_path = root / f"{collection_name}.coarse_scales.npy"
+        self._staged_path = root / f"{collection_name}.staged.f32"
+
+        self._lock = threading.Lock()
+        self._ids: List[str] = []
+        self._chunks: List[Chunk] = []
+        self._row: Dict[str, int] = {}
+        self._vectors: np.ndarray | None = None  # (N, D) float32 or int8
+        self._scales: np.ndarray | None = None   # (N,) float32, int8 only
+        self._coarse: np.ndarray | None = None         # (N, d) or (N, d/8) packed bits; None = one stage
+        self._coarse_scales: np.ndarray | None = None  # (N,) float32, int8 first stage only
+
+        # writes not flushed yet: chunk key -> (chunk, row in the staged file); keys to drop
+        self._staged: Dict[str, tuple[Chunk, int]] = {}
+        self._staged_rows = 0
+        self._staged_dim = 0
+        self._staged_file = None
+        self._deleted: set[str] = set()
+        self._dirty = False
+        # left over from an interrupted build: its chunks were never flushed
+        self._staged_path.unlink(missing_ok=True)
+        self._load()
+
+    # -----------------------------
+    # Persistence
+    # -----------------------------
+    def _load(self) -> None:
+        try:
+            meta = json.loads(self._meta_path.read_text(encoding="utf-8"))
+            vectors = np.load(self._vectors_path, mmap_mode="r")
+            scales = np.load(self._scales_path, mmap_mode="r") if meta.get("quantization") == "int8" else None
+        except Exception:
+            self._set([], [], None, None)
+            return
+
+        if meta.get("quantization") != self.quantization or len(meta.get("ids", [])) != vectors.shape[0]:
+            # stored with other settings: start empty, the indexer re-embeds
+            self._set([], [], None, None)
+            return
+
+        chunks = [
+            Chunk(
+                source=str(m.get("source", "")),
+                chunk_id=int(m.get("chunk_id", 0)),
+                text=str(doc or ""),
+                start=int(m.get("start", -1)),
+                end=int(m.get("end", -1)),
+            )
+            for doc, m in zip(meta.get("documents", []), meta.get("metadatas", []))
+        ]
+        self._set(list(meta["ids"]), chunks, vectors, scales, *self._load_coarse(meta, vectors, scales))
+
+    def _set(self, ids, chunks, vectors, scales, coarse=None, coarse_scales=None) -> None:
+        self._ids = ids
+        self._chunks = chunks
+        self._row = {k: i for i, k in enumerate(ids)}
+        self._vectors = vectors
+        self._scales = scales
+        self._coarse = coarse
+        self._coarse_scales = coarse_scales
+
+    def _first_stage(self, dim: int) -> dict | None:
+        """The coarse matrix this store wants for `dim`-dimensional rows (None: search in one stage)."""
+        if not 0 < self.first_stage_dim < dim:
+            return None
+        return {"dim": self.first_stage_dim, "quantization": self.first_stage_quantization}
+
+    def _load_coarse(self, meta: dict, vectors: np.ndarray, scales) -> tuple:
+        wanted = self._first_stage(vectors.shape[1]) if vectors.ndim == 2 else None
+        if wanted is None or vectors.shape[0] == 0:
+            return None, None
+        if meta.get("first_stage") == wanted:
+            try:
+                coarse = np.load(self._coarse_path, mmap_mode="r")
+                coarse_scales = np.load(self._coarse_scales_path, mmap_mode="r") if wanted["quantization"] == "int8" else None
+                if coarse.shape[0] == vectors.shape[0]:
+                    return coarse, coarse_scales
+            except Exception:
+                pass
+        # written with other first-stage settings: derive it in memory (published files stay as they are)
+        return self._derive_coarse(vectors, scales)
+
+    def _derive_coarse(self, vectors: np.ndarray, scales, block: int = 65536) -> tuple:
+        parts, part_scales = [], []
+        for i in range(0, vectors.shape[0], block):
+            rows = np.asarray(vectors[i:i + block], dtype=np.float32)
+            if scales is not None:
+                rows = rows * np.asarray(scales[i:i + block])[:, None]
+            codes, s = quantize(truncate(rows, self.first_stage_dim), self.first_stage_quantization)
+            parts.append(codes)
+            part_scales.append(s)
+        coarse_scales = np.concatenate(part_scales) if part_scales[0] is not None else None
+        return np.concatenate(parts), coarse_scales
+
+    def _dim(self) -> int:
+        if self._vectors is not None and self._vectors.ndim == 2 and self._vectors.shape[0]:
+            return int(self._vectors.shape[1])
+        return self._staged_dim
+
+    def _stored_rows(self, rows: np.ndarray) -> np.ndarray:
+        """Stored rows (ascending row numbers) back as float32 unit vectors."""
+        v = np.asarray(self._vectors[rows], dtype=np.float32)
+        if self._scales is not None:
+            v *= np.asarray(self._scales)[rows][:, None]
+        return v
+
+    def _merge(self, block: int = 16384) -> None:
+        """
+        Write the stored rows (minus deleted ones, staged replacements in
+        place) followed by the new staged rows as new files, `block` rows at
+        a time, so memory stays at one block however large the index is.
+        """
+        if self._staged_file is not None:
+            self._staged_file.close()
+            self._staged_file = None
+        dim = self._dim()
+        staged = (
+            np.memmap(self._staged_path, dtype=np.float32, mode="r", shape=(self._staged_rows, dim))
+            if self._staged_rows else None
+        )
+
+        ids: List[str] = []
+        chunks: List[Chunk] = []
+        source: List[int] = []  # >= 0: stored row, < 0: staged row -1 - source
+        for i, k in enumerate(self._ids):
+            if k in self._deleted:
+                continue
+            hit = self._staged.get(k)
+            ids.append(k)
+            chunks.append(hit[0] if hit is not None else self._chunks[i])
+            source.append(-1 - hit[1] if hit is not None else i)
+        for k, (c, row) in self._staged.items():
+            if k not in self._row:
+                ids.append(k)
+                chunks.append(c)
+                source.append(-1 - row)
+        src = np.asarray(source, dtype=np.int64)
+        n = len(ids)
+        first_stage = self._first_stage(dim) if n else None
+
+        written: List[tuple[Path, Path]] = []  # (tmp, final)
+
+        def new_file(path: Path, shape: tuple, dtype) -> np.ndarray:
+            tmp = path.with_name(path.name + ".tmp")
+            written.append((tmp, path))
+            return np.lib.format.open_memmap(tmp, mode="w+", dtype=dtype, shape=shape)
+
+        stored = new_file(self._vectors_path, (n, dim), np.int8 if self.quantization == "int8" else np.float32)
+        scales = new_file(self._scales_path, (n,), np.float32) if self.quantization == "int8" else None
+        coarse = coarse_scales = None
+        for i in range(0, n, block):
+            part = src[i:i + block]
+            j = i + len(part)
+            unit = np.empty((len(part), dim), dtype=np.float32)
+            old = part >= 0
+            if old.any():
+                unit[old] = self._stored_rows(part[old])
+            if not old.all():
+                unit[~old] = staged[-1 - part[~old]]
+
+            stored[i:j], s = quantize(unit, self.quantization)
+            if scales is not None:
+                scales[i:j] = s
+            if first_stage is not None:
+                codes, s = quantize(truncate(unit, self.first_stage_dim), self.first_stage_quantization)
+                if coarse is None:
+                    coarse = new_file(self._coarse_path, (n, codes.shape[1]), codes.dtype)
+                    if s is not None:
+                        coarse_scales = new_file(self._coarse_scales_path, (n,), np.float32)
+                coarse[i:j] = codes
+                if coarse_scales is not None:
+                    coarse_scales[i:j] = s
+        for arr in (stored, scales, coarse, coarse_scales):
+            if arr is not None:
+                arr.flush()
+        del staged, stored, scales, coarse, coarse_scales
+
+        # drop the maps of the files about to be replaced (Windows cannot replace mapped files)
+        self._set([], [], None, None)
+        for tmp, path in written:
+            os.replace(tmp, path)
+        meta = {
+            "quantization": self.quantization,
+            "first_stage": first_stage,
+            "ids": ids,
+            "documents": [c.text for c in chunks],
+            "metadatas": [{"source": c.source, "chunk_id": c.chunk_id, "start": c.start, "end": c.end} for c in chunks],
+        }
+        tmp = self._meta_path.with_name(self._meta_path.name + ".tmp")
+        tmp.write_text(json.dumps(meta), encoding="utf-8")
+        os.replace(tmp, self._meta_path)
+
+        self._clear_staged()
+        self._load()
+
+    def _clear_staged(self) -> None:
+        if self._staged_file is not None:
+            self._staged_file.close()
+            self._staged_file = None
+        self._staged_path.unlink(missing_ok=True)
+        self._staged = {}
+        self._staged_rows = 0
+        self._staged_dim = 0
+        self._deleted = set()
+        self._dirty = False
+
+    def flush(self) -> None:
+        """Write staged upserts and deletes to the files (no-op when there are none)."""
+        if not self._dirty:
+            return
+        with self._lock:
+            if self._dirty:
+                self._merge()
+
+    # -----------------------------
+    # VectorStore
+    # -----------------------------
+    def reset(self) -> None:
+        with self._lock:
+            self._clear_staged()
+            for p in (self._vectors_path, self._scales_path, self._meta_path, self._coarse_path, self._coarse_scales_path):
+                try:
+                    p.unlink()
+                except FileNotFoundError:
+                    pass
+            self._set([], [], None, None)
+
+    def count(self) -> int:
+        self.flush()
+        return len(self._ids)
+
+    def close(self) -> None:
+        self.flush()
+        # drop the memory maps (Windows cannot delete mapped files)
+        with self._lock:
+            self._set([], [], None, None)
+
+    def delete(self, ids: List[str]) -> None:
+        with self._lock:
+            for k in ids:
+                if self._staged.pop(k, None) is not None or k in self._row:
+                    self._dirty = True
+                if k in self._row:
+                    self._deleted.add(k)
+
+    def upsert(self, chunks: List[Chunk], embeddings: List[list[float]]) -> None:
+        if not chunks:
+            return
+        new = np.asarray(embeddings, dtype=np.float32)
+        new /= np.linalg.norm(new, axis=1, keepdims=True) + 1e-12
+
+        with self._lock:
+            dim = self._dim()
+            if dim and dim != new.shape[1]:
+                raise ValueError(f"Embedding dimension {new.shape[1]} != stored {dim}")
+            if self._staged_file is None:
+                self._staged_file = open(self._staged_path, "ab")
+            self._staged_file.write(np.ascontiguousarray(new).tobytes())
+            self._staged_dim = new.shape[1]
+            for c in chunks:
+                k = chunk_key(c)
+                self._staged[k] = (c, self._staged_rows)
+                self._deleted.discard(k)
+                self._staged_rows += 1
+            self._dirty = True
+
+    def get_chunks(self, ids: List[str]) -> List[Optional[Chunk]]:
+        self.flush()
+        chunks, rows = self._chunks, self._row
+        return [chunks[rows[i]] if i in rows else None for i in ids]
+
+    def query(self, query_embedding: list[float], top_k: int) -> List[SearchHit]:
+        return self.query_many([query_embedding], top_k)[0]
+
+    def query_many(self, query_embeddings: List[list[float]], top_k: int) -> List[List[SearchHit]]:
+        """
+        All queries in one (Q, D) x (D, N) matmul; top-k per row via argpartition.
+        Two-stage: one (Q, d) x (d, N) pass over the coarse matrix, then the
+        full vectors of the `candidates` best rows per query only.
+        """
+        if not query_embeddings:
+            return []
+        self.flush()
+        vectors, scales, chunks = self._vectors, self._scales, self._chunks
+        coarse, coarse_scales = self._coarse, self._coarse_scales
+        n = len(chunks)
+        if vectors is None or n == 0 or top_k <= 0:
+            return [[] for _ in query_embeddings]
+
+        q = np.asarray(query_embeddings, dtype=np.float32)
+        q /= np.linalg.norm(q, axis=1, keepdims=True) + 1e-12
+
+        rows = None  # (Q, C) rows the columns of cos refer to; None = all rows
+        if coarse is not None and top_k <= self.candidates < n:
+            first = scores(truncate(q, self.first_stage_dim), coarse, coarse_scales, self.first_stage_quantization)
+            rows = candidates(first, self.candidates)
+            full = np.asarray(vectors[rows.ravel()], dtype=np.float32).reshape(rows.shape + (-1,))
+            if scales is not None:
+                full *= np.asarray(scales)[rows][..., None]
+            cos = np.einsum("qd,qcd->qc", q, full)
+        else:
+            cos = q @ vectors.T
+            if scales is not None:
+                cos *= scales[None, :]
+
+        width = cos.shape[1]
+        k = min(top_k, width)
+        if k < width:
+            top = np.argpartition(-cos, k - 1, axis=1)[:, :k]
+        else:
+            top = np.tile(np.arange(width), (len(q), 1))
+        order = np.take_along_axis(cos, top, axis=1).argsort(axis=1)[:, ::-1]
+        top = np.take_along_axis(top, order, axis=1)
+        best = np.take_along_axis(cos, top, axis=1)
+        if rows is not None:
+            top = np.take_along_axis(rows, top, axis=1)
+
+        return [
+            [SearchHit(chunk=chunks[int(i)], similarity=float(2.0 * c - 1.0)) for i, c in zip(row_top, row_best)]
+            for row_top, row_best in zip(top, best)
+        ]
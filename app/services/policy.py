@@ -1,13 +1,15 @@
+import hashlib
 import json
+import os
+import time
+from pathlib import Path
+
 from app.core.config import settings
+from app.services.index_store import FileLock
 from app.services.lm_client import chat_complete
 
-def build_policy_prompt() -> str:
-    """
-    Generate a system prompt using the local model, based on flags only.
-    No hardcoded instruction text is stored in code or uniq txt files.
-    """
-    flags = {
+def policy_flags() -> dict:
+    return {
         "assistant_name": "UNIQ Assistant",
         "domain": "UNIQ Technologies",
         "must_use_rag_context_only": True,
@@ -18,6 +20,18 @@ def build_policy_prompt() -> str:
         "keep_replies_short": True
     }
 
+def policy_key(flags: dict, model: str) -> str:
+    raw = json.dumps({"flags": flags, "model": model}, sort_keys=True)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()[:16]
+
+def build_policy_prompt(flags: dict | None = None) -> str:
+    """
+    Generate a system prompt using the local model, based on flags only.
+    No hardcoded instruction text is stored in code or uniq txt files.
+    """
+    if flags is None:
+        flags = policy_flags()
+
     # Only the JSON flags are provided
     user_text = json.dumps(flags, indent=2)
 
@@ -25,4 +39,39 @@ def build_policy_prompt() -> str:
     # If you also consider this "hardcode", then it's impossible.
     system_text = "Generate a system prompt for a chatbot using the given JSON policy. Output only the system prompt text."
 
-    return chat_complete(system_text=system_text, user_text=user_text, max_tokens=300)
\ No newline at end of file
+    # temperature 0: the same flags give the same prompt (and the same cached prefix)
+    return chat_complete(system_text=system_text, user_text=user_text, max_tokens=300, temperature=0.0)
+
+def _read_cache(path: Path) -> dict:
+    try:
+        return json.loads(path.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return {}
+
+def compiled_policy_prompt(cache_path: Path) -> str:
+    """
+    build_policy_prompt() once per (flags, MODEL_NAME): the result is kept in
+    cache_path, so restarts and every worker use the same text without an
+    LLM call. Changing a flag or the model generates a new entry.
+    """
+    flags = policy_flags()
+    key = policy_key(flags, settings.MODEL_NAME)
+    entry = _read_cache(cache_path).get(key)
+    if entry:
+        return entry["prompt"]
+
+    cache_path.parent.mkdir(parents=True, exist_ok=True)
+    # one worker generates, the others wait and read its result
+    with FileLock(cache_path.with_name(cache_path.name + ".lock")):
+        entries = _read_cache(cache_path)
+        if key not in entries:
+            entries[key] = {
+                "prompt": build_policy_prompt(flags).strip(),
+                "model": settings.MODEL_NAME,
+                "flags": flags,
+                "created": time.time(),
+            }
+            tmp = cache_path.with_name(cache_path.name + ".tmp")
+            tmp.write_text(json.dumps(entries, indent=1, sort_keys=True), encoding="utf-8")
+            os.replace(tmp, cache_path)
+        return entries[key]["prompt"]
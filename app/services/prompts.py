@@ -0,0 +1,55 @@
+"""
+Prompt layout for LLM prefix caching.
+
+llama.cpp / LM Studio keep the attention (KV) cache of the prompts they
+processed and skip the prefill of the longest prefix a new prompt shares
+with one of them. Every chat call is therefore laid out from the most to
+the least stable part:
+
+  system   bot rules + policy prompt      identical for every call
+           history summary                changes only when turns are folded
+  history  verbatim turns                 append-only between folds
+  user     call-site instructions         identical per call site
+           CONTEXT                        the same for similar questions
+           question / answer to check     new every turn
+"""
+from __future__ import annotations
+from typing import Optional
+
+ANSWER_RULES = """
+- Answer ONLY using CONTEXT.
+- If answer is not in CONTEXT, reply exactly:
+{fallback}
+""".strip()
+
+NO_CONTEXT_RULES = """
+- If USER_MESSAGE is a greeting/thanks/acknowledgement OR asks your identity/name,
+  reply naturally according to the SYSTEM PROMPT.
+- Otherwise reply exactly:
+{fallback}
+""".strip()
+
+VERIFY_TASK = """
+- Check whether PREVIOUS_ASSISTANT_ANSWER is supported by CONTEXT.
+- If supported, reply briefly: "Yes, that information is correct." (you may add 1 supporting line from CONTEXT).
+- If not supported or partially wrong, reply briefly with the correct info from CONTEXT.
+- If CONTEXT is insufficient, reply exactly:
+{fallback}
+""".strip()
+
+
+def system_prompt(bot_rules: str, policy_prompt: str = "", summary: str = "") -> str:
+    """Static instructions first; the per-session summary (if any) goes last."""
+    parts = [bot_rules, policy_prompt]
+    if summary:
+        parts.append(f"EARLIER CONVERSATION (summary):\n{summary}")
+    return "\n\n".join(p.strip() for p in parts if p and p.strip())
+
+
+def user_prompt(*sections: tuple[str, Optional[str]]) -> str:
+    """
+    "TITLE:\\ntext" blocks separated by blank lines, in the order given:
+    pass the fixed instructions first and the turn-specific text last.
+    Empty sections are left out.
+    """
+    return "\n\n".join(f"{title}:\n{text.strip()}" for title, text in sections if text and text.strip())
@@ -1,77 +1,715 @@
 from __future__ import annotations
-from typing import List, Optional
+import asyncio
+import functools
+import hashlib
+import json
+import os
+import re
+import shutil
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, AsyncIterator, Callable, List, Optional
 
 from app.core.config import settings
-from app.services.knowledge import load_knowledge_files, load_bot_rules
-from app.services.chunking import chunk_text, Chunk
-from app.services.embeddings import embed_texts
-from app.services.lm_client import chat_complete
-from app.services.vectorstore import ChromaVectorDB
+from app.services.knowledge import discover_knowledge_files, iter_knowledge_files, load_bot_rules
+from app.services.chunking import chunk_text
+from app.services.embeddings import aembed_texts
+from app.services.answer_cache import SemanticAnswerCache
+from app.services.context import AssembledContext, assemble_context
+from app.services.history import HistoryCompactor, HistoryView
+from app.services.index_store import IndexStore, knowledge_stamp
+from app.services.indexing import SyncStats, default_workers, sync_index
+from app.services.intent import INTENTS, CentroidClassifier, IntentRouter, KnowledgeMatch, LexicalRules
+from app.services.lexical import BM25Index, LexicalHit, reciprocal_rank_fusion
+from app.services.lm_client import StopCondition, achat_complete, astream_chat, stop_on_labels, stop_on_text
+from app.services.manifest import IndexManifest, content_hash
+from app.services.metrics import REGISTRY, SIMILARITY_BUCKETS, TOKEN_BUCKETS, timed
+from app.services.policy import compiled_policy_prompt
+from app.services.prompts import ANSWER_RULES, NO_CONTEXT_RULES, VERIFY_TASK, system_prompt, user_prompt
+from app.services.singleflight import SingleFlight
+from app.services.tokens import estimate_tokens
+from app.services.vectorstore import SearchHit, VectorStore, chunk_key, create_vector_store, prune_orphan_segments, segment_dirs
+
+# Fixed instruction text around CONTEXT in the prompt templates below
+PROMPT_TEMPLATE_TOKENS = 80
+
+RETRIEVAL_MODES = ("dense", "hybrid", "lexical_first")
+# Before versioned index directories the index lived directly in STORAGE_DIR:
+# Chroma's database (plus its segment folders) and the uniq_kb.* files
+LEGACY_INDEX_PREFIXES = ("chroma.sqlite3", "uniq_kb.")
+NOT_READY_POLICIES = ("wait", "reject", "fallback")
+RETRIEVAL_TOTAL = REGISTRY.counter(
+    "rag_retrieval_total", "Question retrievals by the path that produced the hits", ("path",)
+)
+RETRIEVAL_SIMILARITY = REGISTRY.histogram(
+    "rag_retrieval_similarity", "Similarity of retrieved chunks (rank=top: best hit only)", SIMILARITY_BUCKETS, ("rank",)
+)
+CONTEXT_TOKENS = REGISTRY.histogram(
+    "rag_context_tokens", "Estimated tokens of the CONTEXT block sent to the LLM", TOKEN_BUCKETS
+)
+CONTEXT_DROPPED = REGISTRY.counter(
+    "rag_context_dropped_hits_total", "Retrieved hits left out of CONTEXT by the token budget"
+)
+INDEX_CHUNKS_EMBEDDED = REGISTRY.counter(
+    "rag_index_embedded_chunks_total", "Chunks embedded by index syncs"
+)
+INDEX_SWAPS = REGISTRY.counter(
+    "rag_index_swaps_total", "Index versions this process switched to after startup"
+)
+VERIFY_CONTEXT = REGISTRY.counter(
+    "rag_verification_context_total",
+    "Where verification turns got CONTEXT from (provenance of the answer, or a new retrieval)",
+    ("source",),
+)
+
+
+class IndexNotReady(Exception):
+    """A question arrived before the index was open (NOT_READY_POLICY=reject, or the wait timed out)."""
+
+
+@dataclass
+class IndexHandle:
+    """One opened index version. Replaced as a whole, so a request never mixes two versions."""
+    name: str  # version directory in the IndexStore
+    vdb: VectorStore
+    lexical: Optional[BM25Index]
+    index_version: str  # manifest content hash
+
+
+# the index a request was planned against (set for the duration of _plan / retrieve_many)
+_PINNED_INDEX: ContextVar[Optional[IndexHandle]] = ContextVar("rag_pinned_index", default=None)
+
+
+@dataclass
+class Provenance:
+    """The chunks an answer was generated from, stored with the assistant turn."""
+    chunk_ids: List[str]  # chunk_key of each chunk in CONTEXT
+    similarities: List[float]
+    index_version: str
+
+    @classmethod
+    def from_hits(cls, hits: List[SearchHit], index_version: str) -> "Provenance":
+        return cls([chunk_key(h.chunk) for h in hits], [round(h.similarity, 4) for h in hits], index_version)
+
+    def to_dict(self) -> dict:
+        return {"chunk_ids": self.chunk_ids, "similarities": self.similarities, "index_version": self.index_version}
+
+    @classmethod
+    def from_dict(cls, raw) -> Optional["Provenance"]:
+        if not isinstance(raw, dict):
+            return None
+        try:
+            return cls(
+                [str(k) for k in raw["chunk_ids"]],
+                [float(s) for s in raw["similarities"]],
+                str(raw["index_version"]),
+            )
+        except (KeyError, TypeError, ValueError):
+            return None
+
+
+@dataclass
+class Reply:
+    text: str
+    provenance: Optional[Provenance] = None
+
+
+@dataclass
+class GenerationPlan:
+    system_text: str
+    user_text: str
+    history_messages: Optional[list]
+    max_tokens: int
+    strict: bool  # any reply mentioning FALLBACK_TEXT becomes exactly FALLBACK_TEXT
+    call_site: str = "answer"  # answer | verify | no_context (metrics, adaptive max_tokens)
+    cache_key: Optional[tuple] = None  # (question embedding, chunk ids, index version, history key)
+    provenance: Optional[Provenance] = None  # CONTEXT chunks, stored with the answer
 
 
 class RAGEngine:
-    def __init__(self):
-        self.vdb: ChromaVectorDB | None = None
+    def __init__(self, speculative_retrieval: bool | None = None):
+        self._index: IndexHandle | None = None
+        self._retired: list[tuple[IndexHandle, float]] = []  # previous versions, closed after INDEX_SWAP_GRACE
+        self.retrieval_mode = settings.RETRIEVAL_MODE.strip().lower()
+        if self.retrieval_mode not in RETRIEVAL_MODES:
+            raise ValueError(f"Unknown RETRIEVAL_MODE: {settings.RETRIEVAL_MODE!r}")
+        self.not_ready_policy = settings.NOT_READY_POLICY.strip().lower()
+        if self.not_ready_policy not in NOT_READY_POLICIES:
+            raise ValueError(f"Unknown NOT_READY_POLICY: {settings.NOT_READY_POLICY!r}")
         self.bot_rules: str = ""
+        self.policy_prompt: str = ""  # POLICY_PROMPT_ENABLED
         self._db_ready = False
+        # initialize_db runs in worker threads (and the ingest CLI): one build at a time
+        self._init_lock = threading.Lock()
+        self._build_lock = threading.Lock()  # the IndexStore file lock is not re-entrant
+        self._swap_lock = threading.Lock()
+        self._store: IndexStore | None = None
+        self._legacy_checked = False
+        self._init_task: asyncio.Task | None = None
+        self.init_error = ""  # last failed index build, for /ready
 
-    def initialize_db(self) -> None:
+        # Start question retrieval while the intent is still being classified
+        if speculative_retrieval is None:
+            speculative_retrieval = settings.RAG_SPECULATIVE_RETRIEVAL
+        self.speculative_retrieval = speculative_retrieval
+
+        self.history = HistoryCompactor(
+            summarizer=self._summarize_history,
+            token_budget=settings.HISTORY_TOKEN_BUDGET,
+            recent_turns=settings.HISTORY_RECENT_TURNS,
+            max_sessions=settings.MEMORY_MAX_SESSIONS,
+            fold_turns=settings.HISTORY_FOLD_TURNS,
+            idle_ttl_seconds=settings.MEMORY_IDLE_TTL_SECONDS,
+        )
+        if settings.MEMORY_BACKEND.strip().lower() != "memory" and "summary" in (
+            settings.HISTORY_MODE_CLASSIFIER,
+            settings.HISTORY_MODE_VERIFIER,
+            settings.HISTORY_MODE_ANSWERER,
+        ):
+            # summaries are not in the shared store: each worker would keep its own
+            print(f"HISTORY SUMMARY IS PER PROCESS (MEMORY_BACKEND={settings.MEMORY_BACKEND}): use recent or full")
+
+        self.single_flight: SingleFlight | None = SingleFlight() if settings.SINGLE_FLIGHT_ENABLED else None
+
+        self.answer_cache: SemanticAnswerCache | None = None
+        if settings.ANSWER_CACHE_ENABLED:
+            self.answer_cache = SemanticAnswerCache(
+                max_items=settings.ANSWER_CACHE_MAX_ITEMS,
+                ttl_seconds=settings.ANSWER_CACHE_TTL_SECONDS,
+                similarity_threshold=settings.ANSWER_CACHE_SIMILARITY,
+            )
+
+        stages = []
+        if settings.INTENT_ROUTER_ENABLED:
+            stages = [LexicalRules()]
+            if self.retrieval_mode == "lexical_first":
+                stages.append(KnowledgeMatch(self._lexical_match))
+            stages.append(CentroidClassifier(settings.knowledge_dir_path / settings.INTENT_EXAMPLES_FILE))
+        self.intent_router = IntentRouter(
+            stages,
+            fallback=self._llm_classify_intent,
+            threshold=settings.INTENT_CONFIDENCE_THRESHOLD,
+        )
+
+        REGISTRY.gauge("rag_index_chunks", "Chunks in the vector index", lambda: self.vdb.count() if self.vdb is not None else 0)
+
+    @property
+    def ready(self) -> bool:
+        return self._db_ready
+
+    @property
+    def index(self) -> IndexHandle | None:
+        return _PINNED_INDEX.get() or self._index
+
+    @property
+    def vdb(self) -> VectorStore | None:
+        index = self.index
+        return index.vdb if index is not None else None
+
+    @property
+    def lexical(self) -> BM25Index | None:
+        index = self.index
+        return index.lexical if index is not None else None
+
+    @property
+    def index_version(self) -> str:
+        index = self.index
+        return index.index_version if index is not None else ""
+
+    @contextmanager
+    def _pinned(self):
+        """Serve everything inside from the index version open right now, even if it is swapped meanwhile."""
+        token = _PINNED_INDEX.set(self._index)
+        try:
+            yield
+        finally:
+            _PINNED_INDEX.reset(token)
+
+    @property
+    def store(self) -> IndexStore:
+        if self._store is None:
+            self._store = IndexStore(settings.storage_dir_path / "index", lease_ttl=settings.INDEX_LEASE_TTL)
+        return self._store
+
+    def initialize_db(
+        self,
+        workers: int | None = None,
+        embed_concurrency: int | None = None,
+        batch_size: int | None = None,
+        progress: Optional[Callable[[SyncStats], None]] = None,
+    ) -> None:
         if self._db_ready:
             return
+        with self._init_lock:
+            if self._db_ready:
+                return  # built by a concurrent caller while we waited
+            self._initialize_db(workers, embed_concurrency, batch_size, progress)
 
-        settings.storage_dir_path.mkdir(parents=True, exist_ok=True)
+    def _initialize_db(
+        self,
+        workers: int | None,
+        embed_concurrency: int | None,
+        batch_size: int | None,
+        progress: Optional[Callable[[SyncStats], None]],
+    ) -> None:
+        self._load_instructions()
+        self._migrate_legacy_index()
 
-        self.bot_rules = load_bot_rules(
-            settings.knowledge_dir_path, settings.BOT_RULES_FILE
-        ).strip()
+        version = self.store.current()
+        if not version or self.store.read_meta(version).get("stamp") != self._knowledge_stamp():
+            # missing or stale: build it (or wait for the process that is building it)
+            version = self.build_index(workers, embed_concurrency, batch_size, progress)
+        self._swap_to(version)
+        self._db_ready = True
+
+    def _load_instructions(self) -> None:
+        """Bot rules and (optionally) the compiled policy prompt: the static start of every system prompt."""
+        self.bot_rules = load_bot_rules(settings.knowledge_dir_path, settings.BOT_RULES_FILE).strip()
+        if not settings.POLICY_PROMPT_ENABLED:
+            return
+        try:
+            self.policy_prompt = compiled_policy_prompt(settings.storage_dir_path / settings.POLICY_PROMPT_FILE)
+        except Exception as e:
+            # answer without it rather than not at all; retried on the next index swap
+            print("POLICY PROMPT FAILED:", e)
+
+    # -----------------------------
+    # Index versions
+    # -----------------------------
+    @staticmethod
+    def _fingerprint() -> dict:
+        fp = {
+            "embed_model": settings.EMBED_MODEL,
+            "vector_backend": settings.VECTOR_BACKEND,
+            "chunk_size": settings.CHUNK_SIZE,
+            "chunk_overlap": settings.CHUNK_OVERLAP,
+            "chunk_unit": settings.CHUNK_UNIT,
+            "chunker": 2,
+        }
+        # Chroma keeps only the truncated vectors in its collection: another cut needs new ones.
+        # The numpy backend derives its first stage from the full vectors it stores.
+        if settings.VECTOR_FIRST_STAGE_DIM and settings.VECTOR_BACKEND.strip().lower() == "chroma":
+            fp["first_stage_dim"] = settings.VECTOR_FIRST_STAGE_DIM
+        return fp
+
+    def _knowledge_stamp(self) -> str:
+        root = settings.knowledge_dir_path
+        return knowledge_stamp((root / name for name in self.knowledge_sources()), self._fingerprint())
+
+    def _knowledge_unchanged(self, version: str) -> bool:
+        """Does `version` already hold exactly the current knowledge files (by content)?"""
+        manifest = IndexManifest.load(self.store.path(version) / "uniq_kb.manifest.json")
+        if manifest is None or manifest.fingerprint != self._fingerprint():
+            return False
+        files = dict(iter_knowledge_files(settings.knowledge_dir_path, self.knowledge_sources()))
+        if set(files) != set(manifest.files):
+            return False
+        return all(manifest.files[name].hash == content_hash(text) for name, text in files.items())
+
+    @staticmethod
+    def _legacy_index_paths() -> List[Path]:
+        root = settings.storage_dir_path
+        if not root.is_dir():
+            return []
+        files = [p for p in root.iterdir() if p.is_file() and p.name.startswith(LEGACY_INDEX_PREFIXES)]
+        return files + segment_dirs(root)
+
+    def _migrate_legacy_index(self) -> None:
+        """
+        Once per engine, under the build lock: an index left in STORAGE_DIR
+        by a version without index directories becomes the first version
+        when none is published yet (nothing is re-embedded; the next build
+        checks it like any other), otherwise it is deleted. Either way its
+        orphaned Chroma segment folders go.
+        """
+        if self._legacy_checked:
+            return
+        if self._legacy_index_paths():
+            with self.store.lock():
+                root = settings.storage_dir_path
+                pruned = prune_orphan_segments(root)
+                paths = self._legacy_index_paths()
+                manifest = IndexManifest.load(root / "uniq_kb.manifest.json")
+                if paths and manifest is not None and not self.store.current():
+                    staging = self.store.stage()
+                    for p in paths:
+                        os.rename(p, staging / p.name)
+                    version = self.store.publish(
+                        staging, {"stamp": "", "index_version": manifest.version, "chunks": manifest.chunk_count},
+                    )
+                    print(f"LEGACY INDEX MOVED TO {version} ({pruned} orphaned segment folders removed)")
+                else:
+                    for p in paths:
+                        if p.is_dir():
+                            shutil.rmtree(p, ignore_errors=True)
+                        else:
+                            p.unlink(missing_ok=True)
+                    print(f"LEGACY INDEX REMOVED ({len(paths) + pruned} files and folders)")
+        self._legacy_checked = True
 
-        self.vdb = ChromaVectorDB(
-            persist_dir=str(settings.storage_dir_path),
+    @staticmethod
+    def _open_vector_store(path) -> VectorStore:
+        options = {
+            "first_stage_dim": settings.VECTOR_FIRST_STAGE_DIM,
+            "candidates": settings.VECTOR_FIRST_STAGE_CANDIDATES,
+        }
+        if settings.VECTOR_BACKEND.strip().lower() == "numpy":
+            options["quantization"] = settings.VECTOR_QUANTIZATION
+            options["first_stage_quantization"] = settings.VECTOR_FIRST_STAGE_QUANTIZATION
+        return create_vector_store(
+            settings.VECTOR_BACKEND,
+            persist_dir=str(path),
             collection_name="uniq_kb",
+            **options,
         )
 
-        chunks = self._load_and_chunk_all()
-        print("TOTAL CHUNKS =", len(chunks))
+    def build_index(
+        self,
+        workers: int | None = None,
+        embed_concurrency: int | None = None,
+        batch_size: int | None = None,
+        progress: Optional[Callable[[SyncStats], None]] = None,
+        fresh: bool = False,
+        blocking: bool = True,
+    ) -> Optional[str]:
+        """
+        Bring the index in line with the knowledge files and return the
+        version that holds them. Changes are synced into a copy of the
+        current version (only new or changed chunks are embedded; with
+        `fresh` into an empty one), published as a new version and made
+        CURRENT. One build at a time across all processes: returns None
+        when another one is running and `blocking` is False.
+        """
+        self._migrate_legacy_index()
+        if not self._build_lock.acquire(blocking):
+            return None
+        lock = self.store.lock()
+        try:
+            if not lock.acquire(blocking):
+                return None
+            try:
+                return self._build_index(workers, embed_concurrency, batch_size, progress, fresh)
+            finally:
+                lock.release()
+        finally:
+            self._build_lock.release()
 
-        self.vdb.reset()
+    def _build_index(self, workers, embed_concurrency, batch_size, progress, fresh: bool) -> str:
+        store = self.store
+        stamp = self._knowledge_stamp()
+        current = store.current()
+        if current and not fresh:
+            meta = store.read_meta(current)
+            if meta.get("stamp") == stamp:
+                return current  # built by another process while we waited for the lock
+            if self._knowledge_unchanged(current):
+                # files touched but not changed: nothing to rebuild
+                store.write_meta(current, dict(meta, stamp=stamp))
+                return current
 
-        if chunks:
-            texts = [c.text for c in chunks]
-            embeddings: list[list[float]] = []
-            B = 64
-            for i in range(0, len(texts), B):
-                embeddings.extend(embed_texts(texts[i:i + B]))
-            self.vdb.upsert(chunks, embeddings)
+        # the numpy store only ever replaces its files, so the unchanged ones can be
+        # shared with the current version; Chroma rewrites its SQLite and HNSW files in place
+        linkable = settings.VECTOR_BACKEND.strip().lower() == "numpy"
+        staging = store.stage("" if fresh else current, link=linkable)
+        try:
+            vdb = self._open_vector_store(staging)
+            lexical_path = staging / "uniq_kb.bm25.json"
+            # kept for every RETRIEVAL_MODE, so switching modes needs no rebuild
+            lexical = BM25Index.load(lexical_path) or BM25Index()
 
-        self._db_ready = True
+            if workers is None:
+                workers = settings.INGEST_WORKERS or default_workers()
+            with timed("index_sync"):
+                stats = sync_index(
+                    vdb,
+                    iter_knowledge_files(settings.knowledge_dir_path, self.knowledge_sources()),
+                    chunker=self._chunker(),
+                    manifest_path=staging / "uniq_kb.manifest.json",
+                    fingerprint=self._fingerprint(),
+                    batch_size=batch_size or settings.INGEST_BATCH_SIZE,
+                    workers=workers,
+                    embed_concurrency=embed_concurrency or settings.INGEST_EMBED_CONCURRENCY,
+                    progress=progress,
+                    lexical=lexical,
+                )
+            INDEX_CHUNKS_EMBEDDED.inc(stats.embedded)
+            if lexical.dirty:
+                lexical.save(lexical_path)
+            vdb.close()
+        except BaseException:
+            store.discard(staging)
+            raise
+        print(
+            "TOTAL CHUNKS =", stats.chunks,
+            "| embedded =", stats.embedded,
+            "| deleted =", stats.deleted,
+            "| rebuilt =", stats.rebuilt,
+        )
+        return store.publish(staging, {"stamp": stamp, "index_version": stats.version, "chunks": stats.chunks})
+
+    def _open_version(self, version: str) -> IndexHandle:
+        store = self.store
+        store.hold(version)  # before opening: garbage collection skips held versions
+        path = store.path(version)
+        if not path.is_dir():
+            store.release(version)
+            raise FileNotFoundError(f"index version {version} no longer exists")
+        lexical = None
+        if self.retrieval_mode != "dense":
+            lexical = BM25Index.load(path / "uniq_kb.bm25.json") or BM25Index()
+        return IndexHandle(
+            name=version,
+            vdb=self._open_vector_store(path),
+            lexical=lexical,
+            index_version=str(store.read_meta(version).get("index_version", "")),
+        )
 
-    def _load_and_chunk_all(self) -> List[Chunk]:
-        files = load_knowledge_files(settings.knowledge_dir_path, settings.knowledge_files_list)
-        all_chunks: List[Chunk] = []
-        for source, text in files:
-            all_chunks.extend(
-                chunk_text(
-                    source=source,
-                    text=text,
-                    chunk_size=settings.CHUNK_SIZE,
-                    overlap=settings.CHUNK_OVERLAP,
+    def _swap_to(self, version: str) -> bool:
+        """Open `version` and serve new requests from it; False if it is already open."""
+        with self._swap_lock:
+            old = self._index
+            if old is not None and old.name == version:
+                return False
+            handle = self._open_version(version)
+            self._load_instructions()
+            if old is not None and handle.index_version != old.index_version and self.answer_cache is not None:
+                self.answer_cache.invalidate()
+            self._index = handle  # one assignment: requests see the old or the new version, never a mix
+            if old is not None:
+                # requests planned on the old version may still read it
+                self._retired.append((old, time.monotonic()))
+                INDEX_SWAPS.inc()
+            return True
+
+    def _close_retired(self, grace: float) -> None:
+        now = time.monotonic()
+        with self._swap_lock:
+            keep = []
+            for handle, since in self._retired:
+                if now - since < grace:
+                    keep.append((handle, since))
+                    continue
+                try:
+                    handle.vdb.close()
+                finally:
+                    self.store.release(handle.name)
+            self._retired = keep
+
+    def poll_index(self) -> None:
+        """
+        Heartbeat this process's leases, switch to a version another process
+        published, close versions retired more than INDEX_SWAP_GRACE ago and
+        delete unused ones. Blocking; called from watch_index.
+        """
+        store = self.store
+        for handle in [self._index] + [h for h, _ in self._retired]:
+            if handle is not None:
+                store.hold(handle.name)
+        current = store.current()
+        if current:
+            self._swap_to(current)
+        self._close_retired(settings.INDEX_SWAP_GRACE)
+        store.collect_garbage()
+
+    async def reindex(self, fresh: bool = False, blocking: bool = True) -> Optional[str]:
+        """
+        Rebuild from the knowledge files (see build_index) and switch this
+        process to the result; other processes follow within INDEX_POLL_INTERVAL.
+        None when another build is running and `blocking` is False.
+        """
+        version = await asyncio.to_thread(self.build_index, fresh=fresh, blocking=blocking)
+        if version is not None and self._db_ready:
+            await asyncio.to_thread(self._swap_to, version)
+        return version
+
+    async def watch_index(self, interval: float, knowledge_interval: float = 0.0) -> None:
+        """
+        Background loop of every server process: poll_index every `interval`
+        seconds and, with knowledge_interval > 0, rebuild when the knowledge
+        files changed (only one process builds, the others pick it up).
+        """
+        last_check = time.monotonic()
+        while True:
+            await asyncio.sleep(interval)
+            if not self._db_ready:
+                continue
+            try:
+                await asyncio.to_thread(self.poll_index)
+                if knowledge_interval > 0 and time.monotonic() - last_check >= knowledge_interval:
+                    last_check = time.monotonic()
+                    stamp = await asyncio.to_thread(self._knowledge_stamp)
+                    index = self._index  # None while close_index runs
+                    if index is not None and stamp != self.store.read_meta(index.name).get("stamp"):
+                        await self.reindex(blocking=False)
+            except Exception as e:
+                print("INDEX WATCH FAILED:", e)
+
+    def close_index(self) -> None:
+        """Release every version this process holds (shutdown)."""
+        with self._swap_lock:
+            handles = [self._index] + [h for h, _ in self._retired]
+            self._index, self._retired = None, []
+            self._db_ready = False
+        for handle in handles:
+            if handle is not None:
+                handle.vdb.close()
+                self.store.release(handle.name)
+
+    # -----------------------------
+    # Warm-up and readiness
+    # -----------------------------
+    async def _open_index(self) -> None:
+        try:
+            # index build does blocking I/O; keep it off the event loop
+            await asyncio.to_thread(self.initialize_db)
+        except Exception as e:
+            self.init_error = f"{type(e).__name__}: {e}"
+            raise
+        self.init_error = ""
+
+    def _start_index(self) -> asyncio.Task:
+        # one build shared by every waiter; a failed one is retried by the next caller
+        if self._init_task is None or (self._init_task.done() and not self._db_ready):
+            self._init_task = asyncio.create_task(self._open_index())
+            self._init_task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        return self._init_task
+
+    async def ensure_index(self) -> None:
+        """Open or build the index (once), waiting for a build already in progress."""
+        if not self._db_ready:
+            await asyncio.shield(self._start_index())
+
+    async def warm_up(self, warm_lm: bool = False) -> None:
+        """
+        Startup warm-up: bot rules and index first (readiness), then optionally
+        the intent example embeddings and one tiny chat completion so the
+        first user does not pay for model loading and new connections.
+        """
+        try:
+            with timed("warmup_index"):
+                await self.ensure_index()
+        except Exception as e:
+            print("INDEX WARM-UP FAILED:", self.init_error or e)
+            return
+        if not warm_lm:
+            return
+        try:
+            with timed("warmup_lm"):
+                await self.intent_router.warm_up()
+                await achat_complete(
+                    system_text=self._system_text(HistoryView()),
+                    user_text="hi",
+                    max_tokens=1,
+                    temperature=0.0,
+                    call_site="warmup",
                 )
-            )
-        return all_chunks
+        except Exception as e:
+            print("LM WARM-UP FAILED:", e)
+
+    async def _await_ready(self) -> bool:
+        """Apply NOT_READY_POLICY; False means: reply NOT_READY_TEXT."""
+        if self._db_ready:
+            return True
+        if self.not_ready_policy == "wait":
+            timeout = settings.NOT_READY_WAIT_SECONDS
+            try:
+                await asyncio.wait_for(self.ensure_index(), timeout if timeout > 0 else None)
+            except asyncio.TimeoutError:
+                raise IndexNotReady("The knowledge index is still being built") from None
+            return True
+        # do not wait, but make sure a build is running (warm-up disabled or failed)
+        self._start_index()
+        if self.not_ready_policy == "reject":
+            raise IndexNotReady("The knowledge index is still being built")
+        return False
+
+    @staticmethod
+    def knowledge_sources() -> List[str]:
+        patterns = settings.knowledge_glob_list
+        if not patterns:
+            return settings.knowledge_files_list
+        return discover_knowledge_files(
+            settings.knowledge_dir_path,
+            patterns,
+            exclude=(settings.BOT_RULES_FILE, settings.INTENT_EXAMPLES_FILE),
+        )
+
+    @staticmethod
+    def _chunker():
+        # a partial of a module-level function, so it can be sent to chunking processes
+        return functools.partial(
+            chunk_text,
+            chunk_size=settings.CHUNK_SIZE,
+            overlap=settings.CHUNK_OVERLAP,
+            unit=settings.CHUNK_UNIT,
+        )
 
     # -----------------------------
     # Helpers
     # -----------------------------
-    def _last_assistant_text(self, history_messages) -> str:
-        if not history_messages:
-            return ""
-        for m in reversed(history_messages):
+    def _last_assistant_turn(self, history_messages) -> dict:
+        for m in reversed(history_messages or []):
             if (m or {}).get("role") == "assistant":
-                t = (m or {}).get("content") or ""
-                return t.strip()
-        return ""
+                return m
+        return {}
 
-    def _classify_intent(self, user_msg: str, history_messages=None) -> str:
+    def _last_assistant_text(self, history_messages) -> str:
+        return (self._last_assistant_turn(history_messages).get("content") or "").strip()
+
+    def _provenance_hits(self, provenance: Optional[Provenance]) -> Optional[List[SearchHit]]:
+        """The chunks of a previous answer, or None when they cannot be reused (other index version)."""
+        if provenance is None or not provenance.chunk_ids or provenance.index_version != self.index_version:
+            return None
+        chunks = self.vdb.get_chunks(provenance.chunk_ids)
+        if any(c is None for c in chunks):
+            return None
+        return [SearchHit(c, s) for c, s in zip(chunks, provenance.similarities)]
+
+    def _system_text(self, history: HistoryView) -> str:
+        return system_prompt(self.bot_rules, self.policy_prompt, history.summary)
+
+    async def _summarize_history(self, previous: str, messages: List[dict]) -> str:
+        sys = (
+            "You keep a short running summary of a chat between a user and a UNIQ Technologies assistant.\n"
+            "Update SUMMARY with NEW_MESSAGES. Keep what the user asked and the facts given in answers.\n"
+            "At most 5 short lines. Output only the summary."
+        )
+        lines = [f"{m['role'].upper()}: {m['content'].strip()}" for m in messages]
+        user = f"SUMMARY:\n{previous or '(empty)'}\n\nNEW_MESSAGES:\n" + "\n".join(lines)
+        return await achat_complete(
+            system_text=sys,
+            user_text=user,
+            history_messages=None,
+            max_tokens=160,
+            temperature=0.0,
+            call_site="summary",
+        )
+
+    async def after_turn(self, session_id: str | None, history_messages) -> None:
+        """
+        Background work once a response has been sent: fold aged-out
+        turns into the session's rolling history summary.
+        """
+        if "summary" not in (
+            settings.HISTORY_MODE_CLASSIFIER,
+            settings.HISTORY_MODE_VERIFIER,
+            settings.HISTORY_MODE_ANSWERER,
+        ):
+            return
+        try:
+            await self.history.update(session_id, history_messages)
+        except Exception as e:
+            print("HISTORY SUMMARY FAILED:", e)
+
+    async def _classify_intent(self, user_msg: str, history: HistoryView) -> str:
+        decision = await self.intent_router.route(user_msg, history_messages=history)
+        return decision.intent
+
+    async def _llm_classify_intent(self, user_msg: str, history_messages: HistoryView | None = None) -> str:
         """
         Returns one of:
         - "uniq_question"
@@ -87,13 +725,13 @@ class RAGEngine:
             "Do not output anything else."
         )
 
-        # Keep it short. Use history if available.
+        # Keep it short. Use history if available (HISTORY_MODE_CLASSIFIER decides how much).
         hist_preview = ""
-        if history_messages:
-            # take last 6 messages max for intent
-            tail = history_messages[-6:]
+        if history_messages is not None and (history_messages.messages or history_messages.summary):
             lines = []
-            for x in tail:
+            if history_messages.summary:
+                lines.append(f"SUMMARY: {history_messages.summary}")
+            for x in history_messages.messages:
                 r = (x or {}).get("role")
                 c = ((x or {}).get("content") or "").strip()
                 if r in ("user", "assistant") and c:
@@ -102,13 +740,18 @@ class RAGEngine:
 
         user = f"CHAT_TAIL:\n{hist_preview}\n\nUSER_MESSAGE:\n{user_msg}".strip()
 
-        label = chat_complete(
+        label = (await achat_complete(
             system_text=sys,
             user_text=user,
             history_messages=None,
             max_tokens=20,
             temperature=0.0,
-        ).strip().lower()
+            call_site="intent",
+            # a blank line after the label means the model went on to explain it
+            stop=stop_on_labels(INTENTS) if settings.LM_EARLY_STOP else None,
+            stop_sequences=("\n\n",),
+            choices=INTENTS,
+        )).strip().lower()
 
         if "verification" in label:
             return "verification_or_feedback"
@@ -116,9 +759,13 @@ class RAGEngine:
             return "casual"
         return "uniq_question"
 
-    def _verify_last_answer(self, last_answer: str, history_messages=None) -> str:
+    async def _plan_verification(
+        self, last_answer: str, history: HistoryView, provenance: Optional[Provenance] = None
+    ) -> "str | GenerationPlan":
         """
-        Try to verify the last assistant answer by retrieving context for it.
+        Try to verify the last assistant answer against the chunks it was
+        generated from (its provenance), or, when the index has changed since,
+        against context retrieved for the answer text.
         If verification is possible, confirm or correct.
         If not possible, ask user what to verify or fallback.
         """
@@ -128,131 +775,421 @@ class RAGEngine:
         if self.vdb is None:
             return settings.FALLBACK_TEXT
 
-        # Retrieve context for the last answer itself
-        ans_emb = embed_texts([last_answer])[0]
-        hits = self.vdb.query(ans_emb, top_k=settings.TOP_K) or []
-        best = hits[0].similarity if hits else 0.0
+        hits = self._provenance_hits(provenance)
+        if hits is not None:
+            VERIFY_CONTEXT.inc(source="provenance")
+        else:
+            # Retrieve context for the last answer itself
+            VERIFY_CONTEXT.inc(source="retrieval")
+            with timed("embed"):
+                ans_emb = (await aembed_texts([last_answer]))[0]
+            hits = self.vdb.query(ans_emb, top_k=settings.TOP_K) or []
+        best = max((h.similarity for h in hits), default=0.0)
 
         # If we cannot retrieve any supporting context, we can't verify
         if best < settings.MIN_SIMILARITY:
             return "I can verify it if you share which exact statement is wrong, or ask a specific UNIQ-related question."
 
-        ctx_lines = []
-        for h in hits:
-            ctx_lines.append(h.chunk.text)
-            ctx_lines.append("")
-        context = "\n".join(ctx_lines).strip()
-
-        user_text = f"""
-CONTEXT:
-{context}
-
-PREVIOUS_ASSISTANT_ANSWER:
-{last_answer}
-
-TASK:
-- Check whether PREVIOUS_ASSISTANT_ANSWER is supported by CONTEXT.
-- If supported, reply briefly: "Yes, that information is correct." (you may add 1 supporting line from CONTEXT).
-- If not supported or partially wrong, reply briefly with the correct info from CONTEXT.
-- If CONTEXT is insufficient, reply exactly:
-{settings.FALLBACK_TEXT}
-""".strip()
-
-        out = chat_complete(
-            system_text=self.bot_rules,
+        context = self._build_context(hits, history, last_answer)
+
+        user_text = user_prompt(
+            ("TASK", VERIFY_TASK.format(fallback=settings.FALLBACK_TEXT)),
+            ("CONTEXT", context.text),
+            ("PREVIOUS_ASSISTANT_ANSWER", last_answer),
+        )
+
+        return GenerationPlan(
+            system_text=self._system_text(history),
             user_text=user_text,
-            history_messages=history_messages,
+            history_messages=history.messages,
             max_tokens=160,
+            strict=True,
+            call_site="verify",
+            provenance=Provenance.from_hits(context.hits, self.index_version),
+        )
+
+    def _build_context(self, hits: List[SearchHit], history: HistoryView, *prompt_texts: str) -> AssembledContext:
+        """
+        CONTEXT gets whatever PROMPT_TOKEN_BUDGET leaves after the system prompt,
+        the history sent along and the rest of the user message.
+        """
+        used = (
+            estimate_tokens(self.bot_rules)
+            + estimate_tokens(self.policy_prompt)
+            + history.tokens
+            + sum(estimate_tokens(t) for t in prompt_texts)
+            + PROMPT_TEMPLATE_TOKENS
+        )
+        budget = max(settings.CONTEXT_MIN_TOKENS, settings.PROMPT_TOKEN_BUDGET - used)
+        with timed("context_assembly"):
+            ctx = assemble_context(hits, budget, max_overlap=settings.CHUNK_OVERLAP)
+        CONTEXT_TOKENS.observe(ctx.tokens)
+        if ctx.dropped:
+            CONTEXT_DROPPED.inc(ctx.dropped)
+        return ctx
+
+    # -----------------------------
+    # Generation
+    # -----------------------------
+    @staticmethod
+    def _stop_condition(plan: GenerationPlan) -> Optional[StopCondition]:
+        """
+        Stop generating once the reply is bound to end up as FALLBACK_TEXT:
+        strict replies as soon as they mention it, others once they start with it.
+        """
+        if not settings.LM_EARLY_STOP:
+            return None
+        return stop_on_text(settings.FALLBACK_TEXT, anywhere=plan.strict)
+
+    async def _generate(self, plan: GenerationPlan) -> str:
+        return await achat_complete(
+            system_text=plan.system_text,
+            user_text=plan.user_text,
+            history_messages=plan.history_messages,
+            max_tokens=plan.max_tokens,
             temperature=0.0,
-        ).strip()
+            call_site=plan.call_site,
+            stop=self._stop_condition(plan),
+        )
 
+    def _finalize(self, plan: GenerationPlan, out: str) -> str:
+        out = (out or "").strip()
         if not out:
-            return settings.FALLBACK_TEXT
-        if settings.FALLBACK_TEXT.lower() in out.lower():
-            return settings.FALLBACK_TEXT
+            out = settings.FALLBACK_TEXT
+        elif plan.strict and settings.FALLBACK_TEXT.lower() in out.lower():
+            out = settings.FALLBACK_TEXT
+
+        if plan.cache_key is not None and self.answer_cache is not None:
+            q_emb, chunk_ids, version, history_key = plan.cache_key
+            self.answer_cache.store(q_emb, out, chunk_ids, version, history_key)
         return out
 
     # -----------------------------
     # Main
     # -----------------------------
-    def answer(self, question: str, history_messages=None) -> str:
-        q = (question or "").strip()
+    def _lexical_search(self, q: str, top_k: int) -> List[LexicalHit]:
+        if self.lexical is None:
+            return []
+        with timed("lexical_query"):
+            return self.lexical.search(q, top_k=top_k)
+
+    def _lexical_match(self, q: str) -> Optional[float]:
+        """BM25 coverage of the best chunk when it is conclusive enough to skip embedding, else None."""
+        if self.lexical is None or self.lexical.known_terms(q) < settings.LEXICAL_FIRST_MIN_TERMS:
+            return None
+        top = self._lexical_search(q, top_k=1)
+        if not top or top[0].coverage < settings.LEXICAL_FIRST_MIN_COVERAGE:
+            return None
+        return top[0].coverage
+
+    def _lexical_hits(self, lexical: List[LexicalHit]) -> List[SearchHit]:
+        chunks = self.vdb.get_chunks([h.key for h in lexical])
+        # coverage stands in for similarity (same 0..1 range, same MIN_SIMILARITY gate)
+        return [SearchHit(c, h.coverage) for c, h in zip(chunks, lexical) if c is not None]
+
+    def _fuse(self, dense: List[SearchHit], lexical: List[LexicalHit], top_k: int) -> List[SearchHit]:
+        """
+        Reciprocal rank fusion of vector and BM25 rankings, in fusion order
+        (so not sorted by similarity). A chunk found by both keeps the higher
+        of its similarity and its lexical coverage, a BM25-only chunk gets its
+        coverage, so exact-term matches are not cut off by MIN_SIMILARITY.
+
+        The two are different measures sharing one threshold: similarity is
+        1 - squared L2 of the embeddings (2*cos - 1), coverage the idf-weighted
+        share of the question terms found in the chunk. Both run 0..1, and at
+        MIN_SIMILARITY=0.35 a chunk passes on meaning or on about a third of
+        the question's weighted terms, but retuning one moves the other.
+        """
+        if not lexical:
+            return dense[:top_k]
+        by_key = {chunk_key(h.chunk): h for h in dense}
+        coverage = {h.key: h.coverage for h in lexical}
+        order = reciprocal_rank_fusion([list(by_key), [h.key for h in lexical]], k=settings.RRF_K)[:top_k]
+
+        missing = [k for k in order if k not in by_key]
+        fetched = dict(zip(missing, self.vdb.get_chunks(missing))) if missing else {}
+        out: List[SearchHit] = []
+        for k in order:
+            h = by_key.get(k)
+            if h is not None:
+                out.append(SearchHit(h.chunk, max(h.similarity, coverage.get(k, 0.0))))
+            elif fetched.get(k) is not None:
+                out.append(SearchHit(fetched[k], coverage[k]))
+        return out
+
+    async def _retrieve(self, q: str) -> tuple[Optional[list[float]], List[SearchHit]]:
+        """(question embedding or None when it was not needed, hits)"""
+        with timed("retrieval"):
+            lexical: List[LexicalHit] = []
+            if self.retrieval_mode != "dense":
+                if self.retrieval_mode == "lexical_first" and self._lexical_match(q) is not None:
+                    RETRIEVAL_TOTAL.inc(path="lexical")
+                    return None, self._lexical_hits(self._lexical_search(q, settings.TOP_K))
+                lexical = self._lexical_search(q, settings.TOP_K)
+
+            with timed("embed"):
+                q_emb = (await aembed_texts([q]))[0]
+            with timed("vector_query"):
+                dense = self.vdb.query(q_emb, top_k=settings.TOP_K) or []
+            RETRIEVAL_TOTAL.inc(path="hybrid" if lexical else "dense")
+            for h in dense:
+                RETRIEVAL_SIMILARITY.observe(h.similarity, rank="any")
+            if dense:
+                RETRIEVAL_SIMILARITY.observe(dense[0].similarity, rank="top")
+            return q_emb, self._fuse(dense, lexical, settings.TOP_K)
+
+    async def retrieve_many(self, questions: List[str], top_k: int | None = None) -> List[List[SearchHit]]:
+        """
+        Batch retrieval for evaluation runs, cache warming and multi-query
+        expansion: one embedding request and one vector-store call for all questions.
+        """
+        if not questions:
+            return []
+        await self.ensure_index()
+        with self._pinned():
+            return await self._retrieve_many(questions, top_k)
+
+    async def _retrieve_many(self, questions: List[str], top_k: int | None) -> List[List[SearchHit]]:
+        if self.vdb is None:
+            return [[] for _ in questions]
+        top_k = top_k or settings.TOP_K
+        with timed("embed"):
+            embs = await aembed_texts(questions)
+        with timed("vector_query_many"):
+            dense = self.vdb.query_many(embs, top_k=top_k)
+        if self.retrieval_mode == "dense":
+            return dense
+        return [self._fuse(d, self._lexical_search(q, top_k), top_k) for q, d in zip(questions, dense)]
+
+    async def _plan(self, q: str, history_messages=None, session_id: str | None = None) -> "str | Reply | GenerationPlan":
+        """
+        Everything up to the final LLM call. Returns either a ready answer
+        or the prompt to generate it from.
+        """
         if not q:
             return settings.FALLBACK_TEXT
 
-        self.initialize_db()
+        if not await self._await_ready():
+            return settings.NOT_READY_TEXT
+        with self._pinned():
+            return await self._plan_pinned(q, history_messages, session_id)
+
+    async def _plan_pinned(self, q: str, history_messages, session_id: str | None) -> "str | Reply | GenerationPlan":
         if self.vdb is None:
             return settings.FALLBACK_TEXT
 
-        # 1) Intent routing (so feedback like "wrong" is handled)
-        intent = self._classify_intent(q, history_messages=history_messages)
+        # Retrieval does not depend on the intent label: run it alongside
+        # classification and throw it away only for verification turns.
+        retrieval: asyncio.Task | None = None
+        if self.speculative_retrieval:
+            retrieval = asyncio.create_task(self._retrieve(q))
 
-        # If user is verifying/correcting, try verifying the last assistant answer
-        if intent == "verification_or_feedback":
-            last_ans = self._last_assistant_text(history_messages)
-            return self._verify_last_answer(last_ans, history_messages=history_messages)
+        try:
+            # 1) Intent routing (so feedback like "wrong" is handled)
+            with timed("intent"):
+                intent = await self._classify_intent(
+                    q, self.history.view(session_id, history_messages, settings.HISTORY_MODE_CLASSIFIER, current=q)
+                )
 
-        # 2) Normal strict UNIQ RAG (your original flow)
-        q_emb = embed_texts([q])[0]
-        hits = self.vdb.query(q_emb, top_k=settings.TOP_K) or []
-        best = hits[0].similarity if hits else 0.0
+            # If user is verifying/correcting, try verifying the last assistant answer
+            if intent == "verification_or_feedback":
+                last = self._last_assistant_turn(history_messages)
+                return await self._plan_verification(
+                    (last.get("content") or "").strip(),
+                    self.history.view(session_id, history_messages, settings.HISTORY_MODE_VERIFIER, current=q),
+                    Provenance.from_dict(last.get("provenance")),
+                )
+
+            # 2) Normal strict UNIQ RAG (your original flow)
+            if retrieval is not None:
+                with timed("retrieval_wait"):
+                    q_emb, hits = await retrieval
+            else:
+                q_emb, hits = await self._retrieve(q)
+        finally:
+            if retrieval is not None and not retrieval.done():
+                retrieval.cancel()
+                # consume the result so a late failure is not reported as unhandled
+                retrieval.add_done_callback(lambda t: t.cancelled() or t.exception())
+
+        # hits are in fusion order, not by similarity
+        best = max((h.similarity for h in hits), default=0.0)
+        history = self.history.view(session_id, history_messages, settings.HISTORY_MODE_ANSWERER, current=q)
 
         # STRICT: if not enough similarity, do NOT answer from world knowledge.
         # Allow ONLY casual / identity via system prompt.
         if best < settings.MIN_SIMILARITY:
-            user_text = f"""
-USER_MESSAGE:
-{q}
-
-RULE:
-- If USER_MESSAGE is a greeting/thanks/acknowledgement OR asks your identity/name,
-  reply naturally according to the SYSTEM PROMPT.
-- Otherwise reply exactly:
-{settings.FALLBACK_TEXT}
-""".strip()
-
-            out = chat_complete(
-                system_text=self.bot_rules,
+            user_text = user_prompt(
+                ("RULE", NO_CONTEXT_RULES.format(fallback=settings.FALLBACK_TEXT)),
+                ("USER_MESSAGE", q),
+            )
+
+            return GenerationPlan(
+                system_text=self._system_text(history),
                 user_text=user_text,
-                history_messages=history_messages,
+                history_messages=history.messages,
                 max_tokens=80,
-                temperature=0.0,
-            ).strip()
-
-            return out if out else settings.FALLBACK_TEXT
-
-        # Build context from hits
-        ctx_lines = []
-        for h in hits:
-            ctx_lines.append(h.chunk.text)
-            ctx_lines.append("")
-        context = "\n".join(ctx_lines).strip()
+                strict=False,
+                call_site="no_context",
+            )
 
-        user_text = f"""
-CONTEXT:
-{context}
+        # Near-duplicate question answered from the very same chunks?
+        cache_key = None
+        if self.answer_cache is not None and q_emb is not None:
+            cache_key = (
+                q_emb, frozenset(chunk_key(h.chunk) for h in hits), self.index_version, self._history_key(history)
+            )
+            cached = self.answer_cache.lookup(*cache_key)
+            if cached is not None:
+                return Reply(cached, Provenance.from_hits(hits, self.index_version))
 
-QUESTION:
-{q}
+        # Build context from hits (merged, de-duplicated, within the token budget)
+        context = self._build_context(hits, history, q)
 
-RULES:
-- Answer ONLY using CONTEXT.
-- If answer is not in CONTEXT, reply exactly:
-{settings.FALLBACK_TEXT}
-""".strip()
+        # fixed rules first, then CONTEXT, the question last (see app/services/prompts.py)
+        user_text = user_prompt(
+            ("RULES", ANSWER_RULES.format(fallback=settings.FALLBACK_TEXT)),
+            ("CONTEXT", context.text),
+            ("QUESTION", q),
+        )
 
-        out = chat_complete(
-            system_text=self.bot_rules,
+        return GenerationPlan(
+            system_text=self._system_text(history),
             user_text=user_text,
-            history_messages=history_messages,
+            history_messages=history.messages,
             max_tokens=220,
+            strict=True,
+            cache_key=cache_key,
+            provenance=Provenance.from_hits(context.hits, self.index_version),
+        )
+
+    @staticmethod
+    def _history_key(history: HistoryView) -> str:
+        """
+        Fingerprint of the conversation in an answer prompt (summary and
+        verbatim turns); "" when there is none, so first questions of
+        different sessions still share cached answers.
+        """
+        if not history.summary and not history.messages:
+            return ""
+        raw = json.dumps([history.summary, [(m.get("role"), m.get("content")) for m in history.messages]])
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _flight_key(self, q: str, history_messages, session_id: str | None) -> tuple:
+        """
+        Two requests may share one computation when the normalised question
+        is the same and everything the pipeline would read from their
+        histories is the same (typically: both empty).
+        """
+        norm = re.sub(r"\s+", " ", q.casefold()).strip().rstrip("?!. ")
+        views = [
+            self.history.view(session_id, history_messages, mode, current=q)
+            for mode in (settings.HISTORY_MODE_CLASSIFIER, settings.HISTORY_MODE_VERIFIER, settings.HISTORY_MODE_ANSWERER)
+        ]
+        hist = json.dumps(
+            [[v.summary, [(m.get("role"), m.get("content")) for m in v.messages]] for v in views]
+            + [self._last_assistant_text(history_messages)]
+            # verification reads the chunks of the last answer
+            + [self._last_assistant_turn(history_messages).get("provenance")]
+        )
+        return (norm, hist)
+
+    async def _answer(self, q: str, history_messages, session_id: str | None) -> Reply:
+        with timed("plan"):
+            plan = await self._plan(q, history_messages=history_messages, session_id=session_id)
+        if isinstance(plan, str):
+            return Reply(plan)
+        if isinstance(plan, Reply):
+            return plan
+        return Reply(self._finalize(plan, await self._generate(plan)), plan.provenance)
+
+    async def answer_turn(self, question: str, history_messages=None, session_id: str | None = None) -> Reply:
+        """The answer and the chunks it was generated from (to be stored with the turn)."""
+        q = (question or "").strip()
+        if self.single_flight is None or not q:
+            return await self._answer(q, history_messages, session_id)
+        return await self.single_flight.do(
+            ("answer",) + self._flight_key(q, history_messages, session_id),
+            lambda: self._answer(q, history_messages, session_id),
+        )
+
+    async def answer(self, question: str, history_messages=None, session_id: str | None = None) -> str:
+        return (await self.answer_turn(question, history_messages, session_id)).text
+
+    async def answer_stream(
+        self, question: str, history_messages=None, session_id: str | None = None
+    ) -> AsyncIterator[tuple[str, Any]]:
+        """
+        Yields ("delta", text) while the answer is generated and one final
+        ("done", answer). The final answer is the same one answer() would return,
+        so clients must replace whatever they rendered from the deltas with it.
+        When the answer came from retrieved chunks, ("provenance", Provenance)
+        comes right before "done".
+        """
+        q = (question or "").strip()
+        with timed("plan"):
+            if self.single_flight is None or not q:
+                plan = await self._plan(q, history_messages=history_messages, session_id=session_id)
+            else:
+                # identical concurrent questions share classification + retrieval;
+                # each stream still generates its own tokens
+                plan = await self.single_flight.do(
+                    ("plan",) + self._flight_key(q, history_messages, session_id),
+                    lambda: self._plan(q, history_messages=history_messages, session_id=session_id),
+                )
+        if isinstance(plan, str):
+            plan = Reply(plan)
+        if isinstance(plan, Reply):
+            yield ("delta", plan.text)
+            if plan.provenance is not None:
+                yield ("provenance", plan.provenance)
+            yield ("done", plan.text)
+            return
+
+        guard = FallbackGuard(settings.FALLBACK_TEXT) if plan.strict else None
+        stop = self._stop_condition(plan)
+        parts: list[str] = []
+        async for delta in astream_chat(
+            system_text=plan.system_text,
+            user_text=plan.user_text,
+            history_messages=plan.history_messages,
+            max_tokens=plan.max_tokens,
             temperature=0.0,
-        ).strip()
+            call_site=plan.call_site,
+            stop=stop,
+        ):
+            parts.append(delta)
+            out = guard.feed(delta) if guard is not None else delta
+            if out:
+                yield ("delta", out)
 
-        if not out:
-            return settings.FALLBACK_TEXT
-        if settings.FALLBACK_TEXT.lower() in out.lower():
-            return settings.FALLBACK_TEXT
+        text = "".join(parts)
+        answer = self._finalize(plan, (stop(text) if stop is not None else None) or text)
+        if plan.provenance is not None:
+            yield ("provenance", plan.provenance)
+        yield ("done", answer)
+
+
+class FallbackGuard:
+    """
+    Holds streamed text back while it could still turn into FALLBACK_TEXT,
+    so a strict-mode fallback reply is never shown token by token.
+    Once the text diverges from the fallback prefix it is passed through.
+    """
+    def __init__(self, fallback: str):
+        self.fallback = fallback.lower()
+        self._held = ""
+        self._open = False
+
+    def feed(self, delta: str) -> str:
+        if self._open:
+            return delta
+        self._held += delta
+        head = self._held.lstrip().lower()
+        if self.fallback.startswith(head) or head.startswith(self.fallback):
+            return ""
+        self._open = True
+        out, self._held = self._held, ""
         return out
 
 
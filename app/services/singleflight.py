@@ -0,0 +1,115 @@
+from __future__ import annotations
+import asyncio
+from typing import Awaitable, Callable, Dict, Hashable, TypeVar
+
+from app.services.metrics import REGISTRY
+
+T = TypeVar("T")
+
+FLIGHT_TOTAL = REGISTRY.counter(
+    "rag_singleflight_total", "Requests that started (leader) or joined (follower) a computation", ("result",)
+)
+
+
+def _consume(t: asyncio.Future) -> None:
+    # nobody may be left waiting; do not log "exception was never retrieved"
+    if not t.cancelled():
+        t.exception()
+
+
+class SingleFlight:
+    """
+    Concurrent callers with the same key share one in-flight computation.
+    The computation runs as its own task, so a caller that disconnects
+    (is cancelled) does not cancel it for the others.
+    """
+    def __init__(self):
+        self._inflight: Dict[Hashable, asyncio.Task] = {}
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[T]]) -> T:
+        task = self._inflight.get(key)
+        if task is not None:
+            FLIGHT_TOTAL.inc(result="follower")
+        else:
+            FLIGHT_TOTAL.inc(result="leader")
+            task = asyncio.ensure_future(fn())
+            task.add_done_callback(_consume)
+            self._inflight[key] = task
+            task.add_done_callback(lambda t, k=key: self._inflight.pop(k, None) if self._inflight.get(k) is t else None)
+        return await asyncio.shield(task)
+
+    def __len__(self) -> int:
+        return len(self._inflight)
+
+
+class MicroBatcher:
+    """
+    Collects items requested by concurrent callers for up to `window_seconds`
+    (or until `max_batch` items) and resolves them with one `send` call.
+    Identical items waiting or in flight are shared, not sent twice.
+    """
+    def __init__(
+        self,
+        send: Callable[[list], Awaitable[list]],
+        window_seconds: float,
+        max_batch: int,
+        on_batch: Callable[[int], None] | None = None,
+    ):
+        self.send = send
+        self.window_seconds = window_seconds
+        self.max_batch = max(1, max_batch)
+        self.on_batch = on_batch
+        self._pending: Dict[Hashable, asyncio.Future] = {}
+        self._inflight: Dict[Hashable, asyncio.Future] = {}
+        self._timer: asyncio.TimerHandle | None = None
+        self._loop: asyncio.AbstractEventLoop | None = None
+
+    async def submit(self, items: list) -> list:
+        loop = asyncio.get_running_loop()
+        self._loop = loop
+        futs = []
+        for item in items:
+            f = self._pending.get(item) or self._inflight.get(item)
+            if f is None:
+                f = loop.create_future()
+                f.add_done_callback(_consume)
+                self._pending[item] = f
+            futs.append(f)
+
+        if len(self._pending) >= self.max_batch or self.window_seconds <= 0:
+            self._flush()
+        elif self._timer is None and self._pending:
+            self._timer = loop.call_later(self.window_seconds, self._flush)
+
+        return list(await asyncio.gather(*(asyncio.shield(f) for f in futs)))
+
+    def _flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        pending, self._pending = self._pending, {}
+        items = list(pending)
+        for i in range(0, len(items), self.max_batch):
+            part = {k: pending[k] for k in items[i:i + self.max_batch]}
+            self._inflight.update(part)
+            asyncio.ensure_future(self._send(part))
+
+    async def _send(self, batch: Dict[Hashable, asyncio.Future]) -> None:
+        items = list(batch)
+        if self.on_batch is not None:
+            self.on_batch(len(items))
+        try:
+            results = await self.send(items)
+            for item, res in zip(items, results):
+                if not batch[item].done():
+                    batch[item].set_result(res)
+            if len(results) != len(items):
+                raise RuntimeError(f"batch returned {len(results)} results for {len(items)} items")
+        except BaseException as e:
+            for f in batch.values():
+                if not f.done():
+                    f.set_exception(e)
+        finally:
+            for item in items:
+                if self._inflight.get(item) is batch[item]:
+                    del self._inflight[item]
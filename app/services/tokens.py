@@ -0,0 +1,44 @@
+import math
+import re
+
+from app.core.config import settings
+
+def estimate_tokens(text: str) -> int:
+    """
+    Cheap token estimate (no tokenizer dependency): characters / CHARS_PER_TOKEN.
+    ~4 chars per token holds well enough for English text with BPE tokenizers.
+    """
+    if not text:
+        return 0
+    return max(1, math.ceil(len(text) / settings.CHARS_PER_TOKEN))
+
+# Words and single punctuation marks, roughly what a BPE pre-tokenizer splits on
+_PIECE = re.compile(r"\w+|[^\w\s]")
+_LONG_WORDS: dict[int, re.Pattern] = {}
+
+def count_tokens(text: str, pos: int = 0, endpos: int | None = None) -> int:
+    """
+    Finer estimate than estimate_tokens for short spans (used to size chunks):
+    one token per word or punctuation mark, long words one per
+    2 * CHARS_PER_TOKEN characters. pos/endpos count a slice without copying it.
+    """
+    if endpos is None:
+        endpos = len(text)
+    per = max(1, int(2 * settings.CHARS_PER_TOKEN))
+    long_words = _LONG_WORDS.get(per)
+    if long_words is None:
+        long_words = _LONG_WORDS[per] = re.compile(r"\w{%d,}" % (per + 1))
+    n = len(_PIECE.findall(text, pos, endpos))
+    for w in long_words.findall(text, pos, endpos):
+        n += (len(w) - 1) // per
+    return n
+
+def estimate_messages_tokens(messages: list[dict] | None, per_message_overhead: int = 4) -> int:
+    if not messages:
+        return 0
+    total = 0
+    for m in messages:
+        content = (m or {}).get("content")
+        if isinstance(content, str):
+            total += estimate_tokens(content) + per_message_overhead
+    return total
@@ -1,33 +1,150 @@
 from dataclasses import dataclass
-from typing import List, Tuple
+from pathlib import Path
+from typing import Dict, List, Optional, Protocol, Tuple
+import threading
+import shutil
+import sqlite3
+import uuid
 import chromadb
+import numpy as np
 from chromadb.config import Settings as ChromaSettings
 
 from app.services.chunking import Chunk
+from app.services.matryoshka import FullVectorTable, truncate
 
 @dataclass
 class SearchHit:
     chunk: Chunk
     similarity: float  # cosine similarity in [0..1] approx
 
+def chunk_key(c: Chunk) -> str:
+    return f"{c.source}::chunk::{c.chunk_id}"
+
+def segment_dirs(root: Path) -> List[Path]:
+    """Chroma's per-segment folders (named by segment UUID) in a persist directory."""
+    out = []
+    for d in root.iterdir():
+        if not d.is_dir():
+            continue
+        try:
+            uuid.UUID(d.name)
+        except ValueError:
+            continue  # not a segment folder
+        out.append(d)
+    return out
+
+def prune_orphan_segments(root: Path) -> int:
+    """
+    Remove every segment folder in `root` that its chroma.sqlite3 no longer
+    references (all of them when there is no chroma.sqlite3 left).
+    Returns how many were removed.
+    """
+    db_file = root / "chroma.sqlite3"
+    live: set = set()
+    if db_file.exists():
+        try:
+            con = sqlite3.connect(f"file:{db_file}?mode=ro", uri=True)
+            try:
+                live = {str(r[0]) for r in con.execute("SELECT id FROM segments")}
+            finally:
+                con.close()
+        except Exception:
+            return 0
+
+    removed = 0
+    for d in segment_dirs(root):
+        if d.name not in live:
+            shutil.rmtree(d, ignore_errors=True)
+            removed += 1
+    return removed
+
+class VectorStore(Protocol):
+    """
+    What RAGEngine and the indexer need from a vector backend.
+    Similarities follow ChromaVectorDB's scale so MIN_SIMILARITY
+    means the same thing for every backend.
+    """
+    def reset(self) -> None: ...
+
+    def count(self) -> int: ...
+
+    def delete(self, ids: List[str]) -> None: ...
+
+    def upsert(self, chunks: List[Chunk], embeddings: List[list[float]]) -> None: ...
+
+    def query(self, query_embedding: list[float], top_k: int) -> List[SearchHit]: ...
+
+    def query_many(self, query_embeddings: List[list[float]], top_k: int) -> List[List[SearchHit]]: ...
+
+    def get_chunks(self, ids: List[str]) -> List[Optional[Chunk]]: ...
+
+    def flush(self) -> None: ...
+
+    def close(self) -> None: ...
+
 class ChromaVectorDB:
     """
     Persistent ChromaDB (local disk) using precomputed embeddings.
     We store:
       - documents: chunk text
       - embeddings: vectors
-      - metadatas: source, chunk_id
+      - metadatas: source, chunk_id, start, end (character offsets)
       - ids: unique per chunk
+
+    With first_stage_dim set, the collection (and its HNSW index) holds only
+    the first first_stage_dim dimensions of each embedding, renormalised;
+    the full vectors go to <collection>.full.sqlite3 and re-rank the
+    `candidates` nearest neighbours of a query. Similarities are then
+    computed on the full vectors, on the same scale as without it.
     """
-    def __init__(self, persist_dir: str, collection_name: str = "uniq_kb"):
+    def __init__(self, persist_dir: str, collection_name: str = "uniq_kb", first_stage_dim: int = 0, candidates: int = 200):
         self.persist_dir = persist_dir
         self.collection_name = collection_name
+        self.first_stage_dim = max(0, first_stage_dim)
+        self.candidates = candidates
+        self._full = FullVectorTable(Path(persist_dir) / f"{collection_name}.full.sqlite3") if self.first_stage_dim else None
 
         self.client = chromadb.PersistentClient(
             path=persist_dir,
             settings=ChromaSettings(anonymized_telemetry=False),
         )
         self.collection = self.client.get_or_create_collection(name=collection_name)
+        self.prune_orphan_segments()
+
+        # chunk id -> Chunk, so query results reuse loaded chunks
+        # instead of rebuilding them from documents/metadatas every call
+        self._chunks: Dict[str, Chunk] | None = None
+        self._chunks_lock = threading.Lock()
+
+    def _chunk_table(self) -> Dict[str, Chunk]:
+        if self._chunks is None:
+            with self._chunks_lock:
+                if self._chunks is None:
+                    res = self.collection.get(include=["documents", "metadatas"])
+                    self._chunks = self._to_chunks(res)
+        return self._chunks
+
+    @staticmethod
+    def _to_chunks(res) -> Dict[str, Chunk]:
+        out: Dict[str, Chunk] = {}
+        for cid, doc, meta in zip(res.get("ids") or [], res.get("documents") or [], res.get("metadatas") or []):
+            meta = meta or {}
+            out[str(cid)] = Chunk(
+                source=str(meta.get("source", "")),
+                chunk_id=int(meta.get("chunk_id", 0)),
+                text=str(doc or ""),
+                start=int(meta.get("start", -1)),
+                end=int(meta.get("end", -1)),
+            )
+        return out
+
+    def get_chunks(self, ids: List[str]) -> List[Optional[Chunk]]:
+        table = self._chunk_table()
+        missing = [i for i in ids if i not in table]
+        if missing:
+            # written by another process since we loaded the table
+            table.update(self._to_chunks(self.collection.get(ids=missing, include=["documents", "metadatas"])))
+        return [table.get(i) for i in ids]
 
     def reset(self) -> None:
         # delete + recreate for clean rebuild
@@ -36,11 +153,61 @@ class ChromaVectorDB:
         except Exception:
             pass
         self.collection = self.client.get_or_create_collection(name=self.collection_name)
+        self._chunks = {}
+        if self._full is not None:
+            self._full.reset()
+        self.prune_orphan_segments()
+
+    def flush(self) -> None:
+        pass  # every upsert / delete is written by Chroma right away
+
+    def count(self) -> int:
+        n = int(self.collection.count())
+        if self._full is not None and self._full.count() != n:
+            return -1  # full vectors missing (e.g. written with the first stage off): the indexer rebuilds
+        return n
+
+    def close(self) -> None:
+        """
+        Stop the Chroma system behind this directory so its files can be
+        moved or deleted. Chroma caches one system per path for the whole
+        process: other clients of the same directory stop working too.
+        """
+        from chromadb.api.shared_system_client import SharedSystemClient
+        system = SharedSystemClient._identifier_to_system.pop(self.client._identifier, None)
+        if system is not None:
+            try:
+                system.stop()
+            except Exception:
+                pass
+        self._chunks = None
+        if self._full is not None:
+            self._full.close()
+
+    def delete(self, ids: List[str]) -> None:
+        if ids:
+            self.collection.delete(ids=ids)
+            if self._full is not None:
+                self._full.delete(ids)
+            table = self._chunk_table()
+            for i in ids:
+                table.pop(i, None)
+
+    def prune_orphan_segments(self) -> int:
+        """delete_collection() leaves the old HNSW segment folder on disk: remove those."""
+        return prune_orphan_segments(Path(self.persist_dir))
 
     def upsert(self, chunks: List[Chunk], embeddings: List[list[float]]) -> None:
-        ids = [f"{c.source}::chunk::{c.chunk_id}" for c in chunks]
+        if not chunks:
+            return
+        ids = [chunk_key(c) for c in chunks]
         docs = [c.text for c in chunks]
-        metas = [{"source": c.source, "chunk_id": c.chunk_id} for c in chunks]
+        metas = [{"source": c.source, "chunk_id": c.chunk_id, "start": c.start, "end": c.end} for c in chunks]
+
+        if self._full is not None:
+            full = np.asarray(embeddings, dtype=np.float32)
+            self._full.upsert(ids, full)
+            embeddings = truncate(full, self.first_stage_dim).tolist()
 
         # Chroma needs lists
         self.collection.upsert(
@@ -49,34 +216,93 @@ class ChromaVectorDB:
             metadatas=metas,
             embeddings=embeddings,
         )
+        table = self._chunk_table()
+        for k, c in zip(ids, chunks):
+            table[k] = c
 
     def query(self, query_embedding: list[float], top_k: int) -> List[SearchHit]:
+        return self.query_many([query_embedding], top_k)[0]
+
+    def query_many(self, query_embeddings: List[list[float]], top_k: int) -> List[List[SearchHit]]:
+        """
+        One Chroma call for N queries; results come back per query, in order.
+        """
+        if not query_embeddings:
+            return []
+        count = int(self.collection.count())
+        n = min(top_k, count)
+        if n <= 0:
+            return [[] for _ in query_embeddings]
+
+        if self._full is not None:
+            return self._query_two_stage(query_embeddings, n, count)
+
         res = self.collection.query(
-            query_embeddings=[query_embedding],
-            n_results=top_k,
-            include=["documents", "metadatas", "distances"],
+            query_embeddings=query_embeddings,
+            n_results=n,
+            include=["distances"],
         )
+        all_ids = res.get("ids") or []
+        all_dists = res.get("distances") or []
 
-        docs = (res.get("documents") or [[]])[0]
-        metas = (res.get("metadatas") or [[]])[0]
-        dists = (res.get("distances") or [[]])[0]
+        chunks = dict(zip(
+            (i for ids in all_ids for i in ids),
+            self.get_chunks([i for ids in all_ids for i in ids]),
+        ))
 
-        hits: List[SearchHit] = []
-        for doc, meta, dist in zip(docs, metas, dists):
-            # Chroma returns distance depending on backend; commonly cosine distance (0=best)
-            # Convert to similarity:
-            try:
-                similarity = 1.0 - float(dist)
-            except Exception:
-                similarity = 0.0
+        out: List[List[SearchHit]] = []
+        for ids, dists in zip(all_ids, all_dists):
+            hits: List[SearchHit] = []
+            for cid, dist in zip(ids, dists):
+                chunk = chunks.get(cid)
+                if chunk is None:
+                    continue
+                # Chroma returns distance depending on backend; commonly cosine distance (0=best)
+                # Convert to similarity:
+                try:
+                    similarity = 1.0 - float(dist)
+                except Exception:
+                    similarity = 0.0
+                hits.append(SearchHit(chunk=chunk, similarity=similarity))
 
-            chunk = Chunk(
-                source=str(meta.get("source", "")),
-                chunk_id=int(meta.get("chunk_id", 0)),
-                text=str(doc or ""),
-            )
-            hits.append(SearchHit(chunk=chunk, similarity=similarity))
+            # Ensure sorted by best similarity
+            hits.sort(key=lambda x: x.similarity, reverse=True)
+            out.append(hits)
+        return out
 
-        # Ensure sorted by best similarity
-        hits.sort(key=lambda x: x.similarity, reverse=True)
-        return hits
\ No newline at end of file
+    def _query_two_stage(self, query_embeddings: List[list[float]], top_k: int, count: int) -> List[List[SearchHit]]:
+        full_q = np.asarray(query_embeddings, dtype=np.float32)
+        res = self.collection.query(
+            query_embeddings=truncate(full_q, self.first_stage_dim).tolist(),
+            n_results=min(max(top_k, self.candidates), count),
+            include=[],
+        )
+        all_ids = res.get("ids") or []
+        flat = list(dict.fromkeys(i for ids in all_ids for i in ids))
+        vectors = self._full.get(flat)
+        chunks = dict(zip(flat, self.get_chunks(flat)))
+
+        out: List[List[SearchHit]] = []
+        for q, ids in zip(full_q, all_ids):
+            ids = [i for i in ids if i in vectors and chunks.get(i) is not None]
+            if not ids:
+                out.append([])
+                continue
+            # 1 - squared L2 distance, what Chroma's l2 space reports for the full vectors
+            d2 = ((np.stack([vectors[i] for i in ids]) - q) ** 2).sum(axis=1)
+            best = np.argsort(d2)[:top_k]
+            out.append([SearchHit(chunk=chunks[ids[j]], similarity=float(1.0 - d2[j])) for j in best])
+        return out
+
+def create_vector_store(backend: str, persist_dir: str, collection_name: str = "uniq_kb", **options) -> VectorStore:
+    """
+    backend: "chroma" (default) or "numpy" (in-process brute force over a memory-mapped .npy)
+    options: quantization / first_stage_quantization (numpy only), first_stage_dim, candidates
+    """
+    backend = (backend or "chroma").strip().lower()
+    if backend == "numpy":
+        from app.services.numpy_store import NumpyVectorDB
+        return NumpyVectorDB(persist_dir=persist_dir, collection_name=collection_name, **options)
+    if backend == "chroma":
+        return ChromaVectorDB(persist_dir=persist_dir, collection_name=collection_name, **options)
+    raise ValueError(f"Unknown VECTOR_BACKEND: {backend!r}")
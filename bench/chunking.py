@@ -0,0 +1,154 @@
+"""
+Chunker benchmark: the current offset-based chunk_text against the previous
+string-concatenating implementation, on inputs of growing size.
+
+    python -m bench.chunking --sizes-mb 0.5,1,2,4 [--unit tokens] [--json out.json]
+
+A linear chunker keeps roughly constant ms/MB as the input grows; the
+legacy one degrades on long paragraphs (its hard-split loop re-slices
+the remaining buffer on every iteration). The "unpunctuated" layout is a
+single line of words with no sentence or paragraph break at all (scraped
+tables, transcripts): every cut has to be sized inside one "sentence".
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import random
+import re
+import time
+from typing import Callable, List
+
+from app.services.chunking import Chunk, chunk_text
+
+WORDS = (
+    "uniq technologies offers python java full stack data science training "
+    "placement internship course fees duration certificate batch online "
+    "offline chennai project mentor interview support"
+).split()
+
+
+def legacy_chunk_text(source: str, text: str, chunk_size: int, overlap: int) -> List[Chunk]:
+    """The chunker before offsets and token sizing, kept verbatim for comparison."""
+    text = text.replace("\r\n", "\n").replace("\r", "\n")
+    text = re.sub(r"\n{3,}", "\n\n", text).strip()
+    if not text:
+        return []
+
+    paras = [p.strip() for p in text.split("\n\n") if p.strip()]
+    chunks: List[Chunk] = []
+    buf = ""
+    cid = 0
+
+    def flush(b: str):
+        nonlocal cid
+        b = b.strip()
+        if b:
+            chunks.append(Chunk(source=source, chunk_id=cid, text=b))
+            cid += 1
+
+    for p in paras:
+        if not buf:
+            buf = p
+            continue
+
+        if len(buf) + 2 + len(p) <= chunk_size:
+            buf = buf + "\n\n" + p
+        else:
+            flush(buf)
+
+            tail = buf[-overlap:] if overlap > 0 else ""
+            buf = (tail + "\n\n" + p).strip()
+
+            while len(buf) > chunk_size:
+                flush(buf[:chunk_size])
+                tail2 = buf[chunk_size - overlap:chunk_size] if overlap > 0 else ""
+                buf = (tail2 + buf[chunk_size:]).strip()
+
+    flush(buf)
+    return chunks
+
+
+def make_text(n_chars: int, paragraph_words: int, seed: int = 0, punctuation: bool = True) -> str:
+    """
+    Sentences of random words in paragraphs of ~paragraph_words words;
+    0 means a short heading followed by a single huge paragraph.
+    Without punctuation: no sentence ends and no heading (so with
+    paragraph_words=0 one single line).
+    """
+    rnd = random.Random(seed)
+    parts: List[str] = [] if paragraph_words or not punctuation else ["Introduction\n\n"]
+    size = sum(len(p) for p in parts)
+    words_in_para = 0
+    while size < n_chars:
+        sentence = " ".join(rnd.choice(WORDS) for _ in range(rnd.randint(6, 18)))
+        sentence = sentence.capitalize() + ". " if punctuation else sentence + " "
+        parts.append(sentence)
+        size += len(sentence)
+        words_in_para += sentence.count(" ")
+        if paragraph_words and words_in_para >= paragraph_words:
+            parts.append("\n\n")
+            words_in_para = 0
+    return "".join(parts)[:n_chars]
+
+
+def _time(fn: Callable[[], list], repeat: int) -> tuple[float, int]:
+    best = float("inf")
+    n = 0
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        n = len(fn())
+        best = min(best, time.perf_counter() - t0)
+    return best, n
+
+
+def run(sizes_mb: List[float], chunk_size: int, overlap: int, unit: str, repeat: int, skip_legacy_over_mb: float) -> List[dict]:
+    rows = []
+    for layout, para_words, punctuation in (
+        ("paragraphs", 120, True), ("single-paragraph", 0, True), ("unpunctuated", 0, False),
+    ):
+        for mb in sizes_mb:
+            text = make_text(int(mb * 1024 * 1024), para_words, punctuation=punctuation)
+            new_s, new_n = _time(lambda: chunk_text("bench", text, chunk_size, overlap, unit=unit), repeat)
+            row = {
+                "layout": layout,
+                "mb": mb,
+                "unit": unit,
+                "chunks": new_n,
+                "seconds": round(new_s, 4),
+                "ms_per_mb": round(1000 * new_s / mb, 1),
+            }
+            if unit == "chars" and mb <= skip_legacy_over_mb:
+                old_s, old_n = _time(lambda: legacy_chunk_text("bench", text, chunk_size, overlap), 1)
+                row.update(legacy_chunks=old_n, legacy_seconds=round(old_s, 4), legacy_ms_per_mb=round(1000 * old_s / mb, 1))
+            rows.append(row)
+    return rows
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--sizes-mb", default="0.5,1,2,4")
+    ap.add_argument("--chunk-size", type=int, default=900)
+    ap.add_argument("--overlap", type=int, default=140)
+    ap.add_argument("--unit", choices=("chars", "tokens"), default="chars")
+    ap.add_argument("--repeat", type=int, default=3)
+    ap.add_argument("--skip-legacy-over-mb", type=float, default=4.0, help="the legacy chunker is quadratic; skip it above this size")
+    ap.add_argument("--json", help="also write the rows to this file")
+    args = ap.parse_args()
+
+    sizes = [float(x) for x in args.sizes_mb.split(",") if x.strip()]
+    rows = run(sizes, args.chunk_size, args.overlap, args.unit, args.repeat, args.skip_legacy_over_mb)
+
+    print(f"{'layout':<17} {'MB':>5} {'chunks':>7} {'s':>8} {'ms/MB':>8} {'legacy s':>9} {'legacy ms/MB':>13}")
+    for r in rows:
+        print(
+            f"{r['layout']:<17} {r['mb']:>5} {r['chunks']:>7} {r['seconds']:>8} {r['ms_per_mb']:>8} "
+            f"{r.get('legacy_seconds', '-'):>9} {r.get('legacy_ms_per_mb', '-'):>13}"
+        )
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(rows, f, indent=1)
+
+
+if __name__ == "__main__":
+    main()
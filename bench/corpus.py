@@ -0,0 +1,194 @@
+"""
+Synthetic knowledge corpus with labelled questions, for retrieval benchmarks.
+
+    python -m bench.corpus --chunks 100000 --out bench_data/corpus_100k
+
+Every paragraph states one fact about a unique, made-up course
+("The course fee of Kavotimura is Rs. 42,500.") among filler
+sentences that keep mentioning the course, and is sized so the chunker keeps it as one chunk:
+the corpus has about --chunks chunks at --chunk-size / --overlap. questions.jsonl
+holds questions about sampled facts (with the source file and the
+expected value) plus unanswerable ones about courses that do not exist.
+
+Disk use is roughly chunks * 0.8 * (chunk_size - overlap) bytes (~610 MB for 1M chunks).
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import random
+import shutil
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Callable, List, Optional, Tuple
+
+CORPUS_FORMAT = 2
+
+_SYLLABLES = (
+    "ka", "vo", "ti", "mu", "ra", "ne", "so", "li", "pa", "de", "ru", "mi", "zo", "ba", "fe", "go",
+    "hu", "ji", "ko", "lu", "ma", "no", "pi", "qua", "re", "sa", "tu", "vi", "wa", "xe", "ya", "zu",
+)
+_NAME_SPACE = len(_SYLLABLES) ** 5
+_NAME_STRIDE = 7919 * 104729  # odd, so i -> i * stride mod 32^5 is a permutation
+
+
+def course_name(i: int) -> str:
+    """A unique pronounceable name for course number i (neighbours look unrelated)."""
+    n = (i * _NAME_STRIDE) % _NAME_SPACE
+    parts = []
+    for _ in range(5):
+        n, r = divmod(n, len(_SYLLABLES))
+        parts.append(_SYLLABLES[r])
+    return "".join(parts).capitalize()
+
+
+_CITIES = ("Chennai", "Madurai", "Coimbatore", "Trichy", "Salem", "Vellore", "Tirunelveli", "Erode")
+
+# (attribute, value generator)
+ATTRIBUTES: Tuple[Tuple[str, Callable[[random.Random], str]], ...] = (
+    ("course fee", lambda r: f"Rs. {r.randint(5, 95)},{r.choice(('000', '500'))}"),
+    ("duration", lambda r: f"{r.randint(2, 40)} weeks"),
+    ("lead mentor", lambda r: f"{course_name(r.randint(0, 10**6))} {r.choice('ABCDEFGHKMNPRS')}."),
+    ("batch timing", lambda r: f"{r.randint(6, 11)}:{r.choice(('00', '30'))} AM to {r.randint(1, 8)}:{r.choice(('00', '30'))} PM"),
+    ("training branch", lambda r: f"{r.choice(_CITIES)} branch {r.randint(1, 60)}"),
+    ("helpline number", lambda r: f"+91 {r.randint(70000, 99999)} {r.randint(10000, 99999)}"),
+)
+
+
+@dataclass
+class LabelledQuestion:
+    question: str
+    answerable: bool
+    source: str = ""   # file holding the answer
+    answer: str = ""   # value a relevant chunk contains
+    course: str = ""
+
+
+def _question(attr: str, course: str) -> str:
+    return f"What is the {attr} of {course}?"
+
+
+# filler vocabulary: a few thousand made-up words that never occur in questions,
+# so only the fact sentence links a paragraph to its questions
+_FILLER = [course_name(10**7 + i)[: 4 + i % 5].lower() for i in range(4000)]
+
+
+def _filler(rnd: random.Random) -> str:
+    return " ".join(rnd.choice(_FILLER) for _ in range(rnd.randint(8, 16))).capitalize() + "."
+
+
+def _paragraph(rnd: random.Random, course: str, fact: str, size: int) -> str:
+    sentences = [_filler(rnd), fact]
+    length = sum(len(s) + 1 for s in sentences)
+    while length < size:
+        s = _filler(rnd)
+        if rnd.random() < 0.5:
+            # a section keeps mentioning its subject
+            s = f"{course} {s[0].lower()}{s[1:]}"
+        sentences.append(s)
+        length += len(s) + 1
+    return " ".join(sentences)
+
+
+def make_corpus(
+    out_dir: Path,
+    chunks: int,
+    chunk_size: int = 900,
+    overlap: int = 140,
+    paragraphs_per_file: int = 200,
+    questions: int = 200,
+    unanswerable: float = 0.2,
+    seed: int = 0,
+) -> List[LabelledQuestion]:
+    """
+    Write the corpus (doc_*.txt, the repo's bot rules and intent examples,
+    questions.jsonl, corpus.json) unless out_dir already holds the same one.
+    """
+    params = {
+        "format": CORPUS_FORMAT,
+        "chunks": chunks,
+        "chunk_size": chunk_size,
+        "overlap": overlap,
+        "paragraphs_per_file": paragraphs_per_file,
+        "questions": questions,
+        "unanswerable": unanswerable,
+        "seed": seed,
+    }
+    existing = load_questions(out_dir, params)
+    if existing is not None:
+        return existing
+
+    if out_dir.exists():
+        shutil.rmtree(out_dir)
+    out_dir.mkdir(parents=True)
+    repo_knowledge = Path(__file__).resolve().parent.parent / "knowledge"
+    for name in ("bot_rules.txt", "intent_examples.json"):
+        if (repo_knowledge / name).exists():
+            shutil.copy(repo_knowledge / name, out_dir / name)
+
+    rnd = random.Random(seed)
+    n_unanswerable = int(questions * unanswerable)
+    asked = set(rnd.sample(range(chunks), min(chunks, questions - n_unanswerable)))
+    # one paragraph plus the overlap carried over from the previous chunk fits in a chunk, two do not
+    para_size = int(0.8 * (chunk_size - overlap))
+
+    labelled: List[LabelledQuestion] = []
+    for f0 in range(0, chunks, paragraphs_per_file):
+        source = f"doc_{f0 // paragraphs_per_file:05d}.txt"
+        paras = []
+        for i in range(f0, min(chunks, f0 + paragraphs_per_file)):
+            course = course_name(i)
+            attr, value_of = ATTRIBUTES[i % len(ATTRIBUTES)]
+            value = value_of(rnd)
+            paras.append(_paragraph(rnd, course, f"The {attr} of {course} is {value}.", para_size))
+            if i in asked:
+                labelled.append(LabelledQuestion(_question(attr, course), True, source, value, course))
+        (out_dir / source).write_text("\n\n".join(paras) + "\n", encoding="utf-8")
+
+    for j in range(n_unanswerable):
+        course = course_name(chunks + j)  # never written
+        attr = ATTRIBUTES[j % len(ATTRIBUTES)][0]
+        labelled.append(LabelledQuestion(_question(attr, course), False, course=course))
+    rnd.shuffle(labelled)
+
+    with open(out_dir / "questions.jsonl", "w", encoding="utf-8") as f:
+        for q in labelled:
+            f.write(json.dumps(asdict(q)) + "\n")
+    # written last: its presence marks a complete corpus
+    (out_dir / "corpus.json").write_text(json.dumps(params, indent=1), encoding="utf-8")
+    return labelled
+
+
+def load_questions(out_dir: Path, params: Optional[dict] = None) -> Optional[List[LabelledQuestion]]:
+    """The labelled questions of a finished corpus (None if missing or built with other params)."""
+    try:
+        meta = json.loads((out_dir / "corpus.json").read_text(encoding="utf-8"))
+        if params is not None and meta != params:
+            return None
+        with open(out_dir / "questions.jsonl", encoding="utf-8") as f:
+            return [LabelledQuestion(**json.loads(line)) for line in f if line.strip()]
+    except (OSError, ValueError, TypeError):
+        return None
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--out", required=True)
+    ap.add_argument("--chunks", type=int, default=10000)
+    ap.add_argument("--chunk-size", type=int, default=900)
+    ap.add_argument("--overlap", type=int, default=140)
+    ap.add_argument("--paragraphs-per-file", type=int, default=200)
+    ap.add_argument("--questions", type=int, default=200)
+    ap.add_argument("--unanswerable", type=float, default=0.2, help="share of questions with no answer in the corpus")
+    ap.add_argument("--seed", type=int, default=0)
+    args = ap.parse_args()
+
+    qs = make_corpus(
+        Path(args.out), args.chunks, args.chunk_size, args.overlap, args.paragraphs_per_file,
+        args.questions, args.unanswerable, args.seed,
+    )
+    print(f"{args.out}: ~{args.chunks} chunks, {len(qs)} questions ({sum(not q.answerable for q in qs)} unanswerable)")
+
+
+if __name__ == "__main__":
+    main()
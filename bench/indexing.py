@@ -0,0 +1,132 @@
+"""
+Index build scaling: sync_index into a fresh vector store for corpora of
+growing size, with hashed embeddings computed in-process (no LM server),
+so the time is chunking, batching and writing the index.
+
+    python -m bench.indexing --chunks 3000,10000,30000,100000 --backends numpy,chroma [--json out.json]
+
+A linear build keeps roughly constant chunks/s as the corpus grows (the
+embedding time is reported apart and excluded from "write chunks/s").
+Every build runs in a fresh process, so one does not inherit the heap
+of the previous. Exits with 1 when a backend builds its largest corpus at less than
+--min-ratio of the write chunks/s it reached on the smallest one.
+"""
+from __future__ import annotations
+
+import argparse
+import functools
+import json
+import multiprocessing
+import shutil
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import List
+
+from app.services.chunking import chunk_text
+from app.services.indexing import sync_index
+from app.services.knowledge import iter_knowledge_files
+from app.services.lexical import BM25Index
+from app.services.vectorstore import create_vector_store
+from bench.corpus import make_corpus
+from bench.stub_lm import hashed_embedding
+
+
+class _TimedEmbedder:
+    def __init__(self, dim: int):
+        self.dim = dim
+        self.seconds = 0.0
+
+    def __call__(self, texts: List[str]) -> List[List[float]]:
+        t0 = time.perf_counter()
+        out = [hashed_embedding(t, self.dim) for t in texts]
+        self.seconds += time.perf_counter() - t0
+        return out
+
+
+def build(backend: str, corpus_dir: Path, index_dir: Path, dim: int, chunk_size: int, overlap: int, batch_size: int) -> dict:
+    if index_dir.exists():
+        shutil.rmtree(index_dir)
+    vdb = create_vector_store(backend, persist_dir=str(index_dir), collection_name="uniq_kb")
+    embed = _TimedEmbedder(dim)
+    sources = sorted(p.name for p in corpus_dir.glob("doc_*.txt"))
+
+    t0 = time.perf_counter()
+    stats = sync_index(
+        vdb,
+        iter_knowledge_files(corpus_dir, sources),
+        chunker=functools.partial(chunk_text, chunk_size=chunk_size, overlap=overlap),
+        manifest_path=index_dir / "uniq_kb.manifest.json",
+        fingerprint={"bench": 1, "dim": dim},
+        batch_size=batch_size,
+        lexical=BM25Index(),
+        embed=embed,
+    )
+    seconds = time.perf_counter() - t0
+    vdb.close()
+    shutil.rmtree(index_dir, ignore_errors=True)
+
+    write = max(seconds - embed.seconds, 1e-9)
+    return {
+        "backend": backend,
+        "chunks": stats.chunks,
+        "seconds": round(seconds, 3),
+        "chunks_per_s": round(stats.chunks / seconds, 1),
+        "embed_seconds": round(embed.seconds, 3),
+        "write_chunks_per_s": round(stats.chunks / write, 1),
+    }
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--chunks", default="3000,10000,30000")
+    ap.add_argument("--backends", default="numpy")
+    ap.add_argument("--dim", type=int, default=768)
+    ap.add_argument("--chunk-size", type=int, default=900)
+    ap.add_argument("--overlap", type=int, default=140)
+    ap.add_argument("--batch-size", type=int, default=64)
+    ap.add_argument("--min-ratio", type=float, default=0.5, help="largest / smallest write chunks/s below this fails")
+    ap.add_argument("--data-dir", default="bench_data")
+    ap.add_argument("--json", help="also write the rows to this file")
+    args = ap.parse_args()
+
+    sizes = sorted(int(x) for x in args.chunks.split(",") if x.strip())
+    backends = [b.strip() for b in args.backends.split(",") if b.strip()]
+    data_dir = Path(args.data_dir)
+
+    rows = []
+    print(f"{'backend':<8} {'chunks':>8} {'s':>9} {'chunks/s':>9} {'embed s':>8} {'write chunks/s':>15}")
+    for n in sizes:
+        corpus_dir = data_dir / f"corpus_{n}_{args.chunk_size}_{args.overlap}"
+        make_corpus(corpus_dir, n, chunk_size=args.chunk_size, overlap=args.overlap, questions=0)
+        for backend in backends:
+            with ProcessPoolExecutor(1, mp_context=multiprocessing.get_context("spawn")) as pool:
+                r = pool.submit(
+                    build, backend, corpus_dir, data_dir / f"index_{backend}",
+                    args.dim, args.chunk_size, args.overlap, args.batch_size,
+                ).result()
+            rows.append(r)
+            print(
+                f"{r['backend']:<8} {r['chunks']:>8} {r['seconds']:>9} {r['chunks_per_s']:>9} "
+                f"{r['embed_seconds']:>8} {r['write_chunks_per_s']:>15}",
+                flush=True,
+            )
+
+    failed = False
+    for backend in backends:
+        mine = [r for r in rows if r["backend"] == backend]
+        if len(mine) < 2:
+            continue
+        ratio = mine[-1]["write_chunks_per_s"] / mine[0]["write_chunks_per_s"]
+        print(f"{backend}: write chunks/s at {mine[-1]['chunks']} = {ratio:.2f} x at {mine[0]['chunks']}")
+        failed |= ratio < args.min_ratio
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(rows, f, indent=1)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,361 @@
+"""
+Stub OpenAI-compatible LM server for load tests and benchmarks.
+
+    python -m bench.stub_lm --port 18234 --latency-ms 50 --fail-rate 0.1
+    python -m bench.stub_lm --embed-latency-ms 5 --chat-latency-ms 300 --token-ms 20
+    python -m bench.stub_lm --prefill-ms 0.5 --prompt-cache 8
+    python -m bench.stub_lm --token-ms 20 --fallback-rate 0.3 --chatter-words 40
+
+Serves GET /v1/models, POST /v1/embeddings (deterministic hashed
+bag-of-words vectors, so texts sharing words are similar) and POST /v1/chat/completions (plain and streamed).
+With --nested the embeddings behave like a Matryoshka model's: dense, and
+every power-of-two prefix (from 32 dimensions) is a coarser embedding of its own.
+
+Chat prompts go through a simulated prompt (KV) cache of the last
+--prompt-cache prompts: only the part of a prompt after the longest prefix
+it shares with one of them costs --prefill-ms per token (4 characters). Responses report
+usage.prompt_tokens_details.cached_tokens and llama.cpp-style timings.
+
+Replies honour max_tokens (one word = one token) and stop sequences. A
+--fallback-rate share of prompts that say "reply exactly:\n<line>" get that
+line, and the intent classifier its label; both followed by
+--chatter-words more words, like a model that keeps talking, unless a
+grammar or json_schema response_format constrains the label. A stream
+whose client disconnects stops generating, as llama.cpp does; the
+completion_tokens and cancelled counters show what was generated.
+"""
+from __future__ import annotations
+
+import argparse
+import functools
+import hashlib
+import json
+import math
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from collections import OrderedDict
+from typing import List
+
+
+@functools.lru_cache(maxsize=1 << 16)
+def _bucket(word: str, dim: int, salt: int = 0) -> tuple[int, float]:
+    h = int(hashlib.md5((f"{salt}:{word}" if salt else word).encode("utf-8")).hexdigest(), 16)
+    # signed hashing: colliding words cancel out on average instead of adding up
+    return h % dim, 1.0 if (h >> 64) & 1 else -1.0
+
+
+_WORD = re.compile(r"\w+")
+_STOPWORDS = frozenset("a an and are do does for how i in is it me of on or the to what when where which who why you".split())
+
+
+@functools.lru_cache(maxsize=64)
+def _segments(dim: int, smallest: int = 32) -> tuple[tuple[int, int], ...]:
+    """[0, s) [s, 2s) [2s, 4s) ... up to dim: each prefix ending at a boundary sees every word."""
+    bounds = [dim]
+    while bounds[-1] % 2 == 0 and bounds[-1] // 2 >= smallest:
+        bounds.append(bounds[-1] // 2)
+    bounds.append(0)
+    bounds.reverse()
+    return tuple(zip(bounds, bounds[1:]))
+
+
+@functools.lru_cache(maxsize=64)
+def _rotation(size: int, salt: int):
+    import numpy as np
+
+    q, _ = np.linalg.qr(np.random.default_rng(1000003 * salt + size).normal(size=(size, size)))
+    return q
+
+
+def hashed_embedding(text: str, dim: int, nested: bool = False) -> List[float]:
+    """
+    Bag of words (minus stopwords) hashed into dim signed buckets, L2-normalised.
+    nested: hashed once per _segments() slice instead, so leading prefixes are
+    (noisier) embeddings too, and each slice randomly rotated: dense like a
+    real model's vectors, with the same dot products.
+    """
+    v = [0.0] * dim
+    segments = _segments(dim) if nested else ((0, dim),)
+    for w in _WORD.findall(text.lower()):
+        if w not in _STOPWORDS:
+            for salt, (lo, hi) in enumerate(segments):
+                i, sign = _bucket(w, hi - lo, salt)
+                v[lo + i] += sign
+    if nested:
+        import numpy as np
+
+        a = np.asarray(v)
+        for salt, (lo, hi) in enumerate(segments):
+            a[lo:hi] = _rotation(hi - lo, salt) @ a[lo:hi]
+        v = a.tolist()
+    n = math.sqrt(sum(x * x for x in v)) or 1.0
+    return [x / n for x in v]
+
+
+CHARS_PER_TOKEN = 4
+
+
+def _common_prefix(a: str, b: str) -> int:
+    n = min(len(a), len(b))
+    if a[:n] == b[:n]:
+        return n
+    lo, hi = 0, n  # a[:lo] == b[:lo], a[:hi] != b[:hi]
+    while hi - lo > 1:
+        mid = (lo + hi) // 2
+        if a[:mid] == b[:mid]:
+            lo = mid
+        else:
+            hi = mid
+    return lo
+
+
+class PromptCache:
+    """
+    The last `size` prompts (plus replies) processed, least recently used out,
+    like llama.cpp's prompt cache: a new prompt skips the prefill of the
+    longest prefix it shares with any of them.
+    """
+    def __init__(self, size: int):
+        self.size = max(1, size)
+        self._entries: "OrderedDict[str, None]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def process(self, prompt: str, reply: str) -> int:
+        """Characters of `prompt` already cached; prompt + reply is cached afterwards."""
+        with self._lock:
+            best, cached = None, 0
+            for text in self._entries:
+                n = _common_prefix(text, prompt)
+                if n > cached:
+                    best, cached = text, n
+            if best is not None:
+                self._entries.move_to_end(best)
+            self._entries[prompt + reply] = None
+            self._entries.move_to_end(prompt + reply)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+            return cached
+
+
+def render_prompt(messages: list) -> str:
+    """What a chat template makes of the messages (role markers + content)."""
+    return "".join(f"<|{m.get('role')}|>{m.get('content') or ''}<|end|>" for m in messages) + "<|assistant|>"
+
+
+class StubConfig:
+    def __init__(self, dim: int = 64, latency_ms: float = 0.0, token_ms: float = 0.0,
+                 fail_rate: float = 0.0, answer: str = "Stub answer about UNIQ.",
+                 embed_latency_ms: float | None = None, chat_latency_ms: float | None = None,
+                 prefill_ms: float = 0.0, prompt_cache: int = 8, answer_words: int = 0, nested: bool = False,
+                 fallback_rate: float = 0.0, chatter_words: int = 0):
+        self.dim = dim
+        self.nested = nested  # Matryoshka-like embeddings
+        self.latency_ms = latency_ms
+        # per endpoint; None = latency_ms
+        self.embed_latency_ms = latency_ms if embed_latency_ms is None else embed_latency_ms
+        self.chat_latency_ms = latency_ms if chat_latency_ms is None else chat_latency_ms
+        self.token_ms = token_ms
+        self.fail_rate = fail_rate
+        self.answer = answer
+        self.answer_words = answer_words  # > 0: pad replies to this length, with words that depend on the question
+        self.prefill_ms = prefill_ms  # per uncached prompt token
+        self.prompt_cache = PromptCache(prompt_cache)
+        self.fallback_rate = fallback_rate  # share of "reply exactly:" prompts answered with that line
+        self.chatter_words = chatter_words  # words added after a label or that line
+        # prefill_us: simulated prefill time in microseconds (counters stay integers)
+        # completion_tokens: words actually generated (streams stop early when the client goes away)
+        self.calls = {
+            "embeddings": 0, "embedded_texts": 0, "chat": 0, "failed": 0,
+            "prompt_tokens": 0, "cached_tokens": 0, "prefill_us": 0,
+            "completion_tokens": 0, "cancelled": 0,
+        }
+        self._lock = threading.Lock()
+
+    def count(self, key: str, n: int = 1) -> None:
+        with self._lock:
+            self.calls[key] += n
+
+    @staticmethod
+    def _filler(rnd: random.Random, n: int) -> list:
+        return [rnd.choice(("course", "batch", "fee", "mentor", "week", "branch", "UNIQ", "details", "offers", "the"))
+                for _ in range(n)]
+
+    def reply(self, messages: list, constrained: bool = False) -> str:
+        system = ((messages or [{}])[0].get("content") or "")
+        last = next((m.get("content") or "" for m in reversed(messages) if m.get("role") == "user"), "")
+        rnd = random.Random(hashlib.md5(last.encode("utf-8")).hexdigest())
+        if "intent classifier" in system:
+            if constrained or not self.chatter_words:
+                return "uniq_question"
+            return "uniq_question\n\n" + " ".join(["Because"] + self._filler(rnd, self.chatter_words - 1)) + "."
+        exact = re.search(r"reply exactly:\n(.+)", last)
+        if exact and rnd.random() < self.fallback_rate:
+            return " ".join([exact.group(1).strip()] + self._filler(rnd, self.chatter_words)).strip()
+
+        words = self.answer.split(" ")
+        if len(words) >= self.answer_words:
+            return self.answer
+        return " ".join(words + self._filler(rnd, self.answer_words - len(words))) + "."
+
+
+class _Handler(BaseHTTPRequestHandler):
+    config: StubConfig
+
+    def log_message(self, *args):
+        pass
+
+    def _json(self, obj, status: int = 200) -> None:
+        body = json.dumps(obj).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path.endswith("/models"):
+            self._json({"data": [{"id": "stub-model"}], "calls": self.config.calls})
+        else:
+            self._json({"error": "not found"}, status=404)
+
+    def do_POST(self):
+        cfg = self.config
+        n = int(self.headers.get("Content-Length", 0))
+        payload = json.loads(self.rfile.read(n) or b"{}")
+
+        latency = cfg.embed_latency_ms if self.path.endswith("/embeddings") else cfg.chat_latency_ms
+        if latency:
+            time.sleep(latency / 1000.0)
+        if cfg.fail_rate and random.random() < cfg.fail_rate:
+            cfg.count("failed")
+            self._json({"error": "injected failure"}, status=503)
+            return
+
+        if self.path.endswith("/embeddings"):
+            inp = payload.get("input", [])
+            inp = [inp] if isinstance(inp, str) else inp
+            cfg.count("embeddings")
+            cfg.count("embedded_texts", len(inp))
+            self._json({"data": [{"index": i, "embedding": hashed_embedding(t, cfg.dim, cfg.nested)} for i, t in enumerate(inp)]})
+            return
+
+        if self.path.endswith("/chat/completions"):
+            cfg.count("chat")
+            constrained = bool(payload.get("grammar") or payload.get("response_format"))
+            text = cfg.reply(payload.get("messages") or [], constrained)
+            for stop in payload.get("stop") or []:
+                if stop in text:
+                    text = text[: text.index(stop)]
+            words = text.split(" ")[: max(1, int(payload.get("max_tokens") or 1 << 30))]
+            text = " ".join(words)
+            if (payload.get("response_format") or {}).get("type") == "json_schema":
+                text = json.dumps({"label": text})
+                words = [text]
+            rendered = render_prompt(payload.get("messages") or [])
+            prompt = len(rendered) // CHARS_PER_TOKEN
+            cached = cfg.prompt_cache.process(rendered, text) // CHARS_PER_TOKEN
+            prefill_ms = (prompt - cached) * cfg.prefill_ms
+            cfg.count("prompt_tokens", prompt)
+            cfg.count("cached_tokens", cached)
+            cfg.count("prefill_us", int(prefill_ms * 1000))
+            if prefill_ms:
+                time.sleep(prefill_ms / 1000.0)
+            usage = {
+                "prompt_tokens": prompt,
+                "completion_tokens": len(words),
+                "prompt_tokens_details": {"cached_tokens": cached},
+            }
+            timings = {"cache_n": cached, "prompt_n": prompt - cached, "prompt_ms": round(prefill_ms, 3)}
+            if payload.get("stream"):
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.end_headers()
+                try:
+                    for i, w in enumerate(words):
+                        delta = w if i == len(words) - 1 else w + " "
+                        chunk = {"choices": [{"delta": {"content": delta}}]}
+                        self.wfile.write(("data: " + json.dumps(chunk) + "\n\n").encode("utf-8"))
+                        self.wfile.flush()
+                        cfg.count("completion_tokens")
+                        if cfg.token_ms:
+                            time.sleep(cfg.token_ms / 1000.0)
+                    if (payload.get("stream_options") or {}).get("include_usage"):
+                        final = {"choices": [], "usage": usage, "timings": timings}
+                        self.wfile.write(("data: " + json.dumps(final) + "\n\n").encode("utf-8"))
+                    self.wfile.write(b"data: [DONE]\n\n")
+                except (BrokenPipeError, ConnectionResetError):
+                    cfg.count("cancelled")  # the client closed the stream: stop generating
+                    self.close_connection = True
+                return
+            cfg.count("completion_tokens", len(words))
+            if cfg.token_ms:
+                time.sleep(cfg.token_ms * len(words) / 1000.0)
+            self._json({"choices": [{"message": {"content": text}}], "usage": usage, "timings": timings})
+            return
+
+        self._json({"error": "not found"}, status=404)
+
+
+class _Server(ThreadingHTTPServer):
+    request_queue_size = 256  # listen() backlog; the default 5 drops bursts
+    daemon_threads = True
+
+
+def make_server(host: str = "127.0.0.1", port: int = 0, config: StubConfig | None = None) -> ThreadingHTTPServer:
+    handler = type("StubHandler", (_Handler,), {"config": config or StubConfig()})
+    return _Server((host, port), handler)
+
+
+def start_stub_server(port: int = 0, **config) -> tuple[ThreadingHTTPServer, str]:
+    """Run a stub in a background thread; returns (server, base_url ending in /v1)."""
+    server = make_server(port=port, config=StubConfig(**config))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    host, real_port = server.server_address[:2]
+    return server, f"http://{host}:{real_port}/v1"
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=18234)
+    ap.add_argument("--dim", type=int, default=64)
+    ap.add_argument("--latency-ms", type=float, default=0.0, help="added to every POST")
+    ap.add_argument("--embed-latency-ms", type=float, default=None, help="overrides --latency-ms for /embeddings")
+    ap.add_argument("--chat-latency-ms", type=float, default=None, help="overrides --latency-ms for /chat/completions")
+    ap.add_argument("--token-ms", type=float, default=0.0, help="per generated word")
+    ap.add_argument("--fail-rate", type=float, default=0.0, help="fraction of POSTs answered with 503")
+    ap.add_argument("--prefill-ms", type=float, default=0.0, help="per prompt token not in the prompt cache")
+    ap.add_argument("--prompt-cache", type=int, default=8, help="prompts kept in the prompt cache")
+    ap.add_argument("--answer-words", type=int, default=0, help="pad replies to this many words")
+    ap.add_argument("--nested", action="store_true", help="Matryoshka-like embeddings (truncatable)")
+    ap.add_argument("--fallback-rate", type=float, default=0.0, help='share of "reply exactly:" prompts answered with that line')
+    ap.add_argument("--chatter-words", type=int, default=0, help="words added after an intent label or that line")
+    args = ap.parse_args()
+
+    cfg = StubConfig(
+        dim=args.dim,
+        latency_ms=args.latency_ms,
+        token_ms=args.token_ms,
+        fail_rate=args.fail_rate,
+        embed_latency_ms=args.embed_latency_ms,
+        chat_latency_ms=args.chat_latency_ms,
+        prefill_ms=args.prefill_ms,
+        prompt_cache=args.prompt_cache,
+        answer_words=args.answer_words,
+        nested=args.nested,
+        fallback_rate=args.fallback_rate,
+        chatter_words=args.chatter_words,
+    )
+    server = make_server(args.host, args.port, cfg)
+    print(f"stub LM listening on http://{args.host}:{args.port}/v1")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,651 @@
+"""
+Offline RAG benchmark: indexing, retrieval and end-to-end /api/chat load
+against the stub LM server, on a synthetic corpus (see bench.corpus).
+
+    python -m bench.suite --chunks 10000 --backends chroma,numpy --json results.json
+    python -m bench.suite --chunks 10000,100000,300000 --backends numpy --skip-e2e
+    python -m bench.suite --chunk-sizes 600,900,1200 --modes dense,hybrid --skip-e2e
+    python -m bench.suite --backends numpy --first-stages 0,256,256:int8,128:binary:400
+    python -m bench.suite --compare baseline.json results.json
+
+Each configuration (corpus size x backend x chunk size x retrieval mode x
+first stage) runs in its own process with the settings passed as environment variables, on a fresh
+STORAGE_DIR, and reports:
+
+  index      cold build (chunks/s, embedding requests, peak memory) and warm start seconds
+  retrieval  per-question latency p50/p99 of the request path (embedding +
+             vector query + BM25 fusion) and of the vector store alone,
+             recall@k / MRR on the labelled questions, and for each
+             MIN_SIMILARITY candidate the share of answerable questions
+             that pass it and of unanswerable ones that wrongly do
+  e2e        /api/chat requests/s and latency p50/p99 per concurrency
+             level, against a uvicorn server started on the same index
+  sessions   multi-turn conversations on that server: LLM calls and prompt
+             tokens per turn, the share served from the stub's simulated
+             prefix cache and prefill milliseconds per turn with and without it,
+             completion tokens generated per turn and streams cancelled early
+             (with --fallback-rate / --chatter-words the stub keeps talking
+             after fallback lines and labels, as real models do)
+
+With several --chunks sizes a build scaling table (chunks/s, seconds and
+peak memory of the build per size and backend) closes the report.
+
+--first-stages compares two-stage (Matryoshka) vector search settings,
+DIM[:QUANTIZATION[:CANDIDATES]] each (0 = one stage); the stub then serves
+Matryoshka-like embeddings for every run, and a recall / latency / index
+size table closes the report.
+
+Results are written as JSON; --compare prints metric changes between two
+result files and exits with 1 if any got worse by more than --tolerance.
+Latencies depend on the --*-latency-ms given to the stub: compare runs
+made with the same stub settings.
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import itertools
+import json
+import math
+import os
+import platform
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence
+
+from bench.corpus import LabelledQuestion, load_questions, make_corpus
+from bench.stub_lm import start_stub_server
+
+RESULT_FORMAT = 1
+
+
+def percentiles(values: Sequence[float]) -> dict:
+    """p50/p90/p99/mean/max in milliseconds of a list of seconds (nearest rank)."""
+    if not values:
+        return {}
+    s = sorted(values)
+
+    def pct(p: float) -> float:
+        return round(1000 * s[min(len(s) - 1, max(0, math.ceil(p / 100 * len(s)) - 1))], 3)
+
+    return {
+        "p50_ms": pct(50),
+        "p90_ms": pct(90),
+        "p99_ms": pct(99),
+        "mean_ms": round(1000 * sum(s) / len(s), 3),
+        "max_ms": round(1000 * s[-1], 3),
+    }
+
+
+def _relevant(q: LabelledQuestion, chunk) -> bool:
+    return chunk.source == q.source and q.answer in chunk.text and q.course in chunk.text
+
+
+def _stub_calls(lm_url: str) -> Dict[str, int]:
+    with urllib.request.urlopen(lm_url + "/models", timeout=10) as r:
+        return dict(json.loads(r.read())["calls"])
+
+
+def _delta(before: Dict[str, int], after: Dict[str, int]) -> Dict[str, int]:
+    return {k: after[k] - before.get(k, 0) for k in after}
+
+
+def _dir_bytes(path: Path) -> int:
+    return sum(p.stat().st_size for p in path.rglob("*") if p.is_file())
+
+
+def _scanned_bytes(vdb) -> int:
+    """What every query reads: the numpy (first-stage) matrix, or Chroma's HNSW vectors and graph."""
+    coarse = getattr(vdb, "_coarse", None)
+    if coarse is not None:
+        scales = getattr(vdb, "_coarse_scales", None)
+        return int(coarse.nbytes + (scales.nbytes if scales is not None else 0))
+    vectors = getattr(vdb, "_vectors", None)
+    if vectors is not None:
+        scales = getattr(vdb, "_scales", None)
+        return int(vectors.nbytes + (scales.nbytes if scales is not None else 0))
+    return sum(p.stat().st_size for p in Path(vdb.persist_dir).glob("*/data_level0.bin"))
+
+
+def _peak_rss_mb() -> Optional[float]:
+    """Peak resident memory of this process so far (None where the platform does not report it)."""
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+# -----------------------------
+# Measurements (in the per-configuration process)
+# -----------------------------
+def measure_index(lm_url: str) -> dict:
+    from app.core.config import settings
+    from app.services.rag import RAGEngine
+
+    last = {}
+    before = _stub_calls(lm_url)
+    engine = RAGEngine()
+    t0 = time.perf_counter()
+    engine.initialize_db(progress=lambda s: last.update(stats=s))
+    seconds = time.perf_counter() - t0
+    peak_mb = _peak_rss_mb()
+    stats = last["stats"]
+    calls = _delta(before, _stub_calls(lm_url))
+
+    # second start on the same storage: the manifest says nothing changed
+    t0 = time.perf_counter()
+    RAGEngine().initialize_db()
+    warm = time.perf_counter() - t0
+
+    return {
+        "engine": engine,
+        "files": stats.files,
+        "chunks": stats.chunks,
+        "seconds": round(seconds, 3),
+        "chunks_per_s": round(stats.chunks / seconds, 1) if seconds else 0.0,
+        "embed_requests": calls.get("embeddings", 0),
+        "embedded_texts": calls.get("embedded_texts", 0),
+        "warm_start_seconds": round(warm, 3),
+        "peak_rss_mb": peak_mb,
+        "storage_bytes": _dir_bytes(settings.storage_dir_path),
+        "scanned_bytes": _scanned_bytes(engine.vdb),
+    }
+
+
+async def measure_retrieval(engine, questions: List[LabelledQuestion], ks: List[int], thresholds: List[float]) -> dict:
+    from app.services.embeddings import aembed_texts
+
+    top_k = max(ks)
+    request_path, store_only = [], []
+    ranks: List[Optional[int]] = []
+    best: List[tuple[bool, float]] = []
+    for q in questions:
+        t0 = time.perf_counter()
+        _, hits = await engine._retrieve(q.question)
+        request_path.append(time.perf_counter() - t0)
+        best.append((q.answerable, max((h.similarity for h in hits), default=0.0)))
+        if q.answerable:
+            ranks.append(next((i + 1 for i, h in enumerate(hits) if _relevant(q, h.chunk)), None))
+
+    embs = await aembed_texts([q.question for q in questions])
+    for e in embs:
+        t0 = time.perf_counter()
+        engine.vdb.query(e, top_k=top_k)
+        store_only.append(time.perf_counter() - t0)
+    t0 = time.perf_counter()
+    engine.vdb.query_many(embs, top_k=top_k)
+    batch = time.perf_counter() - t0
+
+    answerable = max(1, len(ranks))
+    unanswerable = max(1, sum(1 for a, _ in best if not a))
+    return {
+        "questions": len(questions),
+        "request_path": percentiles(request_path),
+        "vector_query": percentiles(store_only),
+        "vector_query_many_per_question_ms": round(1000 * batch / max(1, len(embs)), 3),
+        "recall": {f"@{k}": round(sum(1 for r in ranks if r is not None and r <= k) / answerable, 4) for k in ks},
+        "mrr": round(sum(1.0 / r for r in ranks if r is not None) / answerable, 4),
+        "min_similarity": {
+            str(t): {
+                "answered": round(sum(1 for a, s in best if a and s >= t) / answerable, 4),
+                "false_accept": round(sum(1 for a, s in best if not a and s >= t) / unanswerable, 4),
+            }
+            for t in thresholds
+        },
+    }
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _wait_ready(base: str, proc: subprocess.Popen, timeout: float) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"server exited with {proc.returncode}")
+        try:
+            with urllib.request.urlopen(base + "/ready", timeout=2) as r:
+                if r.status == 200:
+                    return
+        except OSError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError("server not ready in time")
+
+
+async def _load(base: str, questions: List[str], concurrency: int, requests: int) -> dict:
+    import httpx
+
+    latencies: List[float] = []
+    status: Dict[str, int] = {}
+    counter = itertools.count()
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(base_url=base, timeout=300.0, limits=limits) as client:
+        async def user() -> None:
+            while (i := next(counter)) < requests:
+                body = {"question": questions[i % len(questions)], "session_id": f"bench-{concurrency}-{i}"}
+                t0 = time.perf_counter()
+                try:
+                    r = await client.post("/api/chat", json=body)
+                    code = str(r.status_code)
+                except httpx.HTTPError as e:
+                    code = type(e).__name__
+                latencies.append(time.perf_counter() - t0)
+                status[code] = status.get(code, 0) + 1
+
+        t0 = time.perf_counter()
+        await asyncio.gather(*(user() for _ in range(concurrency)))
+        seconds = time.perf_counter() - t0
+
+    ok = status.get("200", 0)
+    return {
+        "concurrency": concurrency,
+        "requests": requests,
+        "seconds": round(seconds, 3),
+        "rps": round(ok / seconds, 2) if seconds else 0.0,
+        "errors": requests - ok,
+        "status": status,
+        **percentiles(latencies),
+    }
+
+
+async def _sessions(base: str, lm_url: str, texts: List[str], sessions: int, turns: int, prefill_ms: float) -> dict:
+    import httpx
+
+    latencies: List[float] = []
+    before = _stub_calls(lm_url)
+    async with httpx.AsyncClient(base_url=base, timeout=300.0) as client:
+        async def conversation(s: int) -> None:
+            for t in range(turns):
+                body = {"question": texts[(s * turns + t) % len(texts)], "session_id": f"bench-session-{s}"}
+                t0 = time.perf_counter()
+                r = await client.post("/api/chat", json=body)
+                r.raise_for_status()
+                latencies.append(time.perf_counter() - t0)
+
+        await asyncio.gather(*(conversation(s) for s in range(sessions)))
+    await asyncio.sleep(1.0)  # history summaries run after the responses
+    calls = _delta(before, _stub_calls(lm_url))
+
+    # per turn, not per LLM call: a layout that saves calls (e.g. fewer summary updates) counts too
+    n = max(1, sessions * turns)
+    prompt = calls.get("prompt_tokens", 0)
+    cached = calls.get("cached_tokens", 0)
+    return {
+        "sessions": sessions,
+        "turns": turns,
+        "chat_calls_per_turn": round(calls.get("chat", 0) / n, 3),
+        "prompt_tokens_per_turn": round(prompt / n, 1),
+        "cached_tokens_per_turn": round(cached / n, 1),
+        "cached_share": round(cached / prompt, 4) if prompt else 0.0,
+        "prefill_per_turn_ms": round(calls.get("prefill_us", 0) / 1000 / n, 3),
+        "completion_tokens_per_turn": round(calls.get("completion_tokens", 0) / n, 1),
+        "cancelled_per_turn": round(calls.get("cancelled", 0) / n, 3),
+        # what the same prompts would cost with no prefix reuse at all
+        "uncached_prefill_per_turn_ms": round(prompt * prefill_ms / n, 3),
+        **percentiles(latencies),
+    }
+
+
+def measure_e2e(
+    questions: List[LabelledQuestion], levels: List[int], requests: int, ready_timeout: float,
+    sessions: Optional[dict] = None,
+) -> dict:
+    """{"e2e": one load result per concurrency level, "sessions": multi-turn prefix reuse (if asked)}"""
+    port = _free_port()
+    base = f"http://127.0.0.1:{port}"
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(port), "--log-level", "warning"],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        _wait_ready(base, proc, ready_timeout)
+        texts = [q.question for q in questions if q.answerable] or [q.question for q in questions]
+        asyncio.run(_load(base, texts, 1, 1))  # first request after startup
+        out = {"e2e": [asyncio.run(_load(base, texts, c, requests)) for c in levels]}
+        if sessions:
+            out["sessions"] = asyncio.run(_sessions(base, texts=texts, **sessions))
+        return out
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+
+
+def run_configuration(spec: dict) -> dict:
+    """One configuration; the settings come from the environment of this process."""
+    questions = load_questions(Path(spec["corpus"])) or []
+    index = measure_index(spec["lm_url"])
+    engine = index.pop("engine")
+    result = {"index": index}
+    result["retrieval"] = asyncio.run(measure_retrieval(engine, questions, spec["ks"], spec["thresholds"]))
+    if spec["concurrency"]:
+        sessions = None
+        if spec["sessions"] and spec["turns"]:
+            sessions = {
+                "lm_url": spec["lm_url"], "sessions": spec["sessions"], "turns": spec["turns"], "prefill_ms": spec["prefill_ms"],
+            }
+        result.update(measure_e2e(questions, spec["concurrency"], spec["requests"], spec["ready_timeout"], sessions))
+    return result
+
+
+# -----------------------------
+# Driver
+# -----------------------------
+def _csv(value: str, cast=str) -> list:
+    return [cast(x.strip()) for x in value.split(",") if x.strip()]
+
+
+def _first_stage(value: str) -> Dict[str, str]:
+    """"DIM[:QUANTIZATION[:CANDIDATES]]" as settings ({} for one-stage search)."""
+    dim, _, rest = value.partition(":")
+    if int(dim) <= 0:
+        return {}
+    quantization, _, candidates = rest.partition(":")
+    config = {"VECTOR_FIRST_STAGE_DIM": str(int(dim))}
+    if quantization:
+        config["VECTOR_FIRST_STAGE_QUANTIZATION"] = quantization
+    if candidates:
+        config["VECTOR_FIRST_STAGE_CANDIDATES"] = str(int(candidates))
+    return config
+
+
+def _git_commit() -> str:
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, timeout=10)
+        return out.stdout.strip()
+    except OSError:
+        return ""
+
+
+def run(args) -> dict:
+    data_dir = Path(args.data_dir)
+    server, lm_url = start_stub_server(
+        dim=args.dim,
+        embed_latency_ms=args.embed_latency_ms,
+        chat_latency_ms=args.chat_latency_ms,
+        token_ms=args.token_ms,
+        prefill_ms=args.prefill_ms,
+        prompt_cache=args.prompt_cache,
+        answer_words=args.answer_words,
+        nested=_nested(args),
+        fallback_rate=args.fallback_rate,
+        chatter_words=args.chatter_words,
+    )
+    extra = dict(kv.split("=", 1) for kv in args.set)
+    runs = []
+    try:
+        for chunks, chunk_size, backend, mode, first_stage in itertools.product(
+            args.chunks, args.chunk_sizes, args.backends, args.modes, args.first_stages,
+        ):
+            corpus = data_dir / f"corpus_{chunks}_{chunk_size}_{args.overlap}"
+            make_corpus(corpus, chunks, chunk_size, args.overlap, questions=args.questions, seed=args.seed)
+            config = {
+                "VECTOR_BACKEND": backend,
+                "CHUNK_SIZE": str(chunk_size),
+                "CHUNK_OVERLAP": str(args.overlap),
+                "RETRIEVAL_MODE": mode,
+                "TOP_K": str(max(args.ks)),
+                **first_stage,
+                **extra,
+            }
+            print(f"== {config}", flush=True)
+            storage = Path(tempfile.mkdtemp(prefix="storage_", dir=data_dir))
+            env = {
+                **os.environ,
+                **config,
+                "LM_URL": lm_url,
+                "LM_CHAT_URLS": "",
+                "LM_EMBED_URLS": "",
+                "KNOWLEDGE_DIR": str(corpus),
+                "KNOWLEDGE_GLOB": "doc_*.txt",
+                "STORAGE_DIR": str(storage),
+                "PYTHONPATH": os.pathsep.join(filter(None, [os.getcwd(), os.environ.get("PYTHONPATH")])),
+            }
+            spec = {
+                "corpus": str(corpus),
+                "lm_url": lm_url,
+                "ks": args.ks,
+                "thresholds": args.thresholds,
+                "concurrency": [] if args.skip_e2e else args.concurrency,
+                "requests": args.requests,
+                "sessions": args.sessions,
+                "turns": args.turns,
+                "prefill_ms": args.prefill_ms,
+                "ready_timeout": args.ready_timeout,
+            }
+            out = storage / "result.json"
+            try:
+                proc = subprocess.run(
+                    [sys.executable, "-m", "bench.suite", "--run-configuration", json.dumps(spec), "--json", str(out)],
+                    env=env,
+                )
+                if proc.returncode != 0:
+                    runs.append({"config": config, "chunks": chunks, "error": f"exit code {proc.returncode}"})
+                else:
+                    runs.append({"config": config, "chunks": chunks, **json.loads(out.read_text(encoding="utf-8"))})
+            finally:
+                shutil.rmtree(storage, ignore_errors=True)
+            _print_run(runs[-1])
+    finally:
+        server.shutdown()
+
+    return {
+        "format": RESULT_FORMAT,
+        "meta": {
+            "started": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "commit": _git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "corpus": {"chunks": args.chunks, "overlap": args.overlap, "questions": args.questions, "seed": args.seed},
+            "stub": {
+                "dim": args.dim,
+                "embed_latency_ms": args.embed_latency_ms,
+                "chat_latency_ms": args.chat_latency_ms,
+                "token_ms": args.token_ms,
+                "prefill_ms": args.prefill_ms,
+                "prompt_cache": args.prompt_cache,
+                "answer_words": args.answer_words,
+                "nested": _nested(args),
+                "fallback_rate": args.fallback_rate,
+                "chatter_words": args.chatter_words,
+            },
+        },
+        "runs": runs,
+    }
+
+
+def print_scaling(runs: List[dict]) -> None:
+    """Index build time and throughput per corpus size, grouped by configuration."""
+    print(f"{'chunks':>9} {'build s':>9} {'chunks/s':>9} {'peak MB':>8}  config")
+    for r in sorted(runs, key=lambda r: (json.dumps(r["config"], sort_keys=True), r["chunks"])):
+        if "error" in r:
+            print(f"{r['chunks']:>9} {'failed: ' + r['error']:>28}  {r['config']}")
+            continue
+        ix = r["index"]
+        print(f"{r['chunks']:>9} {ix['seconds']:>9} {ix['chunks_per_s']:>9} {ix['peak_rss_mb'] or '-':>8}  {r['config']}")
+
+
+def _nested(args) -> bool:
+    # one-stage runs of a first-stage sweep use the same embeddings as the others
+    return args.nested_embeddings or any(args.first_stages)
+
+
+def print_tradeoff(runs: List[dict]) -> None:
+    """Recall against vector query latency and the bytes each query scans, one line per run."""
+    print(f"{'first stage':<22} {'recall@1':>8} {'recall@max':>10} {'mrr':>6} {'p50 ms':>8} {'p99 ms':>8} {'scanned MB':>10}  config")
+    for r in runs:
+        if "error" in r:
+            continue
+        c, rt = r["config"], r["retrieval"]
+        dim = c.get("VECTOR_FIRST_STAGE_DIM")
+        stage = "full" if not dim else ":".join(filter(None, (
+            dim, c.get("VECTOR_FIRST_STAGE_QUANTIZATION", "float32"), c.get("VECTOR_FIRST_STAGE_CANDIDATES"),
+        )))
+        recall = list(rt["recall"].values())
+        rest = {k: v for k, v in c.items() if not k.startswith("VECTOR_FIRST_STAGE_")}
+        print(
+            f"{stage:<22} {recall[0]:>8} {recall[-1]:>10} {rt['mrr']:>6} {rt['vector_query'].get('p50_ms'):>8} "
+            f"{rt['vector_query'].get('p99_ms'):>8} {r['index']['scanned_bytes'] / 1e6:>10.2f}  {rest}"
+        )
+
+
+def _print_run(r: dict) -> None:
+    if "error" in r:
+        print("  FAILED:", r["error"])
+        return
+    ix, rt = r["index"], r["retrieval"]
+    print(
+        f"  index  {ix['chunks']} chunks in {ix['seconds']}s ({ix['chunks_per_s']}/s, "
+        f"{ix['embed_requests']} embedding requests), warm start {ix['warm_start_seconds']}s"
+    )
+    print(
+        f"  retrieval p50 {rt['request_path'].get('p50_ms')} ms  p99 {rt['request_path'].get('p99_ms')} ms  "
+        f"(vector store p50 {rt['vector_query'].get('p50_ms')} ms  p99 {rt['vector_query'].get('p99_ms')} ms)"
+    )
+    print("  recall", rt["recall"], " mrr", rt["mrr"])
+    for t, v in rt["min_similarity"].items():
+        print(f"  MIN_SIMILARITY={t}: answered {v['answered']}  false accept {v['false_accept']}")
+    for e in r.get("e2e", []):
+        print(
+            f"  e2e c={e['concurrency']:<3} {e['rps']} req/s  p50 {e.get('p50_ms')} ms  "
+            f"p99 {e.get('p99_ms')} ms  errors {e['errors']}"
+        )
+    ss = r.get("sessions")
+    if ss:
+        print(
+            f"  sessions {ss['sessions']}x{ss['turns']} turns: {ss['chat_calls_per_turn']} LLM calls and "
+            f"{ss['prompt_tokens_per_turn']} prompt tokens per turn, {ss['cached_share']:.0%} cached; prefill "
+            f"{ss['prefill_per_turn_ms']} ms/turn (without prefix cache {ss['uncached_prefill_per_turn_ms']} ms/turn); "
+            f"{ss['completion_tokens_per_turn']} completion tokens and {ss['cancelled_per_turn']} cancelled streams per turn"
+        )
+
+
+# -----------------------------
+# Comparing result files
+# -----------------------------
+def _flatten(obj, prefix: str = "") -> Dict[str, float]:
+    out: Dict[str, float] = {}
+    if isinstance(obj, dict):
+        for k, v in obj.items():
+            out.update(_flatten(v, f"{prefix}.{k}" if prefix else str(k)))
+    elif isinstance(obj, list):
+        for v in obj:
+            # e2e levels are keyed by their concurrency
+            key = f"c{v.get('concurrency')}" if isinstance(v, dict) and "concurrency" in v else str(len(out))
+            out.update(_flatten(v, f"{prefix}.{key}"))
+    elif isinstance(obj, (int, float)) and not isinstance(obj, bool):
+        out[prefix] = float(obj)
+    return out
+
+
+def _direction(metric: str) -> int:
+    """+1 higher is better, -1 lower is better, 0 not a quality metric."""
+    leaf = metric.rsplit(".", 1)[-1]
+    if leaf.endswith("_ms") or leaf in ("seconds", "warm_start_seconds", "peak_rss_mb", "false_accept", "errors", "chat_calls_per_turn", "completion_tokens_per_turn"):
+        return -1
+    if leaf in ("chunks_per_s", "rps", "mrr", "answered", "cached_share") or metric.split(".")[-2:-1] == ["recall"]:
+        return 1
+    return 0
+
+
+def compare(old: dict, new: dict, tolerance: float) -> int:
+    def key(run: dict, result: dict) -> str:
+        # results from before --chunks took a list have one corpus size in meta
+        chunks = run.get("chunks", result.get("meta", {}).get("corpus", {}).get("chunks"))
+        return json.dumps([run["config"], chunks], sort_keys=True)
+
+    old_runs = {key(r, old): r for r in old.get("runs", [])}
+    worse = 0
+    for r in new.get("runs", []):
+        base = old_runs.get(key(r, new))
+        print(f"== {r.get('chunks', '')} {r['config']}")
+        if base is None or "error" in base or "error" in r:
+            print("  (no comparable baseline)")
+            continue
+        a, b = _flatten(base), _flatten(r)
+        for metric in sorted(set(a) & set(b)):
+            d = _direction(metric)
+            if d == 0 or a[metric] == b[metric]:
+                continue
+            change = (b[metric] - a[metric]) / abs(a[metric]) if a[metric] else float("inf")
+            regressed = d * change < -tolerance
+            worse += regressed
+            print(f"  {'WORSE' if regressed else '     '} {metric:<55} {a[metric]:>12g} -> {b[metric]:<12g} ({change:+.1%})")
+    return 1 if worse else 0
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--data-dir", default="bench_data", help="corpora and temporary index directories")
+    ap.add_argument("--chunks", type=lambda v: _csv(v, int), default=[10000], help="corpus sizes in chunks (10k .. 1M)")
+    ap.add_argument("--questions", type=int, default=200)
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--chunk-sizes", type=lambda v: _csv(v, int), default=[900])
+    ap.add_argument("--overlap", type=int, default=140)
+    ap.add_argument("--backends", type=_csv, default=["chroma"])
+    ap.add_argument("--modes", type=_csv, default=["dense"], help="RETRIEVAL_MODE values")
+    ap.add_argument(
+        "--first-stages", type=lambda v: _csv(v, _first_stage), default=[{}],
+        help="two-stage vector search settings, DIM[:QUANTIZATION[:CANDIDATES]] (0 = one stage)",
+    )
+    ap.add_argument("--ks", type=lambda v: _csv(v, int), default=[1, 3, 5, 8], help="recall@k cut-offs")
+    ap.add_argument("--thresholds", type=lambda v: _csv(v, float), default=[0.0, 0.2, 0.35, 0.5], help="MIN_SIMILARITY candidates")
+    ap.add_argument("--concurrency", type=lambda v: _csv(v, int), default=[1, 8, 32], help="e2e load levels")
+    ap.add_argument("--requests", type=int, default=200, help="e2e requests per level")
+    ap.add_argument("--skip-e2e", action="store_true")
+    ap.add_argument("--ready-timeout", type=float, default=600.0)
+    ap.add_argument("--dim", type=int, default=1024, help="stub embedding size")
+    ap.add_argument("--embed-latency-ms", type=float, default=2.0)
+    ap.add_argument("--chat-latency-ms", type=float, default=50.0)
+    ap.add_argument("--token-ms", type=float, default=0.0)
+    ap.add_argument("--prefill-ms", type=float, default=0.2, help="stub prefill time per uncached prompt token")
+    ap.add_argument("--prompt-cache", type=int, default=8, help="prompts the stub keeps in its prompt cache")
+    ap.add_argument("--answer-words", type=int, default=60, help="stub reply length (replies end up in the history)")
+    ap.add_argument("--fallback-rate", type=float, default=0.0, help='stub: share of "reply exactly:" prompts answered with that line')
+    ap.add_argument("--chatter-words", type=int, default=0, help="stub: words it adds after fallback lines and intent labels")
+    ap.add_argument("--sessions", type=int, default=4, help="concurrent multi-turn conversations (0 = skip)")
+    ap.add_argument("--turns", type=int, default=8, help="turns per conversation")
+    ap.add_argument("--nested-embeddings", action="store_true", help="Matryoshka-like stub embeddings (on with --first-stages)")
+    ap.add_argument("--set", action="append", default=[], metavar="KEY=VALUE", help="extra setting for every run")
+    ap.add_argument("--json", help="write the results to this file")
+    ap.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="compare two result files")
+    ap.add_argument("--tolerance", type=float, default=0.1, help="relative change counted as a regression")
+    ap.add_argument("--run-configuration", help=argparse.SUPPRESS)
+    args = ap.parse_args()
+
+    if args.compare:
+        old, new = (json.loads(Path(p).read_text(encoding="utf-8")) for p in args.compare)
+        sys.exit(compare(old, new, args.tolerance))
+
+    if args.run_configuration:
+        result = run_configuration(json.loads(args.run_configuration))
+    else:
+        Path(args.data_dir).mkdir(parents=True, exist_ok=True)
+        result = run(args)
+        if len(args.first_stages) > 1:
+            print_tradeoff(result["runs"])
+        if len(args.chunks) > 1:
+            print_scaling(result["runs"])
+    if args.json:
+        Path(args.json).write_text(json.dumps(result, indent=1), encoding="utf-8")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+import asyncio
+
+import numpy as np
+import pytest
+
+from app.core.config import settings
+from app.services import rag
+from app.services.chunking import Chunk
+from app.services.numpy_store import NumpyVectorDB
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+class FakeLM:
+    """Stands in for achat_complete: records every call, replies with reply(call)."""
+    def __init__(self, reply):
+        self.reply = reply
+        self.calls: list[dict] = []
+
+    async def __call__(self, system_text, user_text, history_messages=None, **kw):
+        call = {"system_text": system_text, "user_text": user_text, "history_messages": history_messages or [], **kw}
+        self.calls.append(call)
+        return self.reply(call)
+
+
+def unit(*values: float) -> list[float]:
+    v = np.asarray(values, dtype=np.float32)
+    return (v / np.linalg.norm(v)).tolist()
+
+
+@pytest.fixture
+def make_engine(tmp_path, monkeypatch):
+    """
+    A RAGEngine over a NumPy index of `chunks` (text -> embedding), with the
+    question embedding from `embed` and the LLM replaced by `lm`.
+    Intent classification always says "uniq_question".
+    """
+    monkeypatch.setattr(settings, "STORAGE_DIR", str(tmp_path / "storage"))
+    monkeypatch.setattr(settings, "HISTORY_MODE_ANSWERER", "recent")
+
+    def make(chunks: dict, embed, lm: FakeLM, **overrides):
+        for k, v in overrides.items():
+            monkeypatch.setattr(settings, k, v)
+        vdb = NumpyVectorDB(str(tmp_path / "index"))
+        vdb.upsert(
+            [Chunk(source="kb.txt", chunk_id=i, text=t, start=0, end=len(t)) for i, t in enumerate(chunks)],
+            list(chunks.values()),
+        )
+
+        async def aembed_texts(texts):
+            return [embed(t) for t in texts]
+
+        async def classify(user_msg, history):
+            return "uniq_question"
+
+        monkeypatch.setattr(rag, "aembed_texts", aembed_texts)
+        monkeypatch.setattr(rag, "achat_complete", lm)
+        engine = rag.RAGEngine(speculative_retrieval=False)
+        engine._index = rag.IndexHandle("v1", vdb, None, "v1")
+        engine._db_ready = True
+        monkeypatch.setattr(engine, "_classify_intent", classify)
+        return engine
+
+    return make
@@ -0,0 +1,70 @@
+from app.services.answer_cache import SemanticAnswerCache
+
+from tests.conftest import FakeLM, run, unit
+
+
+def _cache() -> SemanticAnswerCache:
+    return SemanticAnswerCache(max_items=10, ttl_seconds=60.0, similarity_threshold=0.95)
+
+
+def test_hit_needs_same_chunks_version_and_history():
+    cache = _cache()
+    cache.store(unit(1, 0), "A", frozenset({"a"}), "v1", "h1")
+
+    assert cache.lookup(unit(1, 0.01), frozenset({"a"}), "v1", "h1") == "A"
+    assert cache.lookup(unit(1, 0), frozenset({"a", "b"}), "v1", "h1") is None
+    assert cache.lookup(unit(1, 0), frozenset({"a"}), "v1", "h2") is None
+    assert cache.lookup(unit(1, 0), frozenset({"a"}), "v1") is None
+    assert cache.lookup(unit(0, 1), frozenset({"a"}), "v1", "h1") is None
+
+
+def test_entries_of_another_index_version_are_dropped():
+    cache = _cache()
+    cache.store(unit(1, 0), "A", frozenset({"a"}), "v1")
+
+    assert cache.lookup(unit(1, 0), frozenset({"a"}), "v2") is None
+    assert cache.stats()["items"] == 0
+
+
+def _course_answer(call) -> str:
+    seen = " ".join(m["content"] for m in call["history_messages"])
+    return "The Python course lasts 3 months." if "Python" in seen else "The Java course lasts 6 months."
+
+
+def test_follow_up_is_not_served_from_another_conversation(make_engine):
+    lm = FakeLM(_course_answer)
+    engine = make_engine(
+        {"Python course: 3 months.": unit(1, 0.1), "Java course: 6 months.": unit(1, -0.1)},
+        embed=lambda text: unit(1, 0),
+        lm=lm,
+    )
+    session_a = [
+        {"role": "user", "content": "Tell me about the Python course"},
+        {"role": "assistant", "content": "The Python course covers the basics."},
+    ]
+    session_b = [
+        {"role": "user", "content": "Tell me about the Java course"},
+        {"role": "assistant", "content": "The Java course covers the basics."},
+    ]
+
+    a = run(engine.answer("how long is it?", session_a, session_id="a"))
+    b = run(engine.answer("how long is it?", session_b, session_id="b"))
+
+    assert a == "The Python course lasts 3 months."
+    assert b == "The Java course lasts 6 months."
+    assert len(lm.calls) == 2
+
+
+def test_same_conversation_is_served_from_cache(make_engine):
+    lm = FakeLM(_course_answer)
+    engine = make_engine({"Python course: 3 months.": unit(1, 0.1)}, embed=lambda text: unit(1, 0), lm=lm)
+    history = [
+        {"role": "user", "content": "Tell me about the Python course"},
+        {"role": "assistant", "content": "The Python course covers the basics."},
+    ]
+
+    first = run(engine.answer("how long is it?", history, session_id="a"))
+    again = run(engine.answer("how long is it?", history, session_id="b"))
+
+    assert first == again == "The Python course lasts 3 months."
+    assert len(lm.calls) == 1
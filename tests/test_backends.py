@@ -0,0 +1,136 @@
+import asyncio
+import threading
+import time
+
+import httpx
+import pytest
+
+from app.services.backends import BackendPool, PoolSaturated
+
+from tests.conftest import run
+
+
+def _pool(urls=("http://a", "http://b"), max_concurrency=1, max_queue=8, queue_timeout=2.0, **kw) -> BackendPool:
+    return BackendPool("test", list(urls), max_concurrency, max_queue, queue_timeout, **kw)
+
+
+def test_blocking_acquire_respects_max_concurrency():
+    pool = _pool(max_concurrency=2)
+    peak, active, lock = [0], [0], threading.Lock()
+
+    def worker():
+        with pool.acquire_blocking():
+            with lock:
+                active[0] += 1
+                peak[0] = max(peak[0], active[0])
+            time.sleep(0.02)
+            with lock:
+                active[0] -= 1
+
+    threads = [threading.Thread(target=worker) for _ in range(12)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert peak[0] == 4  # 2 backends x 2 slots
+    assert all(b.outstanding == 0 for b in pool.backends)
+    assert pool._waiting == 0
+
+
+def test_blocking_acquire_balances_least_outstanding():
+    pool = _pool()
+    with pool.acquire_blocking() as first, pool.acquire_blocking() as second:
+        assert {first.url, second.url} == {"http://a", "http://b"}
+
+
+def test_blocking_acquire_times_out_when_full():
+    pool = _pool(urls=("http://a",), queue_timeout=0.05)
+    with pool.acquire_blocking():
+        with pytest.raises(PoolSaturated, match="queue timeout"):
+            with pool.acquire_blocking():
+                pass
+    assert pool._waiting == 0
+
+
+def test_blocking_acquire_fails_fast_when_queue_full():
+    pool = _pool(urls=("http://a",), max_queue=0)
+    with pool.acquire_blocking():
+        with pytest.raises(PoolSaturated, match="queue full"):
+            with pool.acquire_blocking():
+                pass
+
+
+def test_blocking_and_async_share_slots():
+    pool = _pool(urls=("http://a",))
+
+    async def main():
+        release = threading.Event()
+        held = threading.Event()
+
+        def hold():
+            with pool.acquire_blocking():
+                held.set()
+                release.wait()
+
+        thread = threading.Thread(target=hold)
+        thread.start()
+        held.wait()
+
+        waiter = asyncio.create_task(_acquire_once(pool))
+        await asyncio.sleep(0.05)
+        assert not waiter.done()  # the thread holds the only slot
+
+        release.set()  # the thread's release wakes the waiting coroutine
+        await asyncio.wait_for(waiter, timeout=1.0)
+        thread.join()
+
+    run(main())
+    assert pool.backends[0].outstanding == 0
+
+
+async def _acquire_once(pool: BackendPool) -> None:
+    async with pool.acquire():
+        pass
+
+
+def test_failures_eject_backend_for_blocking_callers():
+    pool = _pool(fail_threshold=2, eject_seconds=60.0)
+    bad = pool.backends[0]
+    pool.report(bad, ok=False)
+    assert bad.available(time.monotonic())
+    pool.report(bad, ok=False)
+    assert not bad.available(time.monotonic())
+
+    for _ in range(3):
+        with pool.acquire_blocking() as backend:
+            assert backend is pool.backends[1]
+
+    pool.report(pool.backends[1], ok=False)
+    pool.report(pool.backends[1], ok=False)
+    with pytest.raises(PoolSaturated, match="no healthy"):
+        with pool.acquire_blocking():
+            pass
+
+
+def test_active_check_updates_health_under_the_lock(monkeypatch):
+    pool = _pool(eject_seconds=60.0)
+    down, back = pool.backends
+    back.ejected_until = time.monotonic() + 60.0
+    held = []
+    eject = pool._eject
+
+    def recording_eject(backend, reason):
+        held.append(pool._lock.locked())
+        eject(backend, reason)
+
+    monkeypatch.setattr(pool, "_eject", recording_eject)
+    client = httpx.AsyncClient(transport=httpx.MockTransport(
+        lambda req: httpx.Response(503 if req.url.host == "a" else 200)
+    ))
+
+    run(pool.check(client))
+
+    assert held == [True]
+    assert not down.available(time.monotonic())
+    assert back.available(time.monotonic())  # healthy again: back early
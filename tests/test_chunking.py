@@ -0,0 +1,46 @@
+import random
+
+import pytest
+
+from app.services.chunking import chunk_text, normalize_text
+from app.services.tokens import count_tokens
+from bench.chunking import make_text
+
+
+def _texts():
+    yield "Short text."
+    yield make_text(20000, 120, seed=1)          # paragraphs of sentences
+    yield make_text(20000, 0, seed=2)            # one huge paragraph
+    yield make_text(20000, 0, seed=3, punctuation=False)  # no sentence breaks at all
+    rnd = random.Random(4)
+    yield "\r\n\r\n\r\n".join(" ".join("x" * rnd.randint(1, 40) for _ in range(rnd.randint(1, 80))) for _ in range(30))
+
+
+@pytest.mark.parametrize("unit", ["chars", "tokens"])
+@pytest.mark.parametrize("text", list(_texts()))
+def test_offsets_sizes_and_overlap(text, unit):
+    size, overlap = (300, 50) if unit == "chars" else (80, 12)
+    chunks = chunk_text("doc.txt", text, size, overlap, unit=unit)
+    norm = normalize_text(text)
+
+    def measure(a: int, b: int) -> int:
+        return count_tokens(norm, a, b) if unit == "tokens" else b - a
+
+    assert [c.chunk_id for c in chunks] == list(range(len(chunks)))
+    assert chunks[0].start == 0 and chunks[-1].end == len(norm)
+    for prev, c in zip([None] + chunks, chunks):
+        assert c.text == norm[c.start:c.end]
+        # words longer than a chunk are cut, everything else fits
+        assert measure(c.start, c.end) <= size or " " not in c.text
+        if prev is not None:
+            assert prev.start < c.start <= prev.end or not norm[prev.end:c.start].strip()
+            if c.start < prev.end:
+                assert measure(c.start, prev.end) <= overlap
+
+
+def test_token_sizes_do_not_depend_on_earlier_cuts():
+    # the running token count must match counting each chunk from scratch
+    text = make_text(50000, 0, seed=5, punctuation=False)
+    for c in chunk_text("doc.txt", text, 100, 20, unit="tokens"):
+        assert count_tokens(c.text) <= 100
+    assert len(chunk_text("doc.txt", text, 100, 0, unit="tokens")) == pytest.approx(count_tokens(text) / 100, rel=0.1)
@@ -0,0 +1,98 @@
+import json
+
+import httpx
+import pytest
+
+from app.services import lm_client
+from app.services.backends import BackendPool
+from app.services.lm_client import CompletionBudget
+
+from tests.conftest import run
+
+
+def _budget(**kw) -> CompletionBudget:
+    return CompletionBudget(**{"window": 100, "quantile": 0.9, "headroom": 1.5, "floor": 16, "min_samples": 10, **kw})
+
+
+def test_limit_used_until_min_samples():
+    budget = _budget()
+    for _ in range(9):
+        budget.observe("answer", 20)
+    assert budget.max_tokens("answer", 400) == 400
+    budget.observe("answer", 20)
+    assert budget.max_tokens("answer", 400) == 30
+    assert budget.max_tokens("intent", 400) == 400  # per call site
+
+
+def test_cap_is_quantile_times_headroom_within_floor_and_limit():
+    budget = _budget()
+    for n in range(1, 101):  # 1 .. 100 tokens
+        budget.observe("answer", n)
+    assert budget.max_tokens("answer", 400) == 137  # q0.9 = 91, x 1.5
+    assert budget.max_tokens("answer", 100) == 100
+
+    small = _budget()
+    for _ in range(10):
+        small.observe("intent", 2)
+    assert small.max_tokens("intent", 400) == 16
+
+
+def test_window_forgets_old_lengths():
+    budget = _budget(window=10)
+    for _ in range(10):
+        budget.observe("answer", 200)
+    for _ in range(10):
+        budget.observe("answer", 20)
+    assert budget.max_tokens("answer", 400) == 30
+
+
+def _sse(deltas, usage=None) -> bytes:
+    lines = [f"data: {json.dumps({'choices': [{'delta': {'content': d}}]})}\n\n" for d in deltas]
+    if usage:
+        lines.append(f"data: {json.dumps({'choices': [], 'usage': usage})}\n\n")
+    lines.append("data: [DONE]\n\n")
+    return "".join(lines).encode()
+
+
+@pytest.fixture
+def stream_server(monkeypatch):
+    """Serves `body` for /chat/completions through a fresh budget; returns (set_body, budget)."""
+    budget = _budget(min_samples=1)
+    served = {}
+    monkeypatch.setattr(lm_client, "completion_budget", budget)
+    monkeypatch.setattr(lm_client, "_chat_pool", BackendPool("chat", ["http://lm/v1"], 4, 8, 1.0))
+    monkeypatch.setattr(
+        lm_client, "_async_client",
+        httpx.AsyncClient(transport=httpx.MockTransport(lambda req: httpx.Response(200, content=served["body"]))),
+    )
+    return lambda body: served.update(body=body), budget
+
+
+def _stream(stop=None) -> str:
+    async def main():
+        parts = []
+        async for d in lm_client.astream_chat("s", "u", max_tokens=400, call_site="answer", stop=stop):
+            parts.append(d)
+        return "".join(parts)
+    return run(main())
+
+
+def test_early_stopped_stream_is_not_observed(stream_server):
+    set_body, budget = stream_server
+    set_body(_sse(["Information ", "not available. ", "Because " * 50]))
+
+    text = _stream(stop=lambda t: "fallback" if t.startswith("Information not available") else None)
+
+    assert text == "Information not available. "
+    assert budget.max_tokens("answer", 400) == 400  # nothing learned from the cut stream
+
+
+def test_finished_stream_is_observed(stream_server):
+    set_body, budget = stream_server
+    set_body(_sse(["a short ", "answer"], usage={"prompt_tokens": 50, "completion_tokens": 40}))
+    assert _stream() == "a short answer"
+    assert budget.max_tokens("answer", 400) == 60
+
+    set_body(_sse(["word " * 40]))  # no usage: estimated from the text
+    text = _stream()
+    assert list(budget._seen["answer"]) == [40, lm_client.estimate_tokens(text)]
@@ -0,0 +1,51 @@
+import asyncio
+import threading
+
+from app.core.config import settings
+from app.services import embeddings
+from app.services.embed_cache import EmbeddingCache
+
+from tests.conftest import run
+
+
+class _ThreadRecordingCache(EmbeddingCache):
+    def __init__(self, *a, **kw):
+        super().__init__(*a, **kw)
+        self.threads: list[tuple[str, int]] = []
+
+    def get_many(self, model, texts):
+        self.threads.append(("get", threading.get_ident()))
+        return super().get_many(model, texts)
+
+    def put_many(self, model, texts, vectors):
+        self.threads.append(("put", threading.get_ident()))
+        super().put_many(model, texts, vectors)
+
+
+def test_cache_io_runs_off_the_event_loop(tmp_path, monkeypatch):
+    cache = _ThreadRecordingCache(tmp_path / "embed_cache.sqlite3")
+    sent: list[list[str]] = []
+
+    async def fake_request(texts):
+        sent.append(list(texts))
+        return [[float(len(t)), 1.0] for t in texts]
+
+    monkeypatch.setattr(embeddings, "get_embedding_cache", lambda: cache)
+    monkeypatch.setattr(embeddings, "_arequest_embeddings", fake_request)
+    monkeypatch.setattr(settings, "EMBED_BATCH_WINDOW_MS", 0)
+
+    async def main():
+        loop_thread = threading.get_ident()
+        first = await embeddings.aembed_texts(["a", "bb"])
+        await asyncio.gather(*embeddings._writes)
+        second = await embeddings.aembed_texts(["bb", "a"])
+        return loop_thread, first, second
+
+    loop_thread, first, second = run(main())
+
+    assert first == [[1.0, 1.0], [2.0, 1.0]]
+    assert second == [[2.0, 1.0], [1.0, 1.0]]
+    assert sent == [["a", "bb"]]  # the second call is served by the cache
+    assert [op for op, _ in cache.threads] == ["get", "put", "get"]
+    assert all(t != loop_thread for _, t in cache.threads)
+    assert not embeddings._writes
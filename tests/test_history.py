@@ -0,0 +1,39 @@
+import time
+
+from app.services.history import HistoryCompactor
+
+from tests.conftest import run
+
+
+def _turns(n: int) -> list[dict]:
+    out = []
+    for i in range(n):
+        out += [{"role": "user", "content": f"q{i}"}, {"role": "assistant", "content": f"a{i}"}]
+    return out
+
+
+def _compactor(idle_ttl_seconds: float) -> HistoryCompactor:
+    async def summarize(previous, messages):
+        return "summary of " + " ".join(m["content"] for m in messages)
+
+    return HistoryCompactor(summarize, token_budget=600, recent_turns=1, idle_ttl_seconds=idle_ttl_seconds)
+
+
+def test_summary_folds_aged_out_turns():
+    history = _compactor(idle_ttl_seconds=60.0)
+    run(history.update("s", _turns(3)))
+
+    view = history.view("s", _turns(3), "summary")
+    assert view.summary == "summary of q0 a0 q1 a1"
+    assert [m["content"] for m in view.messages] == ["q2", "a2"]
+
+
+def test_summary_expires_with_the_session():
+    history = _compactor(idle_ttl_seconds=0.05)
+    run(history.update("s", _turns(3)))
+    time.sleep(0.1)
+
+    # the memory backend dropped the idle session; a new one reuses the id
+    view = history.view("s", [{"role": "user", "content": "new"}], "summary")
+    assert view.summary == ""
+    assert "s" not in history._state
@@ -0,0 +1,104 @@
+import os
+import time
+
+from app.services.index_store import META_FILE, RETIRED_FILE, IndexStore
+
+
+def _publish(store: IndexStore, base: str = "", payload: str = "x") -> str:
+    staging = store.stage(base)
+    (staging / "data.bin").write_text(payload, encoding="utf-8")
+    return store.publish(staging, {"payload": payload})
+
+
+def _age(path, seconds: float) -> None:
+    t = time.time() - seconds
+    os.utime(path, (t, t))
+
+
+def test_publish_flips_current_and_retires_the_previous(tmp_path):
+    store = IndexStore(tmp_path / "index")
+    assert store.current() == ""
+
+    v1 = _publish(store, payload="one")
+    assert store.current() == v1
+    assert store.read_meta(v1)["payload"] == "one"
+    assert not (store.path(v1) / RETIRED_FILE).exists()
+
+    v2 = _publish(store, base=v1, payload="two")
+    assert store.current() == v2
+    assert (store.path(v1) / RETIRED_FILE).exists()
+    assert (store.path(v1) / "data.bin").read_text(encoding="utf-8") == "one"  # published versions stay as they were
+    assert not list(store.root.glob(".staging-*"))
+
+
+def test_stage_copies_the_base_without_its_meta(tmp_path):
+    store = IndexStore(tmp_path / "index")
+    v1 = _publish(store)
+    _publish(store, base=v1)
+
+    staging = store.stage(v1)
+    assert (staging / "data.bin").exists()
+    assert not (staging / META_FILE).exists()
+    assert not (staging / RETIRED_FILE).exists()
+    store.discard(staging)
+    assert not staging.exists()
+
+
+def test_gc_keeps_current_recent_and_leased_versions(tmp_path):
+    store = IndexStore(tmp_path / "index", lease_ttl=60.0)
+    old = _publish(store)
+    leased = _publish(store)
+    recent = _publish(store)
+    current = _publish(store)
+    _age(store.path(old) / RETIRED_FILE, 120)
+    _age(store.path(leased) / RETIRED_FILE, 120)
+    store.hold(leased)
+
+    assert store.collect_garbage() == [old]
+    assert {d.name for d in store.root.iterdir() if d.name.startswith("v")} == {leased, recent, current}
+
+    store.release(leased)
+    assert store.collect_garbage() == [leased]
+    assert store.current() == current
+
+
+def test_gc_drops_stale_leases_and_staging_leftovers(tmp_path):
+    store = IndexStore(tmp_path / "index", lease_ttl=60.0)
+    v1 = _publish(store)
+    _publish(store)
+    _age(store.path(v1) / RETIRED_FILE, 120)
+    store.hold(v1)
+    lease = next(store.leases_dir.iterdir())
+    _age(lease, 120)  # its process stopped heartbeating
+    crashed = store.stage()
+
+    assert store.collect_garbage() == [v1]
+    assert not lease.exists()
+    assert not crashed.exists()
+
+
+def test_gc_skipped_while_a_build_holds_the_lock(tmp_path):
+    store = IndexStore(tmp_path / "index", lease_ttl=60.0)
+    v1 = _publish(store)
+    _publish(store)
+    _age(store.path(v1) / RETIRED_FILE, 120)
+
+    with store.lock():
+        assert store.collect_garbage() == []
+    assert store.collect_garbage() == [v1]
+
+
+def test_linked_stage_shares_files_until_they_are_replaced(tmp_path):
+    store = IndexStore(tmp_path / "index")
+    v1 = _publish(store, payload="one")
+
+    staging = store.stage(v1, link=True)
+    assert (staging / "data.bin").stat().st_ino == (store.path(v1) / "data.bin").stat().st_ino
+
+    tmp = staging / "data.bin.tmp"
+    tmp.write_text("two", encoding="utf-8")
+    os.replace(tmp, staging / "data.bin")  # how the stores write
+    v2 = store.publish(staging, {})
+
+    assert (store.path(v1) / "data.bin").read_text(encoding="utf-8") == "one"
+    assert (store.path(v2) / "data.bin").read_text(encoding="utf-8") == "two"
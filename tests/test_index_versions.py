@@ -0,0 +1,115 @@
+import asyncio
+import shutil
+
+import pytest
+
+from app.core.config import settings
+from app.services import embeddings, rag
+from bench.stub_lm import hashed_embedding
+
+from tests.conftest import FakeLM, run, unit
+
+
+@pytest.fixture
+def knowledge(tmp_path, monkeypatch):
+    """Three knowledge files, a NumPy index in tmp storage; returns (knowledge dir, texts embedded so far)."""
+    root = tmp_path / "knowledge"
+    root.mkdir()
+    for i in range(3):
+        (root / f"doc{i}.txt").write_text(f"Document {i} talks about topic {i}.\n\n" * 20, encoding="utf-8")
+    for k, v in {
+        "STORAGE_DIR": str(tmp_path / "storage"), "KNOWLEDGE_DIR": str(root), "KNOWLEDGE_GLOB": "doc*.txt",
+        "VECTOR_BACKEND": "numpy", "EMBED_CACHE_ENABLED": False, "POLICY_PROMPT_ENABLED": False,
+    }.items():
+        monkeypatch.setattr(settings, k, v)
+    embedded: list[str] = []
+
+    def request(texts):
+        embedded.extend(texts)
+        return [hashed_embedding(t, 32) for t in texts]
+
+    monkeypatch.setattr(embeddings, "_request_embeddings", request)
+    return root, embedded
+
+
+def _to_legacy_layout(engine: rag.RAGEngine, version: str) -> None:
+    """Move a version's files to STORAGE_DIR itself, where indexes lived before index versions."""
+    storage = settings.storage_dir_path
+    for p in engine.store.path(version).iterdir():
+        if p.name not in ("version.json", "RETIRED"):
+            p.rename(storage / p.name)
+    shutil.rmtree(storage / "index")
+
+
+def test_legacy_index_becomes_the_first_version(knowledge):
+    _, embedded = knowledge
+    builder = rag.RAGEngine(speculative_retrieval=False)
+    _to_legacy_layout(builder, builder.build_index())
+    (settings.storage_dir_path / "0b9a4c3e-4f0e-4a59-9d6f-5e8b1c2d3a4f").mkdir()  # an orphaned Chroma segment
+    built = len(embedded)
+
+    engine = rag.RAGEngine(speculative_retrieval=False)
+    engine.initialize_db()
+
+    assert len(embedded) == built  # nothing re-embedded
+    assert sorted(p.name for p in settings.storage_dir_path.iterdir()) == ["index"]
+    assert engine._index.vdb.count() == engine.store.read_meta(engine.store.current())["chunks"] > 0
+    engine.close_index()
+
+
+def test_legacy_index_is_removed_when_a_version_exists(knowledge):
+    builder = rag.RAGEngine(speculative_retrieval=False)
+    current = builder.build_index()
+    for p in builder.store.path(current).glob("uniq_kb.*"):  # left behind by an older version
+        shutil.copy2(p, settings.storage_dir_path / p.name)
+    (settings.storage_dir_path / "chroma.sqlite3").write_bytes(b"")
+    (settings.storage_dir_path / "0b9a4c3e-4f0e-4a59-9d6f-5e8b1c2d3a4f").mkdir()
+
+    engine = rag.RAGEngine(speculative_retrieval=False)
+    engine.initialize_db()
+
+    assert sorted(p.name for p in settings.storage_dir_path.iterdir()) == ["index"]
+    assert engine.store.current() == current
+    engine.close_index()
+
+
+def test_linked_rebuild_leaves_the_old_version_intact(knowledge):
+    root, _ = knowledge
+    engine = rag.RAGEngine(speculative_retrieval=False)
+    v1 = engine.build_index()
+    (root / "doc2.txt").write_text("Document 2 now talks about something else.", encoding="utf-8")
+    v2 = engine.build_index()
+
+    old, new = engine.store.path(v1), engine.store.path(v2)
+    manifest = "uniq_kb.manifest.json"
+    assert (new / manifest).stat().st_ino != (old / manifest).stat().st_ino  # rewritten, not shared
+    assert "doc2.txt" in (old / manifest).read_text(encoding="utf-8")
+    counts = []
+    for version in (v1, v2):
+        vdb = rag.RAGEngine._open_vector_store(engine.store.path(version))
+        counts.append(vdb.count())
+        assert counts[-1] == engine.store.read_meta(version)["chunks"]
+        vdb.close()
+    assert counts[0] == counts[1] + 1  # doc2 went from two chunks to one
+
+
+def test_watch_index_skips_the_stamp_check_without_an_open_index(make_engine, monkeypatch, capsys):
+    engine = make_engine({"a": unit(1, 0)}, lambda t: unit(1, 0), FakeLM(lambda call: ""))
+    engine._index = None  # close_index running, or nothing published yet
+    rebuilds = []
+
+    async def reindex(**kw):
+        rebuilds.append(kw)
+
+    monkeypatch.setattr(engine, "poll_index", lambda: None)
+    monkeypatch.setattr(engine, "_knowledge_stamp", lambda: "changed")
+    monkeypatch.setattr(engine, "reindex", reindex)
+
+    async def main():
+        task = asyncio.create_task(engine.watch_index(0.001, knowledge_interval=0.001))
+        await asyncio.sleep(0.05)
+        task.cancel()
+
+    run(main())
+    assert "INDEX WATCH FAILED" not in capsys.readouterr().out
+    assert rebuilds == []
@@ -0,0 +1,66 @@
+import functools
+
+from app.services.chunking import chunk_text
+from app.services.indexing import sync_index
+from app.services.lexical import BM25Index
+from app.services.manifest import IndexManifest
+from app.services.numpy_store import NumpyVectorDB
+from bench.stub_lm import hashed_embedding
+
+
+class CountingEmbedder:
+    def __init__(self):
+        self.texts = 0
+
+    def __call__(self, texts):
+        self.texts += len(texts)
+        return [hashed_embedding(t, 32) for t in texts]
+
+
+def _sync(path, files, embed, lexical=None):
+    vdb = NumpyVectorDB(str(path))
+    stats = sync_index(
+        vdb,
+        files.items(),
+        chunker=functools.partial(chunk_text, chunk_size=120, overlap=20),
+        manifest_path=path / "uniq_kb.manifest.json",
+        fingerprint={"test": 1},
+        batch_size=4,
+        lexical=lexical,
+        embed=embed,
+    )
+    return vdb, stats
+
+
+def _paragraphs(name, n):
+    return "\n\n".join(f"{name} paragraph {i} has some words about course {i}." for i in range(n))
+
+
+def test_sync_embeds_only_changes_and_commits_once(tmp_path):
+    files = {"a.txt": _paragraphs("alpha", 12), "b.txt": _paragraphs("beta", 6)}
+    embed = CountingEmbedder()
+    vdb, first = _sync(tmp_path, files, embed)
+
+    assert first.rebuilt and first.embedded == first.chunks == embed.texts
+    assert not (tmp_path / "uniq_kb.staged.f32").exists()  # flushed before the manifest was saved
+    assert IndexManifest.load(tmp_path / "uniq_kb.manifest.json").chunk_count == vdb.count()
+    vdb.close()
+
+    files["b.txt"] = _paragraphs("beta", 2)  # shrinks: chunks deleted, none re-embedded
+    embed = CountingEmbedder()
+    vdb, second = _sync(tmp_path, files, embed)
+
+    assert not second.rebuilt
+    assert embed.texts == second.embedded
+    assert second.deleted > 0
+    assert vdb.count() == second.chunks
+    sources = {c.source for c in vdb.get_chunks(sorted(IndexManifest.load(tmp_path / "uniq_kb.manifest.json").files["b.txt"].chunks))}
+    assert sources == {"b.txt"}
+
+
+def test_lexical_index_follows_the_sync(tmp_path):
+    lexical = BM25Index()
+    vdb, stats = _sync(tmp_path, {"a.txt": _paragraphs("alpha", 8)}, CountingEmbedder(), lexical)
+
+    assert lexical.version == stats.version
+    assert lexical.search("alpha paragraph 3", top_k=1)[0].key.startswith("a.txt::chunk::")
@@ -0,0 +1,102 @@
+import threading
+import time
+
+import pytest
+
+from app.services.memory import InProcessMemoryBackend, SlidingWindowMemory, SQLiteMemoryBackend, _approx_size
+
+from tests.conftest import run
+
+
+class _Recording:
+    """Wraps a backend, recording the thread each call runs on."""
+    def __init__(self, backend):
+        self.backend = backend
+        self.blocking = backend.blocking
+        self.threads: list[int] = []
+
+    def get(self, session_id):
+        self.threads.append(threading.get_ident())
+        return self.backend.get(session_id)
+
+    def append(self, session_id, msg, max_messages):
+        self.threads.append(threading.get_ident())
+        self.backend.append(session_id, msg, max_messages)
+
+    def stats(self):
+        return self.backend.stats()
+
+
+@pytest.mark.parametrize("kind", ["sqlite", "memory"])
+def test_async_calls_round_trip(tmp_path, kind):
+    backend = SQLiteMemoryBackend(tmp_path / "memory.sqlite3") if kind == "sqlite" else InProcessMemoryBackend()
+    recording = _Recording(backend)
+    memory = SlidingWindowMemory(max_turns=1, backend=recording)
+
+    async def main():
+        await memory.aadd_user("s", "q1")
+        await memory.aadd_assistant("s", "a1", {"chunks": ["c1"]})
+        await memory.aadd_user("s", "q2")
+        return threading.get_ident(), await memory.aget("s")
+
+    loop_thread, history = run(main())
+
+    assert history == [
+        {"role": "assistant", "content": "a1", "provenance": {"chunks": ["c1"]}},
+        {"role": "user", "content": "q2"},
+    ]
+    assert len(recording.threads) == 4
+    if kind == "sqlite":  # blocking: never on the event loop
+        assert all(t != loop_thread for t in recording.threads)
+    else:  # a dict lookup is not worth a thread hop
+        assert all(t == loop_thread for t in recording.threads)
+
+
+@pytest.mark.parametrize("kind", ["sqlite", "memory"])
+def test_append_after_ttl_starts_a_new_session(tmp_path, kind):
+    if kind == "sqlite":
+        backend = SQLiteMemoryBackend(tmp_path / "memory.sqlite3", idle_ttl_seconds=0.05)
+    else:
+        backend = InProcessMemoryBackend(idle_ttl_seconds=0.05)
+    memory = SlidingWindowMemory(max_turns=5, backend=backend)
+
+    memory.add_user("s", "old secret")
+    time.sleep(0.1)
+    memory.add_user("s", "new")  # as /chat does: append before the first read
+    assert memory.get("s") == [{"role": "user", "content": "new"}]
+
+
+@pytest.mark.parametrize("kind", ["sqlite", "memory"])
+def test_append_within_ttl_keeps_history(tmp_path, kind):
+    if kind == "sqlite":
+        backend = SQLiteMemoryBackend(tmp_path / "memory.sqlite3", idle_ttl_seconds=60.0)
+    else:
+        backend = InProcessMemoryBackend(idle_ttl_seconds=60.0)
+    memory = SlidingWindowMemory(max_turns=5, backend=backend)
+
+    memory.add_user("s", "q1")
+    memory.add_user("s", "q2")
+    assert [m["content"] for m in memory.get("s")] == ["q1", "q2"]
+
+
+def test_in_process_stats_track_appends_and_evictions():
+    backend = InProcessMemoryBackend(max_sessions=2)
+    memory = SlidingWindowMemory(max_turns=1, backend=backend)  # 2 messages per session
+
+    def walked():  # what stats() used to compute by walking every message
+        msgs = [m for s in backend._sessions.values() for m in s.messages]
+        return len(msgs), sum(_approx_size(m) for m in msgs)
+
+    memory.add_user("a", "q1")
+    memory.add_assistant("a", "a1", {"chunks": ["c1"]})
+    memory.add_user("a", "a much longer question that pushes out the first one")
+    stats = backend.stats()
+    assert (stats["messages"], stats["approx_bytes"]) == walked()
+    assert stats["messages"] == 2
+
+    memory.add_user("b", "q")
+    memory.add_user("c", "q")  # evicts "a"
+
+    stats = backend.stats()
+    assert (stats["sessions"], stats["evicted"]) == (2, 1)
+    assert (stats["messages"], stats["approx_bytes"]) == walked() == (2, 2 * _approx_size(("user", "q")))
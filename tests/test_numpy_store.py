@@ -0,0 +1,78 @@
+import numpy as np
+import pytest
+
+from app.services.chunking import Chunk
+from app.services.numpy_store import NumpyVectorDB
+from app.services.vectorstore import chunk_key
+
+DIM = 16
+
+
+def _chunks(ids, tag=""):
+    return [Chunk(source="kb.txt", chunk_id=i, text=f"chunk {i}{tag}", start=0, end=8) for i in ids]
+
+
+def _vectors(ids, seed=0):
+    rng = np.random.default_rng(seed)
+    return {i: rng.standard_normal(DIM).astype(np.float32) for i in ids}
+
+
+def _open(path, **options):
+    return NumpyVectorDB(str(path), **options)
+
+
+@pytest.mark.parametrize("options", [
+    {},
+    {"quantization": "int8"},
+    {"first_stage_dim": 8, "first_stage_quantization": "binary", "candidates": 4},
+])
+def test_staged_writes_match_a_full_rewrite(tmp_path, options):
+    db = _open(tmp_path, **options)
+    first = _vectors(range(10))
+    for batch in (range(0, 4), range(4, 10)):
+        db.upsert(_chunks(batch), [first[i] for i in batch])
+    db.delete([chunk_key(c) for c in _chunks([2, 7])])
+    changed = _vectors([3], seed=1)
+    db.upsert(_chunks([3], " v2"), [changed[3]])
+    db.upsert(_chunks([10]), [_vectors([10], seed=2)[10]])
+
+    assert db.count() == 9
+    assert db.get_chunks([chunk_key(c) for c in _chunks([2, 3])]) == [None, _chunks([3], " v2")[0]]
+
+    hit = db.query(changed[3].tolist(), top_k=1)[0]
+    assert hit.chunk.text == "chunk 3 v2"
+    assert hit.similarity == pytest.approx(1.0, abs=0.02)
+
+    db.close()
+    reopened = _open(tmp_path, **options)
+    assert reopened.count() == 9
+    assert sorted(h.chunk.chunk_id for h in reopened.query(first[0].tolist(), top_k=20)) == [0, 1, 3, 4, 5, 6, 8, 9, 10]
+    assert not (tmp_path / "uniq_kb.staged.f32").exists()
+
+
+def test_batches_append_without_rewriting_the_index(tmp_path):
+    db = _open(tmp_path)
+    vectors = _vectors(range(6))
+    db.upsert(_chunks(range(3)), [vectors[i] for i in range(3)])
+    db.flush()
+    written = (tmp_path / "uniq_kb.vectors.npy").stat().st_mtime_ns
+
+    db.upsert(_chunks(range(3, 6)), [vectors[i] for i in range(3, 6)])
+    assert (tmp_path / "uniq_kb.vectors.npy").stat().st_mtime_ns == written
+    assert db.count() == 6
+
+
+def test_unflushed_writes_are_dropped_on_reopen(tmp_path):
+    db = _open(tmp_path)
+    db.upsert(_chunks([0]), [_vectors([0])[0]])
+    db.flush()
+    db.upsert(_chunks([1]), [_vectors([1])[1]])  # never flushed (build interrupted)
+
+    assert _open(tmp_path).count() == 1
+
+
+def test_dimension_mismatch_is_rejected(tmp_path):
+    db = _open(tmp_path)
+    db.upsert(_chunks([0]), [np.ones(DIM, np.float32)])
+    with pytest.raises(ValueError):
+        db.upsert(_chunks([1]), [np.ones(DIM + 1, np.float32)])
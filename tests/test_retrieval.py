@@ -0,0 +1,79 @@
+import pytest
+
+from app.core.config import settings
+from app.services import rag
+from app.services.chunking import Chunk
+from app.services.lexical import BM25Index, LexicalHit, reciprocal_rank_fusion
+from app.services.vectorstore import SearchHit
+
+from tests.conftest import FakeLM, run, unit
+
+ANSWER = "Fees are listed in the brochure."
+
+
+def test_rrf_prefers_keys_found_by_both_rankings():
+    assert reciprocal_rank_fusion([["a", "b"], ["b", "c"]], k=60) == ["b", "a", "c"]
+
+
+def _engine(make_engine, lm):
+    # "fees" is close to the question; "brochure" is far off but shares a term with it
+    return make_engine(
+        {"Course fees: 20000.": unit(1, 0.5), "Ask for the brochure.": unit(-1, 1)},
+        embed=lambda text: unit(1, 0),
+        lm=lm,
+        MIN_SIMILARITY=0.35,
+    )
+
+
+def test_fuse_keeps_higher_score_in_fusion_order(make_engine):
+    engine = _engine(make_engine, FakeLM(lambda call: ANSWER))
+    fees, brochure = engine.vdb.query(unit(1, 0), top_k=2)
+    assert fees.similarity > 0.35 > brochure.similarity
+
+    lexical = [LexicalHit("kb.txt::chunk::1", 3.0, 0.25), LexicalHit("kb.txt::chunk::0", 1.0, 0.1)]
+    fused = engine._fuse([fees, brochure], lexical, top_k=2)
+
+    # both chunks are in both rankings at swapped ranks: tie, dense order first
+    assert [(h.chunk.chunk_id, round(h.similarity, 4)) for h in fused] == [
+        (0, round(fees.similarity, 4)),
+        (1, 0.25),
+    ]
+
+
+def test_gate_uses_best_similarity_not_first_fused_hit(make_engine, monkeypatch):
+    lm = FakeLM(lambda call: ANSWER)
+    engine = _engine(make_engine, lm)
+    fees, brochure = engine.vdb.query(unit(1, 0), top_k=2)
+
+    async def retrieve(q):
+        # a BM25-led hit with low coverage ranks first, the well-matching chunk second
+        return unit(1, 0), [SearchHit(brochure.chunk, 0.25), fees]
+
+    monkeypatch.setattr(engine, "_retrieve", retrieve)
+
+    assert run(engine.answer("what are the fees?")) == ANSWER
+    assert lm.calls[-1]["call_site"] == "answer"
+    assert "Course fees" in lm.calls[-1]["user_text"]
+
+
+@pytest.mark.parametrize("mode, passes", [(None, False), ("hybrid", True)])
+def test_gate_under_retrieval_mode(make_engine, mode, passes):
+    # "brochure" is the chunk's only term in the question but its embedding is far off:
+    # only hybrid lets BM25 coverage through MIN_SIMILARITY
+    lm = FakeLM(lambda call: ANSWER)
+    engine = make_engine(
+        {"Ask for the brochure.": unit(-1, 1)},
+        embed=lambda text: unit(1, 0),
+        lm=lm,
+        MIN_SIMILARITY=0.35,
+        **({"RETRIEVAL_MODE": mode} if mode else {}),
+    )
+    assert engine.retrieval_mode == (mode or settings.RETRIEVAL_MODE)
+    if mode is None:
+        assert settings.RETRIEVAL_MODE == "dense"  # existing deployments keep vector-only gating
+    lexical = BM25Index()
+    lexical.add([Chunk(source="kb.txt", chunk_id=0, text="Ask for the brochure.", start=0, end=21)])
+    engine._index = rag.IndexHandle("v1", engine.vdb, lexical, "v1")
+
+    run(engine.answer("brochure?"))
+    assert ("Ask for the brochure" in lm.calls[-1]["user_text"]) is passes